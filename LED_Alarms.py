@@ -0,0 +1,178 @@
+#LED_Alarms
+#
+#Alarm timers kept in a priority queue of absolute start times. The alarm
+#task sleeps until the earliest alarm is due instead of polling the clock,
+#and alarms can repeat every day or on chosen weekdays. Windows that end
+#after midnight wrap into the next day.
+
+import datetime
+import heapq
+import time
+
+from LED_Scheduler import wallTime
+
+DAY_NAMES = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+ALL_DAYS = frozenset(range(7))
+DAY_GROUPS = {
+    "daily": ALL_DAYS,
+    "weekdays": frozenset(range(5)),
+    "weekends": frozenset((5, 6)),
+}
+
+#longest to sleep before looking at the wall clock again, seconds
+max_wait = 300
+
+def parseTime(in_time):
+    #"hour:minute" in 24-hour format to minutes past midnight, -1 when invalid
+    split_time = in_time.split(":")
+    if len(split_time) != 2:
+        return -1
+    try:
+        hour = int(split_time[0])
+        minute = int(split_time[1])
+    except ValueError:
+        return -1
+    if hour < 0 or hour >= 24 or minute < 0 or minute >= 60:
+        return -1
+    return hour * 60 + minute
+
+def nextTime(minutes, now):
+    #seconds since 1970 of the first time after now the clock shows minutes past midnight
+    day = datetime.date.fromtimestamp(now)
+    hour, minute = divmod(minutes, 60)
+    for offset in range(3):
+        date = day + datetime.timedelta(days=offset)
+        moment = time.mktime((date.year, date.month, date.day, hour, minute, 0, 0, 0, -1))
+        if moment > now:
+            return moment
+    return None
+
+def parseDays(in_days):
+    #"mon,wed,fri", "weekdays", "weekends" or "daily" to a set of weekday numbers
+    in_days = in_days.strip().lower()
+    if not in_days:
+        return ALL_DAYS
+    if in_days in DAY_GROUPS:
+        return DAY_GROUPS[in_days]
+    days = set()
+    for name in in_days.split(","):
+        name = name.strip()[:3]
+        if name not in DAY_NAMES:
+            return None
+        days.add(DAY_NAMES.index(name))
+    return frozenset(days)
+
+def showDays(days):
+    for group in ("daily", "weekdays", "weekends"):
+        if days == DAY_GROUPS[group]:
+            return group
+    return ",".join(DAY_NAMES[day] for day in sorted(days))
+
+class Alarm:
+    def __init__(self, name, start, end, days=ALL_DAYS, once=False):
+        #times are parsed once here, firing only does arithmetic
+        self.name = name
+        self.start = parseTime(start)
+        self.end = parseTime(end)
+        if self.start < 0 or self.end < 0:
+            raise ValueError("alarm times must be hour:minute in 24-hour format")
+        if self.start == self.end:
+            raise ValueError("alarm start and end must differ")
+        if not days:
+            raise ValueError("alarm needs at least one day")
+        self.days = frozenset(days)
+        self.once = once
+        #end before start means the window runs past midnight
+        self.length = ((self.end - self.start) % (24 * 60)) * 60
+
+    def startTime(self):
+        return "%02d:%02d" % divmod(self.start, 60)
+
+    def endTime(self):
+        return "%02d:%02d" % divmod(self.end, 60)
+
+    def occurrence(self, now):
+        #start of the first window on a chosen day that has not ended by now
+        day = datetime.date.fromtimestamp(now) - datetime.timedelta(days=1)
+        hour, minute = divmod(self.start, 60)
+        for offset in range(9):
+            date = day + datetime.timedelta(days=offset)
+            if date.weekday() not in self.days:
+                continue
+            start = time.mktime((date.year, date.month, date.day, hour, minute, 0, 0, 0, -1))
+            if start + self.length > now:
+                return start
+        return None
+
+    def describe(self):
+        message = self.name + ": " + self.startTime() + " to " + self.endTime()
+        message += " " + showDays(self.days)
+        if self.once:
+            message += " once"
+        return message
+
+class AlarmQueue:
+    def __init__(self, changed=None):
+        #changed is called whenever the alarms or their next start change
+        self.changed = changed
+        #(start time, sequence, alarm), earliest first
+        self.heap = []
+        self.alarms = {}
+        self.sequence = 0
+
+    def notify(self):
+        if self.changed:
+            self.changed()
+
+    def push(self, alarm, now):
+        start = alarm.occurrence(now)
+        if start is not None:
+            self.sequence += 1
+            heapq.heappush(self.heap, (start, self.sequence, alarm))
+
+    def add(self, alarm):
+        self.alarms[alarm.name] = alarm
+        self.heap = [entry for entry in self.heap if entry[2].name != alarm.name]
+        heapq.heapify(self.heap)
+        self.push(alarm, wallTime())
+        self.notify()
+
+    def remove(self, name):
+        if self.alarms.pop(name, None) is None:
+            return False
+        self.heap = [entry for entry in self.heap if entry[2].name != name]
+        heapq.heapify(self.heap)
+        self.notify()
+        return True
+
+    def get(self, name):
+        return self.alarms.get(name)
+
+    def list(self):
+        return sorted(self.alarms.values(), key=lambda alarm: alarm.name)
+
+    def nextStart(self):
+        if not self.heap:
+            return None
+        return self.heap[0][0]
+
+    def timeout(self, now):
+        #how long to sleep before the next alarm is due, None when there is none
+        next_start = self.nextStart()
+        if next_start is None:
+            return None
+        return max(0, min(next_start - now, max_wait))
+
+    def popDue(self, now):
+        #returns (alarm, start time) of an alarm whose window is open, or None
+        while self.heap and self.heap[0][0] <= now:
+            start, _, alarm = heapq.heappop(self.heap)
+            if alarm.once:
+                del self.alarms[alarm.name]
+            else:
+                #the next window starts after this one has ended
+                self.push(alarm, start + alarm.length)
+            #windows that ran out while the alarm was off are skipped
+            if now < start + alarm.length:
+                return alarm, start
+        return None
@@ -0,0 +1,238 @@
+#LED_Audio
+#
+#Lights that follow sound. PCM is read from a WAV file, or from a pipe of
+#raw 16 bit mono, a block at a time. Every frame the blocks it covers are
+#windowed and run through one FFT call as rows of a single array, and the
+#energy of the bass, mids and treble, the sum of the bins in each band, is
+#taken with one matrix product. Each band is scaled against its own slowly
+#falling peak and drawn as red, green and blue at brightness +- flux.
+#
+#A regular file is read in step with the frames, one frame of sound per
+#frame, so it can be played on the simulator's virtual time. A pipe is read
+#by a thread into a few blocks of buffer, the oldest are dropped when the
+#frames fall behind so the light never trails the sound by more than that.
+
+import collections
+import os
+import select
+import threading
+import time
+import wave
+
+from LED_Effects import Effect, clamp
+
+#numpy does the FFTs, audio is not available without it
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#samples per FFT block, and the rate and blocks kept for a raw pipe
+audio_block = 1024
+audio_rate = 44100
+audio_buffer = 8
+#(low, high) Hz of the bands drawn as red, green and blue
+AUDIO_BANDS = ((20, 250), (250, 2000), (2000, 8000))
+#seconds for a band's peak to fall by half, and the quietest peak kept as a
+#part of the energy of a full scale sine, so hiss never shows as full level
+peak_release = 4.0
+peak_floor = 1e-4
+
+def toSamples(data, channels=1):
+    #little endian 16 bit PCM to mono float samples
+    samples = numpy.frombuffer(data[:len(data) - len(data) % (2 * channels)], dtype="<i2")
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return samples.astype(numpy.float32)
+
+class FileSource:
+    #a WAV file, or raw 16 bit mono PCM at audio_rate without a RIFF header
+    def __init__(self, path):
+        self.stream = open(path, "rb")
+        self.wave = None
+        self.channels = 1
+        try:
+            if self.stream.read(4) == b"RIFF":
+                self.stream.seek(0)
+                try:
+                    self.wave = wave.open(self.stream, "rb")
+                except (wave.Error, EOFError):
+                    raise ValueError(path + " is not a WAV file")
+                if self.wave.getsampwidth() != 2:
+                    raise ValueError("only 16 bit WAV is supported")
+                self.channels = self.wave.getnchannels()
+                self.rate = self.wave.getframerate()
+                self.frames = self.wave.getnframes()
+            else:
+                self.stream.seek(0)
+                self.rate = audio_rate
+                self.frames = os.path.getsize(path) // 2
+        except (OSError, ValueError):
+            self.stream.close()
+            raise
+
+    def read(self, count):
+        #up to count samples, fewer only at the end of the file
+        if self.wave:
+            return toSamples(self.wave.readframes(count), self.channels)
+        return toSamples(self.stream.read(count * 2))
+
+    def close(self):
+        if self.wave:
+            self.wave.close()
+        self.stream.close()
+
+class PipeSource:
+    #raw 16 bit mono PCM at audio_rate from a pipe, opened and read by the reader thread
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise OSError("no such pipe " + path)
+        self.path = path
+        self.rate = audio_rate
+        self.fd = None
+        self.closed = False
+
+    def open(self):
+        #waits for a writer like any pipe reader
+        self.fd = os.open(self.path, os.O_RDONLY)
+
+    def read(self, count):
+        #count samples, fewer at the end of the sound or once closed
+        data = b""
+        while len(data) < count * 2 and not self.closed:
+            #looks up every so often so closing never waits on a quiet pipe
+            ready, _, _ = select.select([self.fd], [], [], 0.5)
+            if ready:
+                chunk = os.read(self.fd, count * 2 - len(data))
+                if not chunk:
+                    break
+                data += chunk
+        return toSamples(data)
+
+    def close(self):
+        #the reader thread lets go of the pipe once it sees this
+        self.closed = True
+
+def openAudio(path):
+    #the source of path and whether it is a file to read in step with the frames,
+    #raises OSError or ValueError when it can't be played
+    if numpy is None:
+        raise ValueError("audio needs numpy")
+    if os.path.isfile(path):
+        return FileSource(path), True
+    return PipeSource(path), False
+
+class BandAnalyzer:
+    def __init__(self, rate, delay, block=None, bands=AUDIO_BANDS):
+        self.block = block or audio_block
+        self.window = numpy.hanning(self.block).astype(numpy.float32)
+        frequencies = numpy.fft.rfftfreq(self.block, 1.0 / rate)
+        #one row per band selecting its bins, energies are one product with it
+        self.masks = numpy.array([(frequencies >= low) & (frequencies < high) for low, high in bands],
+                                 dtype=numpy.float32).T
+        self.floor = peak_floor * (32768 * self.window.sum() / 2) ** 2
+        self.peaks = numpy.full(len(bands), self.floor, dtype=numpy.float32)
+        self.release = 0.5 ** (delay / peak_release)
+
+    def levels(self, blocks):
+        #level 0 to 1 of each band over blocks, an array with a block of samples per row
+        spectrum = numpy.fft.rfft(blocks * self.window, axis=1)
+        energy = (spectrum.real ** 2 + spectrum.imag ** 2).dot(self.masks).mean(axis=0)
+        self.peaks = numpy.maximum(self.peaks * self.release, numpy.maximum(energy, self.floor))
+        return numpy.sqrt(energy / self.peaks)
+
+class AudioEffect(Effect):
+    #bands worked out when a frame is asked for can't be drawn ahead
+    ahead = False
+
+    def __init__(self, path, delay, brightness, flux, scales):
+        self.path = path
+        self.source, self.paced = openAudio(path)
+        self.delay = delay
+        self.analyzer = BandAnalyzer(self.source.rate, delay)
+        self.setLevels(brightness, flux, scales)
+        #samples read so far, the frame drawn last and the levels it was drawn with
+        self.read = 0
+        self.shown = -1
+        self.levels = numpy.zeros(len(AUDIO_BANDS), dtype=numpy.float32)
+        #optional Histogram of LED_Metrics, seconds from reading sound to writing
+        #its frame, and when the sound of the frame last made was read
+        self.latency = None
+        self.captured = None
+        self.underruns = 0
+
+        if self.paced:
+            self.length = max(1, int(self.source.frames / (self.source.rate * delay)))
+            self.blocks = None
+        else:
+            #(time read, samples) of each block from the pipe, the oldest fall out when full
+            self.blocks = collections.deque(maxlen=audio_buffer)
+            self.reader = threading.Thread(target=self.readPipe, daemon=True)
+            self.reader.start()
+
+    def setLevels(self, brightness, flux, scales):
+        #brightness, flux and zone scales of every channel, red, green, blue of each zone
+        self.brightness = brightness
+        self.flux = flux
+        self.scales = scales
+
+    def readPipe(self):
+        block = self.analyzer.block
+        try:
+            self.source.open()
+            while True:
+                samples = self.source.read(block)
+                if len(samples) < block:
+                    break
+                self.blocks.append((time.monotonic(), samples))
+        except OSError:
+            pass
+        finally:
+            if self.source.fd is not None:
+                os.close(self.source.fd)
+        #end of the sound, the layer ends after the frame being drawn
+        self.length = self.shown + 2
+
+    def pending(self, i):
+        #blocks of sound for frame i and when they were read, None when there are none
+        block = self.analyzer.block
+        if self.paced:
+            wanted = int((i + 1) * self.delay * self.source.rate) - self.read
+            if wanted <= 0:
+                return None, None
+            samples = self.source.read(wanted)
+            self.read += wanted
+            read = time.monotonic()
+            #the latest blocks of one frame, sound of frames the renderer skipped is not analyzed
+            count = min(len(samples) // block, max(1, int(self.delay * self.source.rate) // block))
+            if not count:
+                return None, None
+            return samples[len(samples) - count * block:].reshape(count, block), read
+        taken = []
+        while self.blocks:
+            taken.append(self.blocks.popleft())
+        if not taken:
+            return None, None
+        self.read += len(taken) * block
+        return numpy.stack([samples for _, samples in taken]), taken[-1][0]
+
+    def frame(self, i):
+        self.shown = i
+        blocks, read = self.pending(i)
+        if blocks is None:
+            self.underruns += 1
+        else:
+            self.levels = self.analyzer.levels(blocks)
+            self.captured = read
+        color = [clamp(self.brightness + self.flux * (2 * level - 1)) for level in self.levels]
+        zone_count = len(self.scales) // 3
+        return tuple(clamp(value * scale) for value, scale in zip(color * zone_count, self.scales))
+
+    def drawn(self):
+        #called once the frame is written to the lights, only new sound is measured
+        if self.captured is not None and self.latency:
+            self.latency.observe(time.monotonic() - self.captured)
+        self.captured = None
+
+    def close(self):
+        self.source.close()
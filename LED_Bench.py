@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+#LED_Bench
+#
+#Benchmarks the light and alarm loops of LED_Main without a Pi. Frames are
+#paced by a virtual clock so every run goes as fast as the code allows, and
+#output goes to a FakeBackend where each zone has three channels of its own,
+#so 16 zones drive 48 channels as they would on a network node.
+#Prints a table, or JSON with --json, so results can be compared between
+#changes.
+#
+#usage: LED_Bench.py [--json] [--output file] [--quick]
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+import tracemalloc
+
+#headless runs use the stand-in when pigpio itself is not installed
+try:
+    import pigpio
+except ImportError:
+    import LED_FakePigpio as pigpio
+    sys.modules["pigpio"] = pigpio
+
+import LED_Frames
+import LED_Main
+import LED_Scheduler
+from LED_Output import FakeBackend, NETWORK_CHANNEL_LIMIT
+from LED_Zones import Zone
+
+ZONE_COUNTS = (1, 4, 8, 16)
+DURATIONS = (60, 600)
+CYCLES = (1, 10)
+
+class TimedClock(LED_Scheduler.VirtualClock):
+    #virtual clock that also notes the real time whenever a frame is done
+    def __init__(self):
+        LED_Scheduler.VirtualClock.__init__(self)
+        self.marks = []
+
+    def sleep(self, seconds):
+        self.marks.append(time.perf_counter())
+        LED_Scheduler.VirtualClock.sleep(self, seconds)
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def setupMain(zone_count, duration, cycles):
+    backend = FakeBackend()
+    #only counts are needed, the frames themselves are not kept
+    backend.keep_history = False
+    LED_Main.backend = backend
+    LED_Main.settings = LED_Main.settings.replace(duration=duration, cycles=cycles, brightness=100, flux=100)
+    LED_Main.zones = [Zone("z" + str(k), (k * 3, k * 3 + 1, k * 3 + 2), phase=k * 360 / zone_count,
+                           limit=NETWORK_CHANNEL_LIMIT)
+                      for k in range(zone_count)]
+    LED_Frames.clearTableCache()
+    return backend
+
+def runCase(name, make_run, zone_count, duration, cycles):
+    #timing pass
+    backend = setupMain(zone_count, duration, cycles)
+    clock = TimedClock()
+    LED_Scheduler.useClock(clock)
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    asyncio.run(make_run())
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    LED_Scheduler.useClock(None)
+    #every zone drew on channels no other zone shares
+    assert len(backend.duty) == zone_count * 3, "zones share channels"
+
+    #the first frame is shown without sleeping
+    frames = len(clock.marks) + 1
+    marks = [wall_start] + clock.marks
+    latencies = [(marks[k + 1] - marks[k]) * 1e6 for k in range(len(marks) - 1)]
+
+    #memory pass, kept apart so tracing does not skew the timings
+    setupMain(zone_count, duration, cycles)
+    LED_Scheduler.useClock(LED_Scheduler.VirtualClock())
+    tracemalloc.start()
+    asyncio.run(make_run())
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    LED_Scheduler.useClock(None)
+
+    return {
+        "case": name,
+        "zones": zone_count,
+        "duration": duration,
+        "cycles": cycles,
+        "frames": frames,
+        "frames_per_sec": frames / wall if wall else 0.0,
+        "latency_us_p50": percentile(latencies, 0.5),
+        "latency_us_p90": percentile(latencies, 0.9),
+        "latency_us_p99": percentile(latencies, 0.99),
+        "latency_us_max": max(latencies) if latencies else 0.0,
+        "backend_round_trips_per_frame": backend.submits / frames,
+        "backend_commands_per_frame": backend.writes / frames,
+        "cpu_sec_per_sim_minute": cpu / (duration / 60),
+        "peak_memory_kb": peak / 1024,
+    }
+
+async def benchLights():
+    LED_Main.startLightTask()
+    await LED_Main.render_task
+
+async def benchAlarm():
+    LED_Main.startAlarm(LED_Main.settings.duration)
+    await LED_Main.render_task
+
+def runBench(quick=False):
+    results = []
+    zone_counts = ZONE_COUNTS[:2] if quick else ZONE_COUNTS
+    durations = DURATIONS[:1] if quick else DURATIONS
+    for zone_count in zone_counts:
+        for duration in durations:
+            for cycles in CYCLES:
+                results.append(runCase("lights", benchLights, zone_count, duration, cycles))
+        for duration in durations:
+            results.append(runCase("alarm", benchAlarm, zone_count, duration, 1))
+    return results
+
+def showResults(results):
+    columns = ("case", "zones", "duration", "cycles", "frames_per_sec", "latency_us_p50",
+               "latency_us_p99", "backend_round_trips_per_frame", "backend_commands_per_frame",
+               "cpu_sec_per_sim_minute", "peak_memory_kb")
+    print ("\t".join(columns))
+    for result in results:
+        row = []
+        for column in columns:
+            value = result[column]
+            if isinstance(value, float):
+                value = round(value, 3)
+            row.append(str(value))
+        print ("\t".join(row))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the LED render and output paths")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--output", help="also write the JSON results to this file")
+    parser.add_argument("--quick", action="store_true", help="only the smaller cases")
+    args = parser.parse_args()
+
+    results = runBench(args.quick)
+    report = {"python": sys.version.split()[0], "numpy": LED_Frames.numpy is not None, "results": results}
+    if args.json:
+        print (json.dumps(report, indent=2))
+    else:
+        showResults(results)
+    if args.output:
+        with open(args.output, "w") as outfile:
+            json.dump(report, outfile, indent=2)
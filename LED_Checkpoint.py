@@ -0,0 +1,128 @@
+#LED_Checkpoint
+#
+#Where the lights were, kept in a small binary file so a restart carries on
+#from the same frame instead of starting over. The playback state is written
+#once a second into one of two fixed slots in turn, each with a sequence
+#number and a checksum. A write is a single pwrite with no fsync, the kernel
+#gets it to disk when it would anyway. A write torn by a power cut only
+#spoils its own slot and the other one is read instead, and as every state
+#holds the wall time it was taken at, an older one still tells where the
+#lights are now.
+
+import os
+import struct
+import zlib
+
+CHECKPOINT_MAGIC = b"LEDSTATE"
+CHECKPOINT_VERSION = 2
+#magic, version, flags, sequence, wall time, light frames played, light phase,
+#light duration, cycles, brightness and flux, alarm window start and end, show
+#frame, show path length, then the show path
+CHECKPOINT_HEADER = struct.Struct("<8sHHIdQdIIHHddQH")
+#bytes of each slot, the last four are the checksum of the rest
+CHECKPOINT_SLOT = 512
+CHECKSUM = struct.Struct("<I")
+PATH_LIMIT = CHECKPOINT_SLOT - CHECKPOINT_HEADER.size - CHECKSUM.size
+
+#what the flags say is in a state
+HAS_LIGHT = 1
+HAS_ALARM_TASK = 2
+HAS_ALARM = 4
+HAS_SHOW = 8
+
+class PlaybackState:
+    def __init__(self, written=0.0, light=None, alarm_task=False, alarm=None, show=None):
+        #written is the wall time the state was taken at, light (frames into the run,
+        #phase, duration, cycles, brightness, flux), alarm the (start, end) wall times
+        #of the pulse playing and show (path, frame), each None when it was not playing
+        self.written = written
+        self.light = light
+        self.alarm_task = alarm_task
+        self.alarm = alarm
+        self.show = show
+        self.sequence = 0
+
+    def active(self):
+        return bool(self.light or self.alarm_task or self.alarm or self.show)
+
+    def playing(self):
+        #something is drawn, so the state moves on with every frame
+        return bool(self.light or self.alarm or self.show)
+
+    def pack(self):
+        flags = 0
+        light_frame, light_phase, duration, cycles, brightness, flux = self.light or (0, 0.0, 0, 0, 0, 0)
+        alarm_start, alarm_end = self.alarm or (0.0, 0.0)
+        show_path, show_frame = self.show or ("", 0)
+        path = show_path.encode("utf-8")
+        if self.light:
+            flags |= HAS_LIGHT
+        if self.alarm_task:
+            flags |= HAS_ALARM_TASK
+        if self.alarm:
+            flags |= HAS_ALARM
+        if self.show and len(path) <= PATH_LIMIT:
+            flags |= HAS_SHOW
+        else:
+            path = b""
+        data = CHECKPOINT_HEADER.pack(CHECKPOINT_MAGIC, CHECKPOINT_VERSION, flags, self.sequence, self.written,
+                                      light_frame, light_phase, duration, cycles, brightness, flux,
+                                      alarm_start, alarm_end, show_frame, len(path)) + path
+        data += b"\0" * (CHECKPOINT_SLOT - CHECKSUM.size - len(data))
+        return data + CHECKSUM.pack(zlib.crc32(data))
+
+def unpackState(data):
+    #the state in one slot, None when it is empty, torn or from another version
+    if len(data) != CHECKPOINT_SLOT:
+        return None
+    if CHECKSUM.unpack_from(data, CHECKPOINT_SLOT - CHECKSUM.size)[0] != zlib.crc32(data[:-CHECKSUM.size]):
+        return None
+    (magic, version, flags, sequence, written, light_frame, light_phase, duration, cycles, brightness, flux,
+     alarm_start, alarm_end, show_frame, path_length) = CHECKPOINT_HEADER.unpack_from(data)
+    if magic != CHECKPOINT_MAGIC or version != CHECKPOINT_VERSION or path_length > PATH_LIMIT:
+        return None
+    state = PlaybackState(written)
+    state.sequence = sequence
+    if flags & HAS_LIGHT:
+        state.light = (light_frame, light_phase, duration, cycles, brightness, flux)
+    state.alarm_task = bool(flags & HAS_ALARM_TASK)
+    if flags & HAS_ALARM:
+        state.alarm = (alarm_start, alarm_end)
+    if flags & HAS_SHOW:
+        path = data[CHECKPOINT_HEADER.size:CHECKPOINT_HEADER.size + path_length]
+        state.show = (path.decode("utf-8", "replace"), show_frame)
+    return state
+
+def readCheckpoint(path):
+    #the newest whole state in the file, None when there is none
+    try:
+        with open(path, "rb") as state_file:
+            data = state_file.read(CHECKPOINT_SLOT * 2)
+    except OSError:
+        return None
+    states = [unpackState(data[slot * CHECKPOINT_SLOT:(slot + 1) * CHECKPOINT_SLOT]) for slot in range(2)]
+    states = [state for state in states if state]
+    if not states:
+        return None
+    return max(states, key=lambda state: state.sequence)
+
+class CheckpointFile:
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+        #newest state in the file, the next write goes to the other slot
+        self.last = readCheckpoint(path)
+        self.sequence = self.last.sequence if self.last else 0
+
+    def write(self, state):
+        #raises OSError when the file can't be opened or written
+        if self.fd is None:
+            self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.sequence = (self.sequence + 1) % (1 << 32)
+        state.sequence = self.sequence
+        os.pwrite(self.fd, state.pack(), (self.sequence % 2) * CHECKPOINT_SLOT)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
@@ -0,0 +1,321 @@
+#LED_Effects
+#
+#Effects are lazy frame sources, a frame is a tuple holding the red, green
+#and blue value of every zone in turn. Nothing is computed until a frame is
+#asked for by its index, so the renderer pulls exactly one frame per tick.
+#Stages wrap effects to scale or blend them, and Layers stacks effects by
+#priority so the alarm draws over the rainbow instead of fighting it.
+#
+#Every effect can also tell when its frame next changes, so the renderer can
+#sleep through the frames that would only repeat the last one, and Layers can
+#work frames out ahead for a backend that plays them on its own.
+
+import math
+
+def clamp(value):
+    return min(255, max(0, int(value)))
+
+class Effect:
+    #frames in the effect, None when it runs until removed
+    length = None
+    #false when a frame can only be made on its own tick, not worked out ahead
+    ahead = True
+
+    def frame(self, i):
+        raise NotImplementedError
+
+    def nextChange(self, i):
+        #first frame after i that may differ from frame i, None when none will
+        return i + 1
+
+    def frames(self):
+        #every frame in turn, for compiling or previewing an effect
+        i = 0
+        while self.length is None or i < self.length:
+            yield self.frame(i)
+            i += 1
+
+class Rainbow(Effect):
+    #plays a FrameTable of LED_Frames that may be only the rest of a longer run,
+    #starting phase radians into the cycle and offset frames after the run began
+    def __init__(self, table, phase=0.0, step=0.0, offset=0, settings=None):
+        self.table = table
+        self.length = table.length
+        self.phase = phase
+        #radians the rainbow moves each frame
+        self.step = step
+        self.offset = offset
+        #what the table was built from, to tell whether it needs rebuilding
+        self.settings = settings
+
+    def frame(self, i):
+        return self.table.frame(i)
+
+    def nextChange(self, i):
+        return self.table.nextChange(i)
+
+    def phaseAt(self, i):
+        return (self.phase + self.step * i) % (2 * math.pi)
+
+class Loop(Effect):
+    #plays an effect over and over until removed
+    def __init__(self, effect):
+        self.effect = effect
+
+    def frame(self, i):
+        return self.effect.frame(i % self.effect.length)
+
+    def nextChange(self, i):
+        #the wrap back to the first frame counts as a change
+        j = i % self.effect.length
+        return i + min(self.effect.nextChange(j), self.effect.length) - j
+
+class Static(Effect):
+    def __init__(self, values, length=None):
+        self.values = tuple(clamp(value) for value in values)
+        self.length = length
+
+    def frame(self, i):
+        return self.values
+
+    def nextChange(self, i):
+        return None
+
+class Fade(Effect):
+    #straight line from one frame to another
+    def __init__(self, start, end, length):
+        self.start = start
+        self.end = end
+        self.length = max(1, length)
+
+    def frame(self, i):
+        amount = min(1.0, i / max(1, self.length - 1))
+        return tuple(clamp(a + (b - a) * amount) for a, b in zip(self.start, self.end))
+
+    def nextChange(self, i):
+        #every channel only moves one way, so the first frame to differ is found by halving
+        values = self.frame(i)
+        low = i + 1
+        high = self.length
+        while low < high:
+            middle = (low + high) // 2
+            if self.frame(middle) != values:
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+class Pulse(Effect):
+    #color flashing on every zone, lit for the first half of each period
+    def __init__(self, color, peak, period, zone_count, length=None):
+        self.color = color
+        self.peak = peak
+        self.period = max(1, period)
+        self.zone_count = zone_count
+        self.length = length
+
+    def frame(self, i):
+        level = max(0.0, math.sin(2 * math.pi * i / self.period)) * self.peak
+        return tuple(clamp(level * part) for part in self.color) * self.zone_count
+
+class Chase(Effect):
+    #color stepping from zone to zone, one zone lit at a time
+    def __init__(self, color, zone_count, step, length=None):
+        self.color = tuple(clamp(part) for part in color)
+        self.zone_count = zone_count
+        self.step = max(1, step)
+        self.length = length
+
+    def frame(self, i):
+        lit = (i // self.step) % self.zone_count
+        off = (0, 0, 0)
+        return sum((self.color if zone == lit else off for zone in range(self.zone_count)), ())
+
+    def nextChange(self, i):
+        #a single zone stays lit
+        if self.zone_count < 2:
+            return None
+        return (i // self.step + 1) * self.step
+
+class Scale(Effect):
+    #multiplies every channel, by one factor or a factor per channel
+    def __init__(self, effect, factors):
+        self.effect = effect
+        self.length = effect.length
+        self.factors = factors
+
+    def frame(self, i):
+        values = self.effect.frame(i)
+        if isinstance(self.factors, (int, float)):
+            return tuple(clamp(value * self.factors) for value in values)
+        return tuple(clamp(value * factor) for value, factor in zip(values, self.factors))
+
+    def nextChange(self, i):
+        return self.effect.nextChange(i)
+
+class Blend(Effect):
+    #mix of two effects, amount 0 is all of the first and 1 all of the second
+    def __init__(self, first, second, amount):
+        self.first = first
+        self.second = second
+        self.amount = amount
+        if first.length is None:
+            self.length = second.length
+        elif second.length is None:
+            self.length = first.length
+        else:
+            self.length = min(first.length, second.length)
+
+    def frame(self, i):
+        return tuple(clamp(a + (b - a) * self.amount)
+                     for a, b in zip(self.first.frame(i), self.second.frame(i)))
+
+    def nextChange(self, i):
+        changes = [change for change in (self.first.nextChange(i), self.second.nextChange(i)) if change is not None]
+        return min(changes) if changes else None
+
+class Layer:
+    def __init__(self, effect, priority, opacity, ended):
+        self.effect = effect
+        self.priority = priority
+        self.opacity = opacity
+        self.ended = ended
+        #tick of the layer's first frame, set when it is first drawn
+        self.start = None
+        #index of the last frame drawn
+        self.shown = -1
+
+class Layers:
+    #named effects drawn by priority, the highest layer covers the ones below
+    def __init__(self, changed=None):
+        self.layers = {}
+        self.order = []
+        self.changed = changed
+        #optional function giving the tick showing now, for frames slept through or drawn ahead
+        self.now = None
+
+    def sort(self):
+        self.order = sorted(self.layers.values(), key=lambda layer: -layer.priority)
+
+    def add(self, name, effect, priority=0, opacity=1.0, ended=None, start=None):
+        #ended is called once the effect has played all its frames, start is the
+        #tick of its first frame, the tick it is first drawn on when None
+        layer = Layer(effect, priority, opacity, ended)
+        layer.start = start
+        self.layers[name] = layer
+        self.sort()
+        self.notify()
+
+    def replace(self, name, effect, restart=False):
+        #new effect for a layer that keeps its place, and its start tick unless
+        #restart makes the new effect begin at its first frame on the next tick
+        layer = self.layers.get(name)
+        if layer:
+            layer.effect = effect
+            if restart:
+                layer.start = None
+                layer.shown = -1
+            self.notify()
+
+    def remove(self, name):
+        if self.layers.pop(name, None) is not None:
+            self.sort()
+            self.notify()
+
+    def notify(self):
+        #tells whoever draws the layers that the next frame may differ
+        if self.changed:
+            self.changed()
+
+    def get(self, name):
+        layer = self.layers.get(name)
+        return layer.effect if layer else None
+
+    def nextFrame(self, name):
+        #index of the frame the layer draws next
+        layer = self.layers.get(name)
+        if not layer:
+            return 0
+        now = self.now() if self.now else None
+        if layer.start is not None and now is not None:
+            return max(layer.shown, now - layer.start) + 1
+        return layer.shown + 1
+
+    def active(self):
+        return len(self.layers) > 0
+
+    def nextChange(self, tick):
+        #first tick after this one whose composed frame may differ, None when none will
+        changes = []
+        covered = False
+        for layer in self.order:
+            if layer.start is None:
+                return tick + 1
+            #an ending layer changes the frame even when covered, and calls ended
+            if layer.effect.length is not None:
+                changes.append(layer.start + layer.effect.length)
+            if not covered:
+                change = layer.effect.nextChange(tick - layer.start)
+                if change is not None:
+                    changes.append(layer.start + change)
+                covered = layer.opacity >= 1.0
+        return min(changes) if changes else None
+
+    def ahead(self):
+        #true when every layer's frames can be worked out before their tick
+        return all(layer.effect.ahead for layer in self.order)
+
+    def nextEnd(self, tick):
+        #first tick from this one on that a drawn layer ends on, None when none will
+        ends = [layer.start + layer.effect.length for layer in self.order
+                if layer.start is not None and layer.effect.length is not None and
+                layer.start + layer.effect.length >= tick]
+        return min(ends) if ends else None
+
+    def peek(self, tick):
+        #the frame tick will compose to, worked out ahead without drawing it,
+        #layers not drawn yet start on tick
+        frames = []
+        for layer in self.order:
+            i = 0 if layer.start is None else tick - layer.start
+            if layer.effect.length is not None and i >= layer.effect.length:
+                continue
+            frames.append((layer.effect.frame(i), layer.opacity))
+            if layer.opacity >= 1.0:
+                break
+        return self.blend(frames)
+
+    def blend(self, frames):
+        #lower layers show through the ones above that are not opaque
+        if not frames:
+            return None
+        values, _ = frames[-1]
+        for upper, opacity in reversed(frames[:-1]):
+            values = tuple(clamp(a + (b - a) * opacity) for a, b in zip(values, upper))
+        return values
+
+    def frame(self, tick):
+        #the composed frame of this tick, None once every layer has ended
+        frames = []
+        finished = []
+        for layer in self.order:
+            if layer.start is None:
+                layer.start = tick
+            i = tick - layer.start
+            if layer.effect.length is not None and i >= layer.effect.length:
+                finished.append(layer)
+                continue
+            layer.shown = i
+            frames.append((layer.effect.frame(i), layer.opacity))
+            if layer.opacity >= 1.0:
+                break
+
+        for layer in finished:
+            for name, other in list(self.layers.items()):
+                if other is layer:
+                    del self.layers[name]
+            if layer.ended:
+                layer.ended()
+        if finished:
+            self.sort()
+        return self.blend(frames)
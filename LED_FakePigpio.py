@@ -0,0 +1,293 @@
+#LED_FakePigpio
+#
+#Stand-in for the parts of pigpio the project uses, for benchmarks and tests
+#on machines without a Pi or pigpiod. Commands go through a fake daemon
+#socket that speaks the pigpiod command format, so the pipelined path of
+#PigpioBackend runs against it too.
+#
+#Stored scripts are run by a small interpreter for the commands the playback
+#scripts of LED_Output use. Scripts run on the daemon's clock, whenever the
+#daemon is asked for anything it first plays every script up to now.
+
+import struct
+import threading
+import time
+
+#pigpiod command numbers this stand-in understands
+PI_CMD_PWM = 5
+PI_CMD_GDC = 83
+
+PI_BAD_USER_GPIO = -2
+PI_BAD_DUTYCYCLE = -8
+PI_BAD_SCRIPT = -47
+PI_BAD_SCRIPT_ID = -48
+PI_SCRIPT_NOT_READY = -62
+
+PI_SCRIPT_INITING = 0
+PI_SCRIPT_HALTED = 1
+PI_SCRIPT_RUNNING = 2
+PI_SCRIPT_WAITING = 3
+PI_SCRIPT_FAILED = 4
+
+#script commands this stand-in understands and how many arguments each takes
+SCRIPT_COMMANDS = {
+    "tag": 1, "ld": 2, "lda": 1, "sta": 1, "add": 1, "sub": 1, "tick": 0,
+    "jmp": 1, "jm": 1, "jz": 1, "jp": 1, "call": 1, "ret": 0,
+    "mils": 1, "mics": 1, "pwm": 2, "halt": 0,
+}
+
+class error(Exception):
+    pass
+
+def error_text(errnum):
+    return "pigpio error " + str(errnum)
+
+def int32(value):
+    #script arithmetic wraps like pigpiod's 32 bit ints
+    value &= 0xffffffff
+    return value - (1 << 32) if value & 0x80000000 else value
+
+class FakeScript:
+    def __init__(self, commands, tags):
+        self.commands = commands
+        self.tags = tags
+        self.status = PI_SCRIPT_HALTED
+        self.params = [0] * 10
+        self.variables = [0] * 150
+        self.position = 0
+        self.accumulator = 0
+        self.flag = 0
+        self.calls = []
+        #daemon time in microseconds the script runs its next command at
+        self.wake = 0
+
+    def value(self, argument):
+        if argument[0] == "p":
+            return self.params[int(argument[1:])]
+        if argument[0] == "v":
+            return self.variables[int(argument[1:])]
+        return int(argument)
+
+    def store(self, argument, value):
+        self.variables[int(argument[1:])] = int32(value)
+
+def parseScript(text):
+    #(command, arguments) of every command and the position of every tag,
+    #None when the script does not parse
+    words = text.split()
+    commands = []
+    tags = {}
+    i = 0
+    while i < len(words):
+        name = words[i].lower()
+        if name not in SCRIPT_COMMANDS:
+            return None
+        arguments = words[i + 1:i + 1 + SCRIPT_COMMANDS[name]]
+        if len(arguments) < SCRIPT_COMMANDS[name]:
+            return None
+        if name == "tag":
+            tags[int(arguments[0])] = len(commands)
+        else:
+            commands.append((name, arguments))
+        i += 1 + len(arguments)
+    return commands, tags
+
+class FakeDaemon:
+    #pin state and the number of commands and round trips it has served
+    def __init__(self):
+        self.duty = {}
+        self.commands = 0
+        self.round_trips = 0
+        #seconds the daemon's tick counts from, and the stored scripts by id
+        self.clock = time.monotonic
+        self.scripts = {}
+        self.next_script = 0
+        #duty cycles written by scripts, and (tick, pin, duty) of each when a list
+        self.script_writes = 0
+        self.log = None
+
+    def now(self):
+        return int(self.clock() * 1000000)
+
+    def tick(self):
+        return self.now() % (1 << 32)
+
+    def runScripts(self, until=None):
+        #plays every running script up to until, microseconds on the daemon's clock,
+        #always running the command that is due first so scripts interleave in time
+        until = self.now() if until is None else until
+        while True:
+            running = [script for script in self.scripts.values()
+                       if script.status == PI_SCRIPT_RUNNING and script.wake <= until]
+            if not running:
+                return
+            self.step(min(running, key=lambda script: script.wake))
+
+    def step(self, script):
+        if script.position >= len(script.commands):
+            script.status = PI_SCRIPT_HALTED
+            return
+        name, arguments = script.commands[script.position]
+        script.position += 1
+        try:
+            if name in ("jmp", "jm", "jz", "jp", "call"):
+                target = script.tags[int(arguments[0])]
+                if name == "call":
+                    script.calls.append(script.position)
+                if (name in ("jmp", "call") or (name == "jm" and script.flag < 0) or
+                        (name == "jz" and script.flag == 0) or (name == "jp" and script.flag >= 0)):
+                    script.position = target
+            elif name == "ret":
+                script.position = script.calls.pop()
+            elif name == "ld":
+                script.store(arguments[0], script.value(arguments[1]))
+            elif name == "lda":
+                script.accumulator = int32(script.value(arguments[0]))
+            elif name == "sta":
+                script.store(arguments[0], script.accumulator)
+            elif name in ("add", "sub"):
+                sign = 1 if name == "add" else -1
+                script.accumulator = int32(script.accumulator + sign * script.value(arguments[0]))
+                script.flag = script.accumulator
+            elif name == "tick":
+                script.accumulator = int32(script.wake)
+            elif name in ("mils", "mics"):
+                script.wake += script.value(arguments[0]) * (1000 if name == "mils" else 1)
+            elif name == "pwm":
+                gpio = script.value(arguments[0])
+                duty = script.value(arguments[1])
+                if gpio > 31 or duty > 255 or duty < 0:
+                    script.status = PI_SCRIPT_FAILED
+                    return
+                self.duty[gpio] = duty
+                self.script_writes += 1
+                if self.log is not None:
+                    self.log.append((script.wake % (1 << 32), gpio, duty))
+            elif name == "halt":
+                script.status = PI_SCRIPT_HALTED
+        except (KeyError, IndexError, ValueError):
+            script.status = PI_SCRIPT_FAILED
+
+    def storeScript(self, text):
+        parsed = parseScript(text.decode("latin-1") if isinstance(text, bytes) else text)
+        if parsed is None:
+            return PI_BAD_SCRIPT
+        script_id = self.next_script
+        self.next_script += 1
+        self.scripts[script_id] = FakeScript(*parsed)
+        return script_id
+
+    def runScript(self, script_id, params):
+        script = self.scripts.get(script_id)
+        if script is None:
+            return PI_BAD_SCRIPT_ID
+        if script.status == PI_SCRIPT_RUNNING:
+            return PI_SCRIPT_NOT_READY
+        for i, param in enumerate(params or []):
+            script.params[i] = int32(param)
+        script.position = 0
+        script.calls = []
+        script.wake = self.now()
+        script.status = PI_SCRIPT_RUNNING
+        return 0
+
+    def command(self, cmd, p1, p2):
+        self.commands += 1
+        self.runScripts()
+        if cmd == PI_CMD_PWM:
+            if p1 > 31:
+                return PI_BAD_USER_GPIO
+            if p2 > 255:
+                return PI_BAD_DUTYCYCLE
+            self.duty[p1] = p2
+            return 0
+        if cmd == PI_CMD_GDC:
+            return self.duty.get(p1, 0)
+        return 0
+
+class FakeSocket:
+    #answers every 16 byte command sent to it the way pigpiod would
+    def __init__(self, daemon):
+        self.daemon = daemon
+        self.replies = bytearray()
+
+    def sendall(self, data):
+        self.daemon.round_trips += 1
+        for offset in range(0, len(data), 16):
+            cmd, p1, p2, _ = struct.unpack_from("IIII", data, offset)
+            result = self.daemon.command(cmd, p1, p2)
+            self.replies += struct.pack("IIIi", cmd, p1, p2, result)
+
+    send = sendall
+
+    def recv(self, size):
+        reply = bytes(self.replies[:size])
+        del self.replies[:size]
+        return reply
+
+class FakeSockLock:
+    def __init__(self, daemon):
+        self.s = FakeSocket(daemon)
+        self.l = threading.Lock()
+
+class pi:
+    def __init__(self, host="localhost", port=8888):
+        self.connected = True
+        self.daemon = FakeDaemon()
+        self.sl = FakeSockLock(self.daemon)
+
+    def command(self, cmd, p1, p2):
+        #one round trip, like pigpio's own _pigpio_command
+        with self.sl.l:
+            self.sl.s.sendall(struct.pack("IIII", cmd, p1, p2, 0))
+            result = struct.unpack("12si", self.sl.s.recv(16))[1]
+        if result < 0:
+            raise error(error_text(result))
+        return result
+
+    def set_PWM_dutycycle(self, user_gpio, dutycycle):
+        return self.command(PI_CMD_PWM, user_gpio, int(dutycycle))
+
+    def get_PWM_dutycycle(self, user_gpio):
+        return self.command(PI_CMD_GDC, user_gpio, 0)
+
+    def script(self, call, *args):
+        #one round trip to the fake daemon for the script commands
+        with self.sl.l:
+            self.daemon.commands += 1
+            self.daemon.round_trips += 1
+            self.daemon.runScripts()
+            result = call(*args)
+        if isinstance(result, int) and result < 0:
+            raise error(error_text(result))
+        return result
+
+    def get_current_tick(self):
+        return self.script(self.daemon.tick)
+
+    def store_script(self, script):
+        return self.script(self.daemon.storeScript, script)
+
+    def run_script(self, script_id, params=None):
+        return self.script(self.daemon.runScript, script_id, params)
+
+    def script_status(self, script_id):
+        script = self.script(self.daemon.scripts.get, script_id)
+        if script is None:
+            raise error(error_text(PI_BAD_SCRIPT_ID))
+        return script.status, tuple(script.params)
+
+    def stop_script(self, script_id):
+        script = self.script(self.daemon.scripts.get, script_id)
+        if script is None:
+            raise error(error_text(PI_BAD_SCRIPT_ID))
+        script.status = PI_SCRIPT_HALTED
+        return 0
+
+    def delete_script(self, script_id):
+        if self.script(self.daemon.scripts.pop, script_id, None) is None:
+            raise error(error_text(PI_BAD_SCRIPT_ID))
+        return 0
+
+    def stop(self):
+        self.connected = False
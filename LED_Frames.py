@@ -0,0 +1,222 @@
+#LED_Frames
+#
+#Builds the rainbow sequence used by startLights and keeps the result as
+#uint8 frame tables, so playback is only an index lookup per frame. Every zone
+#adds three channels to the same table, so one pass covers all of them. A
+#table is built a chunk of frames at a time straight into its bytes, and a run
+#too long to keep whole is built a segment at a time as it plays, so a day
+#long light takes neither the memory nor the time of all its frames at once.
+#Tables are kept in a least recently used cache with a memory cap so repeat
+#runs and change commands reuse them.
+
+import bisect
+import math
+from array import array
+from collections import OrderedDict
+
+#numpy is optional, tables are built in pure python when it is missing
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#seperating the three sin curves with a phase shift
+RED_PHASE = 2 * math.pi * 1/3
+GRN_PHASE = 2 * math.pi * 2/3
+BLU_PHASE = 2 * math.pi * 0/3
+CHANNEL_PHASES = (RED_PHASE, GRN_PHASE, BLU_PHASE)
+
+#a zone is drawn from (effect, phase offset in degrees, brightness percent)
+ZONE_EFFECTS = ("rainbow", "static", "off")
+DEFAULT_ZONES = (("rainbow", 0, 100),)
+
+#most bytes the cached tables may hold before the oldest are dropped
+table_cache_limit = 4 * 1024 * 1024
+
+#frames worked out at once while building, bounds the floats held at a time
+build_chunk = 65536
+#runs of more frames than this are built a segment at a time as they play
+table_frame_limit = 18000
+segment_frames = 3000
+#segments each long run keeps built
+segment_cache = 3
+
+#(duration, cycles, brightness, flux, delay, zones, phase) -> FrameTable, oldest first
+table_cache = OrderedDict()
+table_cache_size = 0
+
+class FrameTable:
+    #one uint8 value per frame for each channel, red, green, blue of each zone in turn
+    def __init__(self, *channels):
+        self.channels = channels
+        self.red = channels[0]
+        self.green = channels[1]
+        self.blue = channels[2]
+        self.length = len(channels[0])
+        #frames that differ from the one before, found when first needed
+        self.changes = None
+
+    def frame(self, i):
+        return tuple(channel[i] for channel in self.channels)
+
+    def nextChange(self, i):
+        #first frame after i with a different value on any channel, length when none has
+        if self.changes is None:
+            self.changes = findChanges(self.channels, self.length)
+        k = bisect.bisect_right(self.changes, i)
+        if k < len(self.changes):
+            return self.changes[k]
+        return self.length
+
+    def scanChange(self, i, window):
+        #same as nextChange but reads at most window frames after i and keeps no
+        #index, for tables too long to index, i + window + 1 when none of those differ
+        if i + 1 >= self.length:
+            return self.length
+        change = min(self.length, i + window + 1)
+        for channel in self.channels:
+            #the run of frames repeating this channel's value is stripped off in one call
+            rest = bytes(channel[i + 1:change]).lstrip(bytes((channel[i],)))
+            change -= len(rest)
+        return change
+
+    def size(self):
+        return len(self.channels) * self.length
+
+class SegmentTable:
+    #same frames as a FrameTable of the whole run, built segment_frames at a time
+    #when first drawn, only the segments last used are kept
+    def __init__(self, curves, frequency, length):
+        self.curves = curves
+        self.frequency = frequency
+        self.length = length
+        #segment number -> FrameTable, oldest first
+        self.segments = OrderedDict()
+
+    def segment(self, k):
+        table = self.segments.get(k)
+        if table is not None:
+            self.segments.move_to_end(k)
+            return table
+        start = k * segment_frames
+        table = FrameTable(*buildChannels(self.curves, self.frequency, start, min(self.length, start + segment_frames)))
+        self.segments[k] = table
+        while len(self.segments) > segment_cache:
+            self.segments.popitem(last=False)
+        return table
+
+    def frame(self, i):
+        if i < 0 or i >= self.length:
+            raise IndexError("frame out of range")
+        k, j = divmod(i, segment_frames)
+        return self.segment(k).frame(j)
+
+    def nextChange(self, i):
+        #first change after i in this segment or the next, the end of the next
+        #when neither has one so no more than two segments are built to find it
+        k, j = divmod(i, segment_frames)
+        last = min(self.length, (k + 2) * segment_frames)
+        table = self.segment(k)
+        change = k * segment_frames + table.nextChange(j)
+        if change < min(self.length, (k + 1) * segment_frames) or change >= last:
+            return change
+        following = self.segment(k + 1)
+        if following.frame(0) != table.frame(table.length - 1):
+            return change
+        return (k + 1) * segment_frames + following.nextChange(0)
+
+    def size(self):
+        return len(self.curves) * min(self.length, segment_frames * segment_cache)
+
+def findChanges(channels, length):
+    #indexes of the frames whose values differ from the frame before
+    if numpy is not None:
+        values = numpy.array([numpy.frombuffer(channel, dtype=numpy.uint8) for channel in channels])
+        changed = numpy.flatnonzero(numpy.any(values[:, 1:] != values[:, :-1], axis=0)) + 1
+        return array("I", changed.astype(numpy.uint32).tobytes())
+    frames = list(zip(*channels))
+    return array("I", (i for i in range(1, length) if frames[i] != frames[i - 1]))
+
+def frameCount(duration, delay):
+    #converting duration to number of program loops
+    return max(1, int(round(duration/delay)))
+
+def channelCurves(brightness, flux, zones, phase=0.0):
+    #(phase, amplitude, offset) of the sine curve behind every channel
+    curves = []
+    for effect, zone_phase, scale in zones:
+        zone_phase = math.radians(zone_phase) + phase
+        scale = scale / 100
+        for channel_phase in CHANNEL_PHASES:
+            if effect == "rainbow":
+                curves.append((channel_phase + zone_phase, flux * scale, brightness * scale))
+            elif effect == "static":
+                curves.append((0, 0, brightness * scale))
+            else:
+                curves.append((0, 0, 0))
+    return curves
+
+def buildChannels(curves, frequency, start, end):
+    #the uint8 values of every curve for frames start to end
+    if numpy is not None:
+        steps = numpy.arange(start, end, dtype=numpy.float64) * frequency
+        phases, amplitudes, offsets = (numpy.array(column)[:, None] for column in zip(*curves))
+        values = numpy.sin(steps + phases) * amplitudes + offsets
+        table = numpy.clip(values, 0, 255).astype(numpy.uint8)
+        return [row.tobytes() for row in table]
+
+    channels = []
+    for phase, amplitude, offset in curves:
+        values = [math.sin(frequency*i + phase) * amplitude + offset for i in range(start, end)]
+        channels.append(bytes(min(255, max(0, int(value))) for value in values))
+    return channels
+
+def rainbowCurves(duration, cycles, brightness, flux, delay, zones, phase):
+    #phase is where in its cycle the rainbow starts, radians
+    length = frameCount(duration, delay)
+    #each color only repeats cycles times
+    frequency = (2 * math.pi)/(length/cycles)
+    return channelCurves(brightness, flux, zones, phase), frequency, length
+
+def buildRainbowTable(duration, cycles, brightness, flux, delay, zones=DEFAULT_ZONES, phase=0.0):
+    curves, frequency, length = rainbowCurves(duration, cycles, brightness, flux, delay, zones, phase)
+    if length <= build_chunk:
+        return FrameTable(*buildChannels(curves, frequency, 0, length))
+
+    channels = [bytearray() for curve in curves]
+    for start in range(0, length, build_chunk):
+        for channel, values in zip(channels, buildChannels(curves, frequency, start, min(length, start + build_chunk))):
+            channel += values
+    return FrameTable(*channels)
+
+def getRainbowTable(duration, cycles, brightness, flux, delay, zones=DEFAULT_ZONES, phase=0.0):
+    global table_cache_size
+
+    curves, frequency, length = rainbowCurves(duration, cycles, brightness, flux, delay, zones, phase)
+    if length > table_frame_limit:
+        #nothing is built until it is drawn, so there is nothing to cache
+        return SegmentTable(curves, frequency, length)
+
+    key = (duration, cycles, brightness, flux, delay, zones, phase)
+    table = table_cache.get(key)
+    if table is not None:
+        table_cache.move_to_end(key)
+        return table
+
+    table = buildRainbowTable(duration, cycles, brightness, flux, delay, zones, phase)
+    #tables larger than the whole cache are used once and not kept
+    if table.size() > table_cache_limit:
+        return table
+
+    table_cache[key] = table
+    table_cache_size += table.size()
+    while table_cache_size > table_cache_limit:
+        _, oldest = table_cache.popitem(last=False)
+        table_cache_size -= oldest.size()
+    return table
+
+def clearTableCache():
+    global table_cache_size
+
+    table_cache.clear()
+    table_cache_size = 0
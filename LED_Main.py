@@ -8,37 +8,93 @@
 #or read in from a config file
 
 import pigpio
-import math
 import time
+import math
+import asyncio
 import configparser
-from _thread import start_new_thread
+import argparse
+import os
+import sys
+from LED_Frames import getRainbowTable, frameCount
+from LED_Scheduler import FrameScheduler, wallTime
+from LED_Alarms import Alarm, AlarmQueue, parseDays, parseTime, nextTime, showDays, max_wait
+from LED_Output import PigpioBackend, ScriptBackend, E131Backend, ArtNetBackend, NETWORK_CHANNEL_LIMIT
+from LED_Zones import Zone, loadZone, saveZone, config_zone_prefix, GPIO_LIMIT
+from LED_Effects import Layers, Rainbow, Loop, Pulse, Scale, Static, Fade, Chase, Blend
+from LED_Server import ControlServer
+from LED_Show import Show
+from LED_Audio import AudioEffect
+from LED_Sync import SyncClock, SYNC_PORT
+from LED_Settings import Settings
+from LED_Checkpoint import CheckpointFile, PlaybackState
+from LED_Stream import FrameStream
+from LED_Watch import ConfigWatcher
+import LED_Metrics
     
 #gpio pins
 RED_PIN = 20
 GRN_PIN = 21
 BLU_PIN = 16
 
+#every strip driven by the light loop, the pins above unless zones are configured
+zones = [Zone("main", (RED_PIN, GRN_PIN, BLU_PIN))]
+default_zones = zones
+
 #true when running, false when closing/closed
 program_state = True
 
-#constant used when time.sleep is called to reduce cpu load or limit light change rate
+#constant used as the frame period of lights and alarm, seconds
 sleep_delay = .1
 
 #true when lights are running
 light_state = False
-#desired duration of lights, seconds
-light_duration = 600
-#how many times the lights will cycle accoss time
-light_cycles = 1
-#led brightness = brightness +- (0 to flux)
-light_brightness = 5
-light_flux = 10
-
 #true when alarm is running
 alarm_state = False
-#alarm start end value, will be "hour:minute" in 24-hour format
-alarm_start = ""
-alarm_end = ""
+
+#light and alarm settings, a read only snapshot that is replaced as a whole:
+#duration of lights in seconds, how many times the lights will cycle accoss
+#time, led brightness = brightness +- (0 to flux), and the alarm start and end
+#as "hour:minute" in 24-hour format
+settings = Settings(duration=600, cycles=1, brightness=5, flux=10)
+#every alarm by name, the start/end alarm above is kept under main_alarm_name
+alarm_queue = AlarmQueue()
+main_alarm_name = "alarm"
+
+#effects drawn by the render task, the alarm layer covers the light layer
+layers = Layers()
+light_priority = 0
+effect_priority = 2
+audio_priority = 3
+show_priority = 5
+alarm_priority = 10
+
+#show file being played, drawn over the rainbow and under the alarm
+show = None
+#name of the effect started by start effect, drawn over the rainbow and under the audio
+effect_name = None
+effect_names = ("static", "fade", "chase", "blend")
+#sound the lights are following, drawn over the rainbow and under the show
+audio = None
+#frame scheduler of the latest render run, kept for its timing stats
+render_scheduler = None
+
+#asyncio tasks drawing the layers and waiting on alarms, None when stopped
+render_task = None
+alarm_task = None
+#true when something drawn changed since the render task last drew
+render_stale = False
+#(start, end) wall times of the alarm pulse being drawn
+alarm_window = None
+
+#where the lights are is written here every checkpoint_interval seconds and
+#played on from at startup, next to the config file when empty
+checkpoint_file_name = ""
+checkpoint_interval = 1.0
+#set whenever the alarms change so the alarm task recomputes its wait
+alarm_changed = None
+#set whenever a layer or the alarm task starts or stops, so the checkpoint task
+#only wakes while something plays
+playback_changed = None
 
 #config file name, along with seciton headers and values
 config_file_name = "/home/pi/Raspberry-Pi-LED-Project/LED_Main.ini"
@@ -47,7 +103,51 @@ config_alarm_end = "alarm_end"
 config_alarm_time = "alarm_time"
 config_light = "light"
 config_light_duration = "duration"
-confid_light_cycles = "cycles"
+config_light_cycles = "cycles"
+#extra alarms are sections named alarm:<name> holding start, end, days and once
+config_alarm_prefix = "alarm:"
+config_alarm_start_time = "start"
+config_alarm_end_time = "end"
+config_alarm_days = "days"
+config_alarm_once = "once"
+#where the metrics are served, host:port or a unix socket path, empty for off
+config_metrics = "metrics"
+config_metrics_listen = "listen"
+metrics_listen = ""
+#where the control server listens, host:port or a unix socket path, empty for off
+config_server = "server"
+config_server_listen = "listen"
+server_listen = ""
+
+#live frames and the preview page over HTTP, served when stream_listen is set
+config_stream = "stream"
+config_stream_listen = "listen"
+stream_listen = ""
+frame_stream = FrameStream()
+#true to pick up edits of the config file while running
+config_watch = True
+
+#output section, where frames go, read once at startup like the listen addresses
+config_output = "output"
+config_output_type = "type"
+config_output_host = "host"
+config_output_port = "port"
+config_output_universe = "universe"
+config_output_nodes = "nodes"
+config_output_chunk = "chunk"
+output_config = {}
+#type -> backend class, pigpio drives the gpio pins of this Pi and script has
+#pigpiod play them chunk frames at a time
+output_backends = {"e131": E131Backend, "artnet": ArtNetBackend}
+
+#sync section, nodes sharing a clock and epoch show the same frame, read once at startup
+config_sync = "sync"
+config_sync_role = "role"
+config_sync_host = "host"
+config_sync_port = "port"
+config_sync_epoch = "epoch"
+sync_config = {}
+sync_clock = None
 config_light_brightness = "brightness"
 config_light_flux = "flux"
 
@@ -58,74 +158,381 @@ def checkBrightness(brightness):
         return False
     return new_brightness >= 0 and new_brightness <= 255
 
-def checkFlux(flux):
+def wholeNumber(value):
+    #value as an int when it is one, otherwise as given for Settings to refuse by name
     try:
-        new_flux = int(flux)
-    except:
-        return False
-    return (light_brightness + new_flux) <= 255 and (light_brightness - new_flux) >= 0
+        return int(value)
+    except (TypeError, ValueError):
+        return value
 
-def checkDuration(duration):
-    try:
-        new_duration = int(duration)
-    except:
-        return False
-    return new_duration > 0
+def outputLimit(output):
+    #highest zone pin the configured output can drive
+    if output.get(config_output_type, "pigpio") in output_backends:
+        return NETWORK_CHANNEL_LIMIT
+    return GPIO_LIMIT
 
-def checkCycles(cycles):
-    try:
-        new_cycles = int(cycles)
-    except:
-        return False
-    return new_cycles > 0
+def makeBackend(output):
+    #the backend named by the output section, raises ValueError when it is not valid
+    global pi
+
+    output_type = output.get(config_output_type, "pigpio")
+    if output_type == "pigpio":
+        pi = pigpio.pi()
+        return PigpioBackend(pi)
+    if output_type == "script":
+        chunk = int(output.get(config_output_chunk, "100"))
+        if chunk <= 0:
+            raise ValueError("output chunk must be greater than zero")
+        pi = pigpio.pi()
+        return ScriptBackend(pi, chunk)
+    if output_type not in output_backends:
+        raise ValueError("unknown output type " + output_type)
+
+    #nodes is a list of universe=host for universes that go to their own node
+    nodes = {}
+    for node in output.get(config_output_nodes, "").split(","):
+        if node.strip():
+            universe, _, host = node.partition("=")
+            nodes[int(universe)] = host.strip()
+    options = {"nodes": nodes, "host": output.get(config_output_host, "")}
+    if config_output_port in output:
+        options["port"] = int(output[config_output_port])
+    if config_output_universe in output:
+        options["first_universe"] = int(output[config_output_universe])
+    return output_backends[output_type](**options)
 
 def checkRGB(r, g, b):
     return checkBrightness(r) and checkBrightness(g) and checkBrightness(b)
 
-def setLights(r, g, b):
-    if checkRGB(r, g, b):
-        pi.set_PWM_dutycycle(RED_PIN, r)
-        pi.set_PWM_dutycycle(GRN_PIN, g)
-        pi.set_PWM_dutycycle(BLU_PIN, b)
-    time.sleep(sleep_delay)
+def zonePins():
+    global zones
+
+    #pin of every channel, red, green, blue of each zone in turn
+    return [pin for zone in zones for pin in zone.pins]
+
+def zoneScales():
+    global zones
+
+    return [zone.brightness / 100 for zone in zones for pin in zone.pins]
+
+def lightSettings(snapshot):
+    return snapshot.light() + (tuple(zone.spec() for zone in zones),)
+
+def lightEffect(elapsed=0, phase=0.0, snapshot=None):
+    global zones
+
+    #the whole rainbow of every zone is precomputed, each frame is only a lookup
+    snapshot = snapshot or settings
+    built = lightSettings(snapshot)
+    specs = built[-1]
+    length = frameCount(snapshot.duration, sleep_delay)
+    step = 2 * math.pi * snapshot.cycles / length
+    if elapsed == 0 and phase == 0:
+        table = getRainbowTable(snapshot.duration, snapshot.cycles, snapshot.brightness, snapshot.flux, sleep_delay, specs)
+        return Rainbow(table, 0.0, step, 0, built)
+
+    #mid run only the frames left are built, starting from the phase already reached
+    remaining = max(1, length - elapsed)
+    table = getRainbowTable(remaining * sleep_delay, snapshot.cycles * remaining / length,
+                            snapshot.brightness, snapshot.flux, sleep_delay, specs, phase)
+    return Rainbow(table, phase, step, elapsed, built)
+
+def retimeLight(elapsed=None, snapshot=None):
+    #carries the running rainbow on from the frame it draws next with the new
+    #settings, elapsed frames into the run, the frames it has played by default
+    rainbow = layers.get("light")
+    if not rainbow:
+        return
+    position = layers.nextFrame("light")
+    if elapsed is None:
+        elapsed = rainbow.offset + position
+    layers.replace("light", lightEffect(elapsed, rainbow.phaseAt(position), snapshot), restart=True)
+
+def alarmEffect(length, snapshot=None):
+    global zones
+
+    #red light will flash once every second on every zone
+    snapshot = snapshot or settings
+    pulse = Pulse((1, 0, 0), snapshot.flux + snapshot.brightness, int(round(1/sleep_delay)), len(zones), length)
+    return Scale(pulse, zoneScales())
+
+def namedEffect(name, snapshot=None):
+    global zones
+
+    #every zone in white at brightness + flux: static holds it, fade rises to it
+    #from off over the light duration, chase steps it from zone to zone once a
+    #second and blend mixes that chase half and half with the rainbow
+    snapshot = snapshot or settings
+    peak = snapshot.brightness + snapshot.flux
+    white = (peak, peak, peak)
+    if name == "static":
+        effect = Static(white * len(zones))
+    elif name == "fade":
+        effect = Fade((0, 0, 0) * len(zones), white * len(zones), frameCount(snapshot.duration, sleep_delay))
+    elif name == "chase":
+        effect = Chase(white, len(zones), int(round(1/sleep_delay)))
+    else:
+        effect = Blend(lightEffect(snapshot=snapshot), Chase(white, len(zones), int(round(1/sleep_delay))), 0.5)
+    return Scale(effect, zoneScales())
+
+def makeSyncClock(sync):
+    #the shared clock of the sync section, None without one, raises ValueError when it is not valid
+    if not sync:
+        return None
+    return SyncClock(sync.get(config_sync_role, "follower"), sync.get(config_sync_host, ""),
+                     int(sync.get(config_sync_port, SYNC_PORT)), float(sync.get(config_sync_epoch, "0")))
+
+def refreshEffects(snapshot):
+    #rebuilt effects continue where they were, the rainbow from its current phase
+    rainbow = layers.get("light")
+    if rainbow and sync_clock:
+        #the loop stays where the shared clock puts it
+        if rainbow.effect.settings != lightSettings(snapshot):
+            layers.replace("light", Loop(lightEffect(snapshot=snapshot)))
+    elif rainbow and rainbow.settings != lightSettings(snapshot):
+        if rainbow.offset == 0 and rainbow.phase == 0 and rainbow.settings[:2] == (snapshot.duration, snapshot.cycles):
+            #same timing, the full table lines up frame for frame
+            layers.replace("light", lightEffect(snapshot=snapshot))
+        else:
+            retimeLight(snapshot=snapshot)
+    alarm = layers.get("alarm")
+    if alarm:
+        layers.replace("alarm", alarmEffect(alarm.length, snapshot))
+    if layers.get("effect"):
+        layers.replace("effect", namedEffect(effect_name, snapshot))
+    if audio:
+        audio.setLevels(snapshot.brightness, snapshot.flux, zoneScales())
+
+def clearLights():
+    backend.writeFrame([(pin, 0) for pin in zonePins()])
+
+async def queueChunk(start, pins):
+    #hands pigpiod the frames from start on, up to a chunk or the tick a layer
+    #ends on, which is left to the render task, returns the tick after the last one
+    end = start + backend.chunk
+    layer_end = layers.nextEnd(start)
+    if layer_end is not None:
+        end = min(end, layer_end)
+    if end <= start:
+        return start
+    frames = [layers.peek(i) for i in range(start, end)]
+    return start + await backend.queue(pins, frames, render_scheduler.deadline(start), sleep_delay,
+                                       render_scheduler.clock)
+
+def firstTick():
+    #tick the render task draws next, for layers carrying on from a frame
+    tick = renderTick()
+    if tick is not None:
+        return tick + 1
+    if sync_clock:
+        return max(0, int(math.ceil((sync_clock.now() - sync_clock.epoch) / sleep_delay)))
+    return 0
+
+def renderTick():
+    #tick showing now, None when the render task is not running
+    if render_task and render_scheduler:
+        return render_scheduler.current()
+    return None
+
+#render task, draws one composed frame of every layer per tick until no layer is left
+async def runRender():
+    global render_task
+    global render_scheduler
+    global render_stale
+    global zones
+
+    drawn = settings
+    render_zones = zones
+    pins = zonePins()
+    #with a backend that plays frames itself, the tick the render task planned to
+    #wake on and the tick after the last frame handed to it
+    chunked = hasattr(backend, "queue")
+    chunk_wake = None
+    queued = None
+    failed = False
+
+    #frames are paced against absolute deadlines so every effect keeps its duration
+    if sync_clock:
+        #ticks are frames since the shared epoch, the same on every node
+        render_scheduler = FrameScheduler(sleep_delay, clock=sync_clock.now, metrics=LED_Metrics.render_metrics,
+                                          epoch=sync_clock.epoch, max_idle=backend.max_idle)
+    else:
+        render_scheduler = FrameScheduler(sleep_delay, metrics=LED_Metrics.render_metrics, max_idle=backend.max_idle)
+    try:
+        async for tick in render_scheduler.asyncFrames(None):
+            #one snapshot per frame, when it or the zones changed mid run the effects
+            #carry on from the same frame with every new value at once
+            snapshot = settings
+            if snapshot is not drawn or render_zones is not zones:
+                if render_zones is not zones:
+                    backend.writeFrame([(pin, 0) for pin in pins])
+                    render_zones = zones
+                    pins = zonePins()
+                drawn = snapshot
+                refreshEffects(snapshot)
+
+            frame = layers.frame(tick)
+            if frame is None:
+                break
+            change = layers.nextChange(tick)
+            #while the stream has viewers frames are written one at a time, so each is published
+            if chunked and change is not None and layers.ahead() and not frame_stream.clients:
+                if tick != chunk_wake or render_stale or not backend.playing():
+                    #first frame, or something changed, what was handed over is stale
+                    backend.cancel()
+                    queued = tick
+                if queued <= tick:
+                    queued = await queueChunk(tick, pins)
+                #the next chunk waits on pigpiod while this one plays, the render
+                #task wakes to hand over another once it starts
+                chunk_wake = queued
+                queued = await queueChunk(queued, pins)
+                render_scheduler.skipTo(chunk_wake)
+            else:
+                chunk_wake = None
+                backend.writeFrame(zip(pins, frame))
+                if audio:
+                    audio.drawn()
+                #frames that would write the same duty cycles again are slept through
+                render_scheduler.skipTo(change)
+            render_stale = False
+            if frame_stream.clients:
+                frame_stream.publish(tick, pins, frame)
+    except (OSError, pigpio.error) as error:
+        print ("Output failed, lights stopped: " + str(error))
+        failed = True
+    finally:
+        #however the task ends, even on an error from the backend, the next layer
+        #started gets a new one, unless a new one was started already
+        if render_task is asyncio.current_task():
+            render_task = None
+            LED_Metrics.render_metrics.running.set(0)
+    if failed:
+        #nothing can be drawn, everything playing is stopped so the state says so,
+        #the alarm task stays to try the output again at the next alarm
+        stopEffectTask()
+        stopShowTask()
+        stopAudioTask()
+        stopLayer("alarm")
+        stopLightTask()
+    else:
+        clearLights()
+
+def wakeRender():
+    #something drawn has changed, an idle render task draws it on the next frame
+    global render_stale
+
+    render_stale = True
+    if render_task and render_scheduler:
+        render_scheduler.wakeUp()
+
+layers.changed = wakeRender
+frame_stream.changed = wakeRender
+layers.now = renderTick
+
+def startLayer(name, effect, priority, ended=None, start=None):
+    global render_task
+
+    layers.add(name, effect, priority, ended=ended, start=start)
+    if playback_changed:
+        playback_changed.set()
+    if render_task is None:
+        render_task = asyncio.ensure_future(runRender())
+        LED_Metrics.render_metrics.running.set(1)
+
+def stopLayer(name):
+    global render_task
+
+    layers.remove(name)
+    #cancelled while waiting on its next frame, nothing is written after this
+    if not layers.active() and render_task:
+        render_task.cancel()
+        render_task = None
+        LED_Metrics.render_metrics.running.set(0)
+        clearLights()
 
-def startLights():
-    global program_state
-    global light_state
-    global light_duration
-    global light_cycles
-    global light_brightness
-    global light_flux
-
-    #converting duration to number of program loops
-    length = light_duration/sleep_delay
-    #each color only repeats light_cycles times
-    r_frequency = g_frequency = b_frequency = (2 * math.pi)/(length/light_cycles)
-    #seperating the three sin curves with a phase shift
-    r_phase = 2 * math.pi * 1/3
-    g_phase = 2 * math.pi * 2/3
-    b_phase = 2 * math.pi * 0/3
-    
-    for i in range(0, length):
-        if not light_state:
-            break
-        #three seperate sine curves create a rainbow effect
-        r = math.sin(r_frequency*i + r_phase) * light_flux + light_brightness
-        g = math.sin(g_frequency*i + g_phase) * light_flux + light_brightness
-        b = math.sin(b_frequency*i + b_phase) * light_flux + light_brightness
-        setLights(r, g, b)
-        
 def endLights():
     global light_state
-    
+
     light_state = False
-    setLights(0,0,0)
+
+def startLightTask(snapshot=None):
+    global light_state
+    global settings
+
+    #built before new settings are kept, a build that fails leaves the old ones
+    snapshot = snapshot or settings
+    if sync_clock:
+        #repeats until stopped, frame 0 of the first run was at the epoch
+        rainbow = Loop(lightEffect(snapshot=snapshot))
+        start = 0
+    else:
+        rainbow = lightEffect(snapshot=snapshot)
+        start = None
+    settings = snapshot
+    light_state = True
+    startLayer("light", rainbow, light_priority, endLights, start)
+
+def stopLightTask():
+    endLights()
+    stopLayer("light")
+
+def endShow():
+    global show
+
+    if show:
+        show.close()
+        show = None
+
+def startShowTask(new_show, start=None):
+    global show
+
+    show = new_show
+    startLayer("show", show, show_priority, endShow, start)
+
+def stopShowTask():
+    stopLayer("show")
+    endShow()
+
+def endEffect():
+    global effect_name
+
+    effect_name = None
+
+def startEffectTask(name):
+    global effect_name
+
+    effect = namedEffect(name)
+    effect_name = name
+    startLayer("effect", effect, effect_priority, endEffect)
+
+def stopEffectTask():
+    stopLayer("effect")
+    endEffect()
+
+def endAudio():
+    global audio
+
+    if audio:
+        audio.close()
+        audio = None
+
+def startAudioTask(new_audio):
+    global audio
+
+    audio = new_audio
+    audio.latency = LED_Metrics.audio_latency
+    startLayer("audio", audio, audio_priority, endAudio)
+
+def stopAudioTask():
+    stopLayer("audio")
+    endAudio()
 
 def calculateDifference(*times):
 	if not times or len(times) > 2:
 		return -1
 	if len(times) == 1:
-		time1 = time.strftime("%H:%M").split(":")
+		time1 = time.strftime("%H:%M", time.localtime(wallTime())).split(":")
 		start_hour = int(time1[0])
 		start_minute = int(time1[1])
 		time2 = times[0].split(":")
@@ -141,18 +548,11 @@ def calculateDifference(*times):
 	return (((end_hour - start_hour)*60 + (end_minute - start_minute))*60)
 
 def startAlarm(duration):
-    length = duration/sleep_delay
-    #red light will flash once every second
-    r_frequency = (2 * math.pi)/(length/duration)
-    
-    for i in range(0, length):
-        if not alarm_state:
-            break
-        r = math.sin(r_frequency*i) * (light_flux + light_brightness)
-        g = 0
-        b = 0
-        setLights(r, g, b)
-    
+    #pulse drawn over the rainbow for duration seconds
+    global alarm_window
+
+    alarm_window = (wallTime(), wallTime() + duration)
+    startLayer("alarm", alarmEffect(int(duration/sleep_delay)), alarm_priority)
 
 def checkValidTime(in_time):
     split_time = in_time.split(":")
@@ -180,35 +580,39 @@ def checkValidTime(in_time):
     return str_hour + ":" + str_minute
 
 def checkValidAlarm(start_time, end_time):
-    if checkValidTime(start_time) and checValidTime(end_time):
+    if checkValidTime(start_time) and checkValidTime(end_time):
         return calculateDifference(start_time, end_time) >= 0
     return False
 
 def checkAlarmSet():
-    global alarm_start
-    global alarm_end
-    
-    return alarm_start and alarm_end
+    global alarm_queue
+
+    return len(alarm_queue.list()) > 0
+
+def setMainAlarm():
+    global alarm_queue
+
+    #the alarm queue holds parsed copies, refresh it whenever start or end change
+    if settings.alarm_start and settings.alarm_end and settings.alarm_start != settings.alarm_end:
+        alarm_queue.add(Alarm(main_alarm_name, settings.alarm_start, settings.alarm_end))
+    else:
+        alarm_queue.remove(main_alarm_name)
 
 def showAlarm():
-    global alarm_start
-    global alarm_end
+    global alarm_queue
 
     message = "Alarm is not set"
     if checkAlarmSet():
-        message = "Alarm:\n"
-        message += "Start Time: " + alarm_start[0] + ":" + alarm_start[1] + "\n"
-        message += "End Time: " + alarm_end[0] + ":" + alarm_end[1]
+        message = "Alarm:"
+        for alarm in alarm_queue.list():
+            message += "\n" + alarm.describe()
+        next_start = alarm_queue.nextStart()
+        if next_start is not None:
+            message += "\nNext: " + time.strftime("%a %H:%M", time.localtime(next_start))
     
     return message
     
-def loadConfig():
-    global light_duration
-    global light_cycles
-    global light_brightness
-    global light_flux
-    global alarm_start
-    global alarm_end
+def readConfig():
     global config_file_name
     global config_alarm_start
     global config_alarm_end
@@ -218,62 +622,166 @@ def loadConfig():
     global config_light_cycles
     global config_light_brightness
     global config_light_flux
-    
+
+    #parses and checks the config file, returns the valid values by name or None
+    values = {}
     try:
         config = configparser.ConfigParser()
-        config.read(config_file_name)
-
-        new_light_duration = int(config[config_light][config_light_duration])
-        new_light_cycles = int(config[config_light][config_light_cycles])
-        new_light_brightness = int(config[config_light][config_light_brightness])
-        new_light_flux = int(config[config_light][config_light_flux])
-        new_alarm_start = config[config_alarm_start][config_alarm_time]
-        new_alarm_end = config[config_alarm_end][config_alarm_time]
-
-        valid = True
-        if not checkDuration(new_light_duration):
-            print ("Within Load, loaded light duration not valid: " + str(new_light_duration))
-            valid = False
-        if not checkCycles(new_light_cycles):
-            print ("Within Load, loaded light cycles not valid: " + str(new_light_cycles))
-            valid = False
-        if not checkBrightness(new_light_brightness):
-            print ("Within Load, loaded light brightness not valid: " + str(new_light_brightness))
-            valid = False
-        if not checkFlux(new_light_flux):
-            print ("Within Load, loaded light flux not valid: " + str(new_light_flux))
-            valid = False
-        if not checkValidTime(new_alarm_start):
-            print ("Within Load, loaded alarm start not valid: " + new_alarm_start)
-            valid = False
-        if not checkValidTime(new_alarm_end):
-            print ("Within Load, loaded alram end not valid: " + new_alarm_end)
-            valid = False
-        if valid:
-            light_duration = new_light_duration
-            light_cycles = new_light_cycles
-            light_brightness = new_light_brightness
-            light_flux = new_light_flux
-            alarm_start = checkValidTime(new_alarm_start)
-            alarm_end = checkValidTime(new_alarm_end)
+        if not config.read(config_file_name):
+            print ("Within Load, could not read " + config_file_name)
+            return None
+
+        #every setting in the file is checked by Settings on its own, a bad one is
+        #reported and skipped and the live value kept, one missing is left as it is
+        found = []
+        for section, key, name in ((config_light, config_light_duration, "duration"),
+                                   (config_light, config_light_cycles, "cycles"),
+                                   (config_light, config_light_brightness, "brightness"),
+                                   (config_light, config_light_flux, "flux"),
+                                   (config_alarm_start, config_alarm_time, "alarm_start"),
+                                   (config_alarm_end, config_alarm_time, "alarm_end")):
+            if not config.has_option(section, key):
+                continue
+            raw = config.get(section, key).strip()
+            if name.startswith("alarm"):
+                #an empty time is an alarm that is not set
+                value = (checkValidTime(raw) or raw) if raw else ""
+            else:
+                value = wholeNumber(raw)
+            found.append((name, raw, value))
+
+        snapshot = settings
+        #a second pass takes values refused only with the one before them, like a
+        #brightness that only fits with the flux read after it
+        for last_pass in (False, True):
+            refused = []
+            for name, raw, value in found:
+                try:
+                    snapshot = snapshot.replace(**{name: value})
+                except ValueError as error:
+                    refused.append((name, raw, value))
+                    if last_pass:
+                        print ("Within Load, skipped " + repr(raw) + ": " + str(error))
+            found = refused
+        values["settings"] = snapshot
+        values["valid"] = not found
+
+        #extra alarms, each one is checked on its own
+        values["alarms"] = {}
+        for section in config.sections():
+            if not section.startswith(config_alarm_prefix):
+                continue
+            name = section[len(config_alarm_prefix):]
+            days = parseDays(config[section].get(config_alarm_days, ""))
+            try:
+                if days is None:
+                    raise ValueError("invalid days")
+                values["alarms"][name] = Alarm(name, config[section][config_alarm_start_time],
+                                               config[section][config_alarm_end_time], days,
+                                               config[section].getboolean(config_alarm_once, False))
+            except (KeyError, ValueError):
+                print ("Within Load, loaded alarm not valid: " + name)
+
+        values["output"] = dict(config[config_output]) if config.has_section(config_output) else {}
+        values["sync"] = dict(config[config_sync]) if config.has_section(config_sync) else {}
+
+        #zones replace the default strip only when at least one is configured
+        values["zones"] = []
+        for section in config.sections():
+            if not section.startswith(config_zone_prefix):
+                continue
+            name = section[len(config_zone_prefix):]
+            try:
+                values["zones"].append(loadZone(name, config[section], outputLimit(values["output"])))
+            except (KeyError, ValueError):
+                print ("Within Load, loaded zone not valid: " + name)
+
+        values["metrics_listen"] = config.get(config_metrics, config_metrics_listen, fallback="")
+        values["server_listen"] = config.get(config_server, config_server_listen, fallback="")
+        values["stream_listen"] = config.get(config_stream, config_stream_listen, fallback="")
+        return values
 
     except configparser.Error:
         print ("Within Load, Config Parser had an error")
-        pass
     except ValueError:
         print ("Within Load, conversion error")
-        pass
     except:
         print ("Within Load, unknown error")
-        pass
+    return None
+
+def sameAlarm(first, second):
+    return (first.startTime() == second.startTime() and first.endTime() == second.endTime() and
+            first.days == second.days and first.once == second.once)
+
+def sameZones(first, second):
+    return ([(zone.name, zone.pins, zone.spec()) for zone in first] ==
+            [(zone.name, zone.pins, zone.spec()) for zone in second])
+
+def applyConfig(values):
+    global settings
+    global zones
+    global metrics_listen
+    global server_listen
+    global stream_listen
+    global output_config
+    global sync_config
+
+    #only values that differ from the live ones are set, returns their names
+    changed = []
+    if "settings" in values and values["settings"] != settings:
+        old = settings
+        #every changed value is swapped in at once
+        settings = values["settings"]
+        for name in ("duration", "cycles", "brightness", "flux"):
+            if getattr(settings, name) != getattr(old, name):
+                changed.append("light_" + name)
+        if (settings.alarm_start, settings.alarm_end) != (old.alarm_start, old.alarm_end):
+            setMainAlarm()
+            changed.append("alarm")
+
+    for name, alarm in values["alarms"].items():
+        live = alarm_queue.get(name)
+        if live is None or not sameAlarm(live, alarm):
+            alarm_queue.add(alarm)
+            changed.append("alarm:" + name)
+    for alarm in alarm_queue.list():
+        if alarm.name != main_alarm_name and alarm.name not in values["alarms"]:
+            alarm_queue.remove(alarm.name)
+            changed.append("alarm:" + alarm.name)
+
+    new_zones = values["zones"] or default_zones
+    if not sameZones(new_zones, zones):
+        zones = new_zones
+        changed.append("zones")
+
+    #read once at startup, the servers are not moved by a later load
+    metrics_listen = metrics_listen or values["metrics_listen"]
+    server_listen = server_listen or values["server_listen"]
+    stream_listen = stream_listen or values["stream_listen"]
+    output_config = output_config or values["output"]
+    sync_config = sync_config or values["sync"]
+    if changed:
+        wakeRender()
+    return changed
+
+def loadConfig():
+    values = readConfig()
+    if values is None:
+        return False
+    applyConfig(values)
+    return values["valid"]
+
+def reloadConfig():
+    #called by the config watcher once the file has changed on disk
+    values = readConfig()
+    if values is None:
+        return
+    changed = applyConfig(values)
+    if changed:
+        print ("Config reloaded, changed: " + ", ".join(changed))
 
 def saveConfig():
-    global light_duration
-    global light_cycles
-    global light_brightness
-    global light_flux
-    global alarm_start
-    global alarm_end
+    global zones
     global config_file_name
     global config_alarm_start
     global config_alarm_end
@@ -291,15 +799,44 @@ def saveConfig():
         config[config_alarm_end] = {}
         config[config_light] = {}
         
-        config[config_alarm_start][config_alarm_time] = alarm_start
-        config[config_alarm_end][config_alarm_time] = alarm_end
-        config[config_light][config_brightness] = str(light_duration)
-        config[config_light][config_light_duration] = str(light_cycles)
-        config[config_light][config_light_cycles] = str(light_brightness)
-        config[config_light][config_flux] = str(light_flux)
+        #one snapshot, so the file holds settings that were valid together
+        snapshot = settings
+        config[config_alarm_start][config_alarm_time] = snapshot.alarm_start
+        config[config_alarm_end][config_alarm_time] = snapshot.alarm_end
+        config[config_light][config_light_duration] = str(snapshot.duration)
+        config[config_light][config_light_cycles] = str(snapshot.cycles)
+        config[config_light][config_light_brightness] = str(snapshot.brightness)
+        config[config_light][config_light_flux] = str(snapshot.flux)
+
+        for alarm in alarm_queue.list():
+            if alarm.name == main_alarm_name:
+                continue
+            section = config_alarm_prefix + alarm.name
+            config[section] = {}
+            config[section][config_alarm_start_time] = alarm.startTime()
+            config[section][config_alarm_end_time] = alarm.endTime()
+            config[section][config_alarm_days] = showDays(alarm.days)
+            config[section][config_alarm_once] = str(alarm.once)
+
+        #the default strip is not a configured zone
+        if zones is not default_zones:
+            for zone in zones:
+                config[config_zone_prefix + zone.name] = saveZone(zone)
+
+        if metrics_listen:
+            config[config_metrics] = {config_metrics_listen: metrics_listen}
+        if server_listen:
+            config[config_server] = {config_server_listen: server_listen}
+        if stream_listen:
+            config[config_stream] = {config_stream_listen: stream_listen}
+        if output_config:
+            config[config_output] = output_config
+        if sync_config:
+            config[config_sync] = sync_config
 
         with open(config_file_name, "w") as configfile:
             config.write(configfile)
+        return True
 
     except configparser.Error:
         print ("Within Save, Config Parser had an error")
@@ -309,286 +846,627 @@ def saveConfig():
 
     except:
         print ("Within Save, unknown error")
+    return False
+
+#commands shared by the console and the control server, each returns (ok, message)
+def commandStartLight():
+    if light_state:
+        return False, "Invalid lights already on, see overview for status"
+    startLightTask()
+    return True, "Lights started"
+
+def commandStopLight():
+    if not light_state:
+        return False, "Invalid light already off, see overview for status"
+    stopLightTask()
+    return True, "Lights stopped"
+
+def commandStartAlarm():
+    if not checkAlarmSet():
+        return False, "Invalid alarm needs to be set, see start help or overview for status"
+    if alarm_state:
+        return False, "Invalid alarm already on, see overview for status"
+    startAlarmTask()
+    return True, "Alarm started"
+
+def commandStopAlarm():
+    if not alarm_state:
+        return False, "Invalid alarm already off, see overview for status"
+    stopAlarmTask()
+    return True, "Alarm stopped"
+
+def commandStartShow(path):
+    if show:
+        return False, "Invalid show already playing, see overview for status"
+    try:
+        new_show = Show(path)
+    except (OSError, ValueError):
+        return False, "Invalid show file " + path
+    if not new_show.matches(len(zonePins()), sleep_delay):
+        new_show.close()
+        return False, "Invalid show was compiled for other zones or another frame rate"
+    startShowTask(new_show)
+    return True, "Show started: " + path
+
+def commandStopShow():
+    if not show:
+        return False, "Invalid no show playing, see overview for status"
+    stopShowTask()
+    return True, "Show stopped"
+
+def commandStartEffect(name):
+    if name not in effect_names:
+        return False, "Invalid effect, must be one of " + ", ".join(effect_names)
+    if effect_name:
+        return False, "Invalid effect already playing, see overview for status"
+    startEffectTask(name)
+    return True, "Effect started: " + name
+
+def commandStopEffect():
+    if not effect_name:
+        return False, "Invalid no effect playing, see overview for status"
+    stopEffectTask()
+    return True, "Effect stopped"
 
-#main thread
-def runInput():
+def commandStartAudio(path):
+    if audio:
+        return False, "Invalid audio already playing, see overview for status"
+    try:
+        new_audio = AudioEffect(path, sleep_delay, settings.brightness, settings.flux, zoneScales())
+    except (OSError, ValueError) as error:
+        return False, "Invalid audio " + path + ": " + str(error)
+    startAudioTask(new_audio)
+    return True, "Audio started: " + path
+
+def commandStopAudio():
+    if not audio:
+        return False, "Invalid no audio playing, see overview for status"
+    stopAudioTask()
+    return True, "Audio stopped"
+
+def commandChangeLight(value):
+    global settings
+
+    #Input can be in time format, the end time it plays until
+    new_duration = wholeNumber(value)
+    if checkValidTime(value):
+        new_duration = calculateDifference(checkValidTime(value))
+    #Settings holds the one rule for every value, the config and server included
+    try:
+        snapshot = settings.replace(duration=new_duration)
+    except ValueError as error:
+        return False, "Invalid light duration, " + str(error)
+
+    #a running light keeps its colors and plays the new duration from now, in
+    #sync the render task rebuilds it where the shared clock puts it, the new
+    #rainbow is built before the new duration is kept
+    if light_state:
+        if not sync_clock:
+            retimeLight(0, snapshot)
+        settings = snapshot
+        wakeRender()
+    else:
+        startLightTask(snapshot)
+    return True, "Light's duration changed to: " + str(settings.duration)
+
+def commandChangeAlarm(start, end):
+    global settings
+
+    #an empty time would unset the alarm, here both must be times
+    try:
+        settings = settings.replace(alarm_start=checkValidTime(start) or start or "-",
+                                    alarm_end=checkValidTime(end) or end or "-")
+    except ValueError as error:
+        return False, "Invalid alarm, " + str(error)
+    setMainAlarm()
+    return True, showAlarm()
+
+def commandChangeBrightness(value):
+    global settings
+
+    #checked together with the flux it will be drawn with
+    try:
+        settings = settings.replace(brightness=wholeNumber(value))
+    except ValueError as error:
+        return False, "Invalid brightness, " + str(error)
+    wakeRender()
+    return True, "Light's brightness changed to: " + str(settings.brightness)
+
+def commandChangeFlux(value):
+    global settings
+
+    #checked together with the brightness it will be drawn with
+    try:
+        settings = settings.replace(flux=wholeNumber(value))
+    except ValueError as error:
+        return False, "Invalid flux, " + str(error)
+    wakeRender()
+    return True, "Light's flux changed to: " + str(settings.flux)
+
+def commandSave():
+    if saveConfig():
+        return True, "Saved"
+    return False, "Invalid save failed, see program output"
+
+def commandLoad():
+    if loadConfig():
+        return True, "Loaded"
+    #the values that were valid are loaded all the same
+    return False, "Invalid load, bad values were skipped, see program output"
+
+def overviewState():
+    return {
+        "program_state": program_state,
+        "light_state": light_state,
+        "alarm_state": alarm_state,
+        "show": show.path if show else None,
+        "effect": effect_name,
+        "audio": audio.path if audio else None,
+        "sync": sync_clock.describe() if sync_clock else None,
+        "stream_clients": len(frame_stream.clients),
+        "alarms": [alarm.describe() for alarm in alarm_queue.list()],
+        "light_duration": settings.duration,
+        "light_cycles": settings.cycles,
+        "light_brightness": settings.brightness,
+        "light_flux": settings.flux,
+        "zones": [zone.describe() for zone in zones],
+        "layers": sorted(layers.layers),
+    }
+
+def overviewLines():
+    lines = [
+        "Program State: " + str(program_state),
+        "Light State: " + str(light_state),
+        "Alarm State: " + str(alarm_state),
+        "Show: " + (show.path if show else "None"),
+        "Effect: " + (effect_name or "None"),
+        "Audio: " + (audio.path if audio else "None"),
+        "Sync: " + (sync_clock.describe() if sync_clock else "None"),
+        "Stream: " + (stream_listen + ", " + str(len(frame_stream.clients)) + " viewers, " +
+                      str(LED_Metrics.stream_dropped.value) + " frames dropped" if stream_listen else "None"),
+        showAlarm(),
+        "Light Duration: " + str(settings.duration),
+        "Light Cycles: " + str(settings.cycles),
+        "Light Brightness: " + str(settings.brightness),
+        "Light Flux: " + str(settings.flux),
+        "Zones:",
+    ]
+    for zone in zones:
+        lines.append("\t" + zone.describe())
+    if render_scheduler:
+        lines.append("Render Timing: " + render_scheduler.summary())
+    lines += LED_Metrics.overview()
+    lines.append("Render Task: " + ("running" if render_task and not render_task.done() else "stopped"))
+    lines.append("Alarm Task: " + ("waiting" if alarm_task and not alarm_task.done() else "stopped"))
+    lines.append("Layers: " + ", ".join(sorted(layers.layers)))
+    return lines
+
+def commandOverview():
+    return True, "\n".join(overviewLines()), overviewState()
+
+#what the control server can do, (command, option) -> command function
+server_commands = {
+    ("start", "light"): commandStartLight,
+    ("stop", "light"): commandStopLight,
+    ("start", "alarm"): commandStartAlarm,
+    ("stop", "alarm"): commandStopAlarm,
+    ("start", "show"): commandStartShow,
+    ("stop", "show"): commandStopShow,
+    ("start", "effect"): commandStartEffect,
+    ("stop", "effect"): commandStopEffect,
+    ("start", "audio"): commandStartAudio,
+    ("stop", "audio"): commandStopAudio,
+    ("change", "light"): commandChangeLight,
+    ("change", "alarm"): commandChangeAlarm,
+    ("change", "brightness"): commandChangeBrightness,
+    ("change", "flux"): commandChangeFlux,
+    ("save", ""): commandSave,
+    ("load", ""): commandLoad,
+    ("overview", ""): commandOverview,
+}
+control_server = ControlServer(server_commands)
+
+def commandExit(save=False):
     global program_state
-    global light_state
-    global light_duration
-    global light_cycles
-    global light_brightness
-    global light_flux
-    global alarm_state
-    global alarm_start
-    global alarm_end
-    
-    while program_state:
-        user_input = input(">>").split(" ")
 
-        command = user_input[0]
+    if save:
+        print ("Saving")
+        saveConfig()
+    print ("Exiting")
+    program_state = False
+    stopAlarmTask()
+    stopShowTask()
+    stopEffectTask()
+    stopAudioTask()
+    stopLightTask()
+    return True, "\n".join(["Program State: " + str(program_state),
+                            "Light State: " + str(light_state),
+                            "Alarm State: " + str(alarm_state),
+                            "Exited"])
+
+def commandExitSave():
+    return commandExit(True)
+
+def commandList():
+    return True, "\n".join(command_list)
+
+async def commandWait(seconds):
+    try:
+        seconds = float(seconds)
+    except ValueError:
+        return False, "Invalid seconds for wait please see wait help"
+    if seconds < 0:
+        return False, "Invalid seconds for wait must be >= 0 please see wait help"
+    await asyncio.sleep(seconds)
+    return True, ""
+
+async def commandAt(at_time):
+    minutes = parseTime(at_time)
+    if minutes < 0:
+        return False, "Invalid time for at please see at help"
+    #the wall clock is read again now and then in case it is set while waiting
+    until = nextTime(minutes, wallTime())
+    while wallTime() < until:
+        await asyncio.sleep(min(until - wallTime(), max_wait))
+    return True, ""
+
+#console and batch commands, command -> option -> (values it takes, command function),
+#"" is the command without an option
+console_commands = {
+    "exit": {"": (0, commandExit), "save": (0, commandExitSave)},
+    "start": {"light": (0, commandStartLight), "alarm": (0, commandStartAlarm), "show": (1, commandStartShow),
+              "effect": (1, commandStartEffect), "audio": (1, commandStartAudio)},
+    "stop": {"light": (0, commandStopLight), "alarm": (0, commandStopAlarm), "show": (0, commandStopShow),
+             "effect": (0, commandStopEffect), "audio": (0, commandStopAudio)},
+    "change": {"light": (1, commandChangeLight), "alarm": (2, commandChangeAlarm),
+               "brightness": (1, commandChangeBrightness), "flux": (1, commandChangeFlux)},
+    "save": {"": (0, commandSave)},
+    "load": {"": (0, commandLoad)},
+    "overview": {"": (0, commandOverview)},
+    "list": {"": (0, commandList)},
+    "wait": {"": (1, commandWait)},
+    "at": {"": (1, commandAt)},
+}
+
+command_list = [
+    "exit <options>",
+    "start <options> <values>",
+    "stop <options>",
+    "change <options> <values>",
+    "save",
+    "load",
+    "overview",
+    "list",
+    "wait <seconds>",
+    "at <hour>:<minute>",
+]
+
+#printed by <command> help
+command_help = {
+    "exit": ["Will terminate program",
+             "Options:",
+             "\t\n\t\tWill terminate immediately",
+             "\tsave\n\t\tWill save before termination"],
+    "start": ["Will start lights, alarm, a show, an effect or audio",
+              "Options:",
+              "\tlight\n\t\tWill start the light with set period (seconds)",
+              "\talarm\n\t\tWill start the alarm with set (start, end) time",
+              "\tshow <file>\n\t\tWill play a show file compiled by LED_Show.py",
+              "\teffect <static|fade|chase|blend>\n\t\tWill draw white at brightness + flux over the light: held, faded up over the light duration, stepped from zone to zone or blended with the rainbow",
+              "\taudio <file>\n\t\tWill follow the sound of a WAV file, or of a pipe of raw 16 bit mono PCM"],
+    "stop": ["Will stop lights, alarm, show, effect or audio",
+             "Options:",
+             "\tlight\n\t\tWill stop the lights",
+             "\talarm\n\t\tWill stop the alarm",
+             "\tshow\n\t\tWill stop the show",
+             "\teffect\n\t\tWill stop the effect",
+             "\taudio\n\t\tWill stop following the audio"],
+    "change": ["Will change light duration, alarm (start, end) time, brightness, flux",
+               "Options:",
+               "\tlight <duration>\n\t\tWill change the light duration to the desired value, must be greater than zero and at most a day (seconds)",
+               "\talarm <start hour>:<start minute> <end hour>:<end minute>\n\t\tWill start the alarm after setting it to desired (start, end) time",
+               "\tbrightness <value>\n\t\tWill change the brightness to the desired value, must be >= 0 and <= 255",
+               "\tflux <value>\n\t\tWill change the brightness fluctuation to the desired amount, must be >= 0 and have brightness + flux <= 255, below zero the light is off"],
+    "save": ["Will save program's values",
+             "Options:",
+             "\t\n\t\tWill save the program's values listed in overview to LED_Main.ini"],
+    "load": ["Will load program's values",
+             "Options:",
+             "\t\n\t\tWill load the program's values listed in overview from LED_Main.ini"],
+    "overview": ["Will show the program's values and state"],
+    "list": ["Will list all valid commands"],
+    "wait": ["Will wait before the next command, for timed scenes in a batch",
+             "Options:",
+             "\t<seconds>\n\t\tWill wait this many seconds, must be >= 0"],
+    "at": ["Will wait until a time of day before the next command, for timed scenes in a batch",
+           "Options:",
+           "\t<hour>:<minute>\n\t\tWill wait until the next time the clock shows this, 24-hour format"],
+}
+
+async def runCommand(words):
+    #looks up and runs one command, words as typed
+    if not words or words[0] not in console_commands:
+        print ("Invalid command, type list for all valid commands")
+        return
+    command = words[0]
+    options = console_commands[command]
+    if len(words) >= 2 and words[1] == "help":
+        print ("\n".join(command_help[command]))
+        return
+
+    if len(words) >= 2 and words[1] in options:
+        option = words[1]
+        values = words[2:]
+    else:
         option = ""
-        values = ()
-        if len(user_input) >= 2:
-            option = user_input[1]
-            if len(user_input) >= 3:
-                values = user_input[2:4]
-        
-        #exit command
-        if command == "exit":
-            will_exit = False
-
-            #no option
-            if not option:
-                will_exit = True
-            #save option
-            elif option == "save":
-                will_exit = True
-                print ("Saving")
-                saveConfig()
-            #help option
-            elif option == "help":
-                print ("Will terminate program")
-                print ("Options:")
-                print ("\t\n\t\tWill terminate immediately")
-                print ("\tsave\n\t\tWill save before termination")
-            else:
-                print ("Invalid option please see exit help")
-
-            if will_exit:
-                print ("Exiting")
-                program_state = False
-                light_state = False
-                alarm_state = False
-                endLights()
-                
-                print ("Program State: " + str(program_state))
-                print ("Light State: " + str(light_state))
-                print ("Alarm State: " + str(alarm_state))
-                print ("Exited")
-            
-        #start command
-        elif command == "start":
-            #light option
-            if option == "light":
-                if not values:
-                    if not light_state:
-                        light_state = True
-                        print ("Lights started")
-                    else:
-                        print ("Invalid lights already on, see overview for status")
-                else:
-                    print ("Invalid number of values for start light please see start help")
-            #alarm option
-            elif option == "alarm":
-                if not values:
-                    if checkAlarmSet():
-                        if not alarm_state:
-                            alarm_state = True
-                            print ("Alarm started")
-                        else:
-                            print ("Invalid alarm already on, see overview for status")
-                    else:
-                        print ("Invalid alarm needs to be set, see start help or overview for status")       
-                else:
-                    print ("Invalid number of values for start alarm please see start help")
-            #help option
-            elif option == "help":
-                print ("Will start lights or alarm")
-                print ("Options:")
-                print ("\tlight\n\t\tWill start the light with set period (seconds)")
-                print ("\talarm\n\t\tWill start the alarm with set (start, end) time")
-            else:
-                print ("Invalid option please see start help")
-
-        #stop command
-        if command == "stop":
-            #light option
-            if option == "light":
-                if light_state:
-                    light_state = False
-                else:
-                    print ("Invalid light already off, see overview for status")
-            #alarm option
-            elif option == "alarm":
-                if alarm_state:
-                    alarm_state = False
-                else:
-                    print ("Invalid alarm already off, see overview for status")
-            #help option
-            elif option == "help":
-                print ("Will stop lights or alarm")
-                print ("Options:")
-                print ("\tlight\n\t\tWill stop the lights")
-                print ("\talarm\n\t\tWill stop the alarm")
-            else:
-                print ("Invalid option please see stop help")
-
-        #change command
-        elif command == "change":
-            #light option
-            if option == "light":
-                if len(values) == 1:
-                    valid = False
-                    #Input cna be in time format
-                    new_end_time = checkValidTime(values[0])
-                    if checkDuration(values[0]):
-                        new_duration = int(values[0])
-                        valid = True
-                    elif new_end_time:
-                        new_duration = calculateDifference(new_end_time)
-                        valid = new_duration > 0
-                    if valid:
-                        #restart light with new duration if necessary
-                        if light_state:
-                            light_state = False
-                            time.sleep(sleep_delay)
-                        light_duration = new_duration
-                        light_state = True
-                        print ("Light's duration changed to: " + str(light_duration))
-                    else:
-                        print ("Invalid value for light duration please see change help")
-                else:
-                    print ("Invalid number of values for change light please see change help")
-            #alarm option
-            elif option == "alarm":
-                if len(values) == 2:
-                    valid = True
-                    if not checkValidTime(values[0]):
-                        print ("Invalid start time for change alarm please see change help")
-                        valid = False
-                    if checkValidTime(values[1]):
-                        print ("Invalid end time for change alarm please see change help")
-                        valid = False
-                    if valid:
-                        alarm_start = values[0]
-                        alarm_end = values[1]
-                        print (showAlarm())
-                else:
-                    print ("Invalid number of values for change alarm please see alarm help")
-            #brightness option
-            if option == "brightness":
-                if len(values) == 1:
-                    if checkBrightness(values[0]):
-                        light_brightness = int(values[0])
-                    else:
-                        print ("Invalid value for change brightness please see change help")
-                else:
-                    print ("Invalid number of values for change brightness please see change help")
-            #flux option
-            elif option == "flux":
-                if len(values) == 1:
-                    if checkFlux(values[0]):
-                        light_flux = int(values[0])
-                    else:
-                        print ("Invalid value for change brightness please see change help")
-                else:
-                    print ("Invalid number of values for change brightness please see change help")
-            #help option
-            elif option == "help":
-                print ("Will change light duration, alarm (start, end) time, brightness, flux")
-                print ("Options:")
-                print ("\tlight <duration>\n\t\tWill change the light duration to the desired value, must be greater than zero (seconds)")
-                print ("\talarm <start hour>:<start minute> <end hour>:<end minute>\n\t\tWill start the alarm after setting it to desired (start, end) time")
-                print ("\brightness <value>\n\t\tWill change the brightness to the desired value, must be >= 0 and <= 255")
-                print ("\flux <value>\n\t\tWill change the brightness fluctuation to the desired amount, must have brightness - flux >= 0 and brightness + flux <= 255")
-            else:
-                print ("Invalid option please see change help")
-                
-        #save command
-        elif command == "save":
-            will_save = False
-
-            #no option
-            if not option:
-                will_save = True
-            #help option
-            elif option == "help":
-                print ("Will save program's values")
-                print ("Options:")
-                print ("\t\n\t\tWill save the program's values listed in overview to LED_Main.ini")
-            else:
-                print ("Invalid option please see save help")
-            
-            if will_save:
-                print("Saving")
-                saveConfig()
-        
-        #load command
-        elif command == "load":
-            #no option is default and will load
-            will_load = not option
-            
-            #help option
-            if option == "help":
-                print ("Will load program's values")
-                print ("Options:")
-                print ("\t\n\t\tWill load the program's values listed in overview from LED_Main.ini")
+        values = words[1:]
+    if option not in options or (not option and values and not options[option][0]):
+        print ("Invalid option please see " + command + " help")
+        return
+    count, function = options[option]
+    if len(values) != count:
+        print ("Invalid number of values for " + (command + " " + option).strip() + " please see " + command + " help")
+        return
+
+    result = function(*values)
+    if asyncio.iscoroutine(result):
+        result = await result
+    if result[1]:
+        print (result[1])
+
+#input task, reads commands from the console or from a batch file or pipe,
+#a batch runs each command as soon as the one before is done
+async def runInput(batch=None):
+    loop = asyncio.get_event_loop()
+    while program_state:
+        #input blocks, so it waits in a worker thread while the loop keeps running
+        try:
+            if batch is None:
+                line = await loop.run_in_executor(None, input, ">>")
             else:
-                print ("Invalid option please see load help")
-            if will_load:
-                loadConfig()
-        
-        #overview command
-        elif command == "overview":
-            print ("Program State: " + str(program_state))
-            print ("Light State: " + str(light_state))
-            print ("Alarm State: " + str(alarm_state))
-            print (showAlarm())
-            print ("Light Duration: " + str(light_duration))
-            print ("Light Cycles: " + str(light_cycles))
-            print ("Light Brightness: " + str(light_brightness))
-            print ("Light Flux: " + str(light_flux))
-
-        #list command
-        elif command == "list":
-            print ("exit <options>")
-            print ("start <options> <values>")
-            print ("stop <options>")
-            print ("change <options> <values>")
-            print ("save")
-            print ("load")
-            print ("overview")
-            print ("list")
+                line = await loop.run_in_executor(None, batch.readline)
+                if not line:
+                    raise EOFError
+        except EOFError:
+            #without a console the control server keeps the program running
+            if control_server.server:
+                print ("Input closed, serving control clients only")
+                await control_server.server.serve_forever()
+            line = "exit"
 
-        else:
-            print ("Invalid command, type list for all valid commands")
-            
-        time.sleep(sleep_delay) #to reduce cpu load
+        words = line.split()
+        if batch is not None:
+            #blank lines and # comments are skipped, the rest are echoed as they run
+            if not words or words[0].startswith("#"):
+                continue
+            print (">>" + " ".join(words))
+        await runCommand(words)
 
-#threaded lights
-def runLight():
-    global program_state
+#alarm task, exists while alarm_state is true and only wakes when an alarm is due or changed
+async def runAlarm():
+    global alarm_queue
+    global alarm_changed
+
+    while True:
+        due = alarm_queue.popDue(wallTime())
+        if due:
+            alarm, start = due
+            LED_Metrics.alarm_error.observe(max(0, wallTime() - start))
+            #started late or mid window, only play what is left of it
+            remaining = start + alarm.length - wallTime()
+            #a window resumed from the checkpoint is already being drawn
+            if alarm_window and layers.get("alarm") and start + alarm.length <= alarm_window[1] + sleep_delay:
+                continue
+            if remaining >= 1:
+                startAlarm(remaining)
+            continue
+
+        alarm_changed.clear()
+        try:
+            await asyncio.wait_for(alarm_changed.wait(), alarm_queue.timeout(wallTime()))
+        except asyncio.TimeoutError:
+            pass
+
+def startAlarmTask():
+    global alarm_state
+    global alarm_task
+
+    alarm_state = True
+    alarm_task = asyncio.ensure_future(runAlarm())
+    if playback_changed:
+        playback_changed.set()
+
+def stopAlarmTask():
+    global alarm_state
+    global alarm_task
+
+    alarm_state = False
+    if alarm_task:
+        alarm_task.cancel()
+        alarm_task = None
+    stopLayer("alarm")
+    if playback_changed:
+        playback_changed.set()
+
+def checkpointPath():
+    return checkpoint_file_name or os.path.splitext(config_file_name)[0] + ".state"
+
+def playbackState():
+    #what is playing now and how far along, for the checkpoint, taken at the
+    #deadline of the frame showing so the frames missed since are exact
+    written = wallTime()
+    tick = renderTick()
+    if tick is not None:
+        written -= render_scheduler.clock() - render_scheduler.deadline(tick)
+    light = None
+    rainbow = layers.get("light")
+    #the rainbow is played with the settings it was built with, not the config's
+    if light_state and isinstance(rainbow, Rainbow):
+        position = max(0, layers.nextFrame("light") - 1)
+        light = (rainbow.offset + position, rainbow.phaseAt(position)) + settings.light()
+    elif light_state and rainbow:
+        #in sync the loop is placed by the shared clock
+        light = (0, 0.0) + settings.light()
+    alarm = alarm_window if layers.get("alarm") else None
+    show_state = (show.path, max(0, layers.nextFrame("show") - 1)) if show else None
+    return PlaybackState(written, light, alarm_state, alarm, show_state)
+
+def resumePlayback(state):
+    #plays on from a checkpoint, counting the frames missed since it was taken
     global light_state
-    
-    while program_state:
-        if light_state:
-            startLights()
-            endLights()
+    global alarm_window
+    global settings
+
+    now = wallTime()
+    passed = max(0, int(math.floor((now - state.written) / sleep_delay)))
+    first = firstTick()
+    resumed = []
+    snapshot = None
+    if state.light:
+        elapsed, phase, duration, cycles, brightness, flux = state.light
+        try:
+            snapshot = settings.replace(duration=duration, cycles=cycles, brightness=brightness, flux=flux)
+        except ValueError as error:
+            print ("Light not resumed, checkpoint settings not valid: " + str(error))
+    if snapshot and sync_clock:
+        startLightTask(snapshot)
+        resumed.append("light")
+    elif snapshot:
+        rainbow = lightEffect(elapsed, phase, snapshot)
+        if passed < rainbow.length:
+            settings = snapshot
+            light_state = True
+            startLayer("light", rainbow, light_priority, endLights, first - passed)
+            resumed.append("light")
+    if state.show:
+        path, frame = state.show
+        try:
+            new_show = Show(path)
+        except (OSError, ValueError):
+            new_show = None
+        if new_show and new_show.matches(len(zonePins()), sleep_delay) and frame + passed < new_show.length:
+            startShowTask(new_show, first - frame - passed)
+            resumed.append("show")
+        elif new_show:
+            new_show.close()
+    if state.alarm and now < state.alarm[1]:
+        start, end = state.alarm
+        alarm_window = state.alarm
+        startLayer("alarm", alarmEffect(int((end - start) / sleep_delay)), alarm_priority,
+                   start=first - int(round((now - start) / sleep_delay)))
+        resumed.append("alarm")
+    if state.alarm_task:
+        startAlarmTask()
+    if resumed:
+        print ("Resumed " + ", ".join(resumed) + " from " + str(round(now - state.written, 1)) + " seconds ago")
+
+async def runCheckpoint(checkpoint):
+    #writes the playback state at a fixed rate while something plays, otherwise
+    #once and then sleeps until a layer or the alarm task starts or stops
+    written = None
+    while True:
+        playback_changed.clear()
+        state = playbackState()
+        if written is None or state.playing() or written.playing() or state.alarm_task != written.alarm_task:
+            try:
+                checkpoint.write(state)
+            except OSError as error:
+                print ("Could not write checkpoint " + checkpoint.path + ": " + str(error))
+                return
+            written = state
+        if state.playing():
+            await asyncio.sleep(checkpoint_interval)
         else:
-           time.sleep(sleep_delay)
+            await playback_changed.wait()
 
-#threaded alarm
-def runAlarm():
-    global program_state
-    global alarm_state
-    global alarm_start
-    global alarm_end
+async def runProgram(batch=None):
+    global alarm_changed
+    global playback_changed
 
-    while program_state:
-        if alarm_state:
-            #if the current time == alarm_start
-            if not calculateDifference(alarm_start):
-                startAlarm(calculateDifference(alarm_start, alarm_end))
-            else:
-                time.sleep(sleep_delay*10)
-        time.sleep(sleep_delay)
+    alarm_changed = asyncio.Event()
+    playback_changed = asyncio.Event()
+    alarm_queue.changed = alarm_changed.set
+    backend.latency = LED_Metrics.backend_latency
+    backend.writes_counter = LED_Metrics.backend_writes
+    if hasattr(backend, "errors_counter"):
+        backend.errors_counter = LED_Metrics.backend_send_errors
+    #lights pick up where they were before anything else starts
+    checkpoint = CheckpointFile(checkpointPath())
+    if checkpoint.last and checkpoint.last.active():
+        resumePlayback(checkpoint.last)
+    checkpoint_task = asyncio.ensure_future(runCheckpoint(checkpoint))
+    if metrics_listen:
+        try:
+            await LED_Metrics.startServer(metrics_listen)
+            print ("Metrics served on " + metrics_listen)
+        except (OSError, ValueError):
+            print ("Could not serve metrics on " + metrics_listen)
+    if server_listen:
+        try:
+            await control_server.start(server_listen)
+            print ("Control server listening on " + server_listen)
+        except (OSError, ValueError):
+            print ("Could not start control server on " + server_listen)
+    if stream_listen:
+        frame_stream.clients_gauge = LED_Metrics.stream_clients
+        frame_stream.dropped_counter = LED_Metrics.stream_dropped
+        try:
+            await frame_stream.start(stream_listen)
+            print ("Frames streamed on " + stream_listen)
+        except (OSError, ValueError):
+            print ("Could not stream frames on " + stream_listen)
+    if config_watch:
+        watch_task = asyncio.ensure_future(ConfigWatcher(config_file_name, reloadConfig).run())
+    if sync_clock:
+        sync_clock.offset_gauge = LED_Metrics.sync_offset
+        sync_task = asyncio.ensure_future(sync_clock.run())
+        print ("Sync " + sync_clock.describe())
+    await runInput(batch) #lights and alarm run as tasks beside the input
+    if config_watch:
+        watch_task.cancel()
+    if sync_clock:
+        sync_task.cancel()
+    control_server.close()
+    frame_stream.close()
+    stopAlarmTask()
+    stopShowTask()
+    stopEffectTask()
+    stopAudioTask()
+    stopLightTask()
+    #exited on purpose, nothing is resumed next time
+    checkpoint_task.cancel()
+    try:
+        checkpoint.write(playbackState())
+    except OSError:
+        pass
+    checkpoint.close()
 
 if __name__ == "__main__":
-    pi = pigpio.pi()
+    parser = argparse.ArgumentParser(description="Rainbow lights and alarm clock for RGB LEDs on a Raspberry Pi")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="run the commands in FILE, - for stdin, instead of reading the console")
+    args = parser.parse_args()
+    batch = None
+    if args.batch == "-":
+        batch = sys.stdin
+    elif args.batch:
+        try:
+            batch = open(args.batch)
+        except OSError as error:
+            print ("Could not read " + args.batch + ": " + str(error))
+            raise SystemExit(1)
 
+    pi = None
     loadConfig()
-    start_new_thread(runAlarm, ()) #third thread for alarm timer
-    start_new_thread(runLight, ()) #second thread for light display
-    runInput() #main thread checks input
-         
-    pi.stop()
+    try:
+        backend = makeBackend(output_config)
+        sync_clock = makeSyncClock(sync_config)
+    except (OSError, ValueError) as error:
+        print ("Could not set up the output or sync: " + str(error))
+        raise SystemExit(1)
+
+    asyncio.run(runProgram(batch))
+
+    backend.close()
+    if pi:
+        pi.stop()
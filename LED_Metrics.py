@@ -0,0 +1,209 @@
+#LED_Metrics
+#
+#Counters, gauges and histograms filled in by the render loop, the alarm
+#task and the output backend, kept cheap enough for every frame. They are shown by
+#the overview command and served in Prometheus text format over local
+#HTTP, on a TCP port or a unix socket.
+
+import bisect
+
+from LED_Server import startListener
+
+#histogram buckets, seconds
+FRAME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+CALL_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+ALARM_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0, 60.0)
+
+def showLabels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(key + '="' + str(value) + '"' for key, value in sorted(labels.items())) + "}"
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=None):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels or {}
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        return [(self.name, self.labels, self.value)]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value):
+        self.value = value
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets, labels=None):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels or {}
+        self.buckets = buckets
+        #one count per bucket plus the overflow, made cumulative when read
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def mean(self):
+        if not self.count:
+            return 0.0
+        return self.total / self.count
+
+    def quantile(self, fraction):
+        #upper bound of the bucket holding the quantile, max for the overflow bucket
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def samples(self):
+        samples = []
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            labels = dict(self.labels, le=repr(bound))
+            samples.append((self.name + "_bucket", labels, seen))
+        samples.append((self.name + "_bucket", dict(self.labels, le="+Inf"), self.count))
+        samples.append((self.name + "_sum", self.labels, self.total))
+        samples.append((self.name + "_count", self.labels, self.count))
+        return samples
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        #Prometheus text format, HELP and TYPE once per metric name
+        lines = []
+        described = set()
+        for metric in self.metrics:
+            if metric.name not in described:
+                described.add(metric.name)
+                lines.append("# HELP " + metric.name + " " + metric.help_text)
+                lines.append("# TYPE " + metric.name + " " + metric.kind)
+            for name, labels, value in metric.samples():
+                lines.append(name + showLabels(labels) + " " + repr(value))
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+class LoopMetrics:
+    #what a FrameScheduler reports about one loop
+    def __init__(self, loop):
+        labels = {"loop": loop}
+        self.lateness = registry.add(Histogram("led_frame_lateness_seconds",
+            "How long after its deadline each frame was shown", FRAME_BUCKETS, labels))
+        self.frames = registry.add(Counter("led_frames_total", "Frames shown", labels))
+        self.late = registry.add(Counter("led_frames_late_total",
+            "Frames shown more than a tenth of a frame after their deadline", labels))
+        self.dropped = registry.add(Counter("led_frames_dropped_total",
+            "Frames skipped because the loop fell behind", labels))
+        self.idle = registry.add(Counter("led_frames_idle_total",
+            "Frames not drawn because nothing on the output would have changed", labels))
+        self.running = registry.add(Gauge("led_loop_running", "1 while the loop is playing", labels))
+
+    def frame(self, late, delay):
+        self.lateness.observe(late)
+        self.frames.value += 1
+        if late > delay / 10:
+            self.late.value += 1
+
+    def summary(self):
+        return ("frames " + str(self.frames.value) +
+                ", late " + str(self.late.value) +
+                ", dropped " + str(self.dropped.value) +
+                ", idle " + str(self.idle.value) +
+                ", lateness p50 " + str(round(self.lateness.quantile(0.5) * 1000, 2)) + "ms" +
+                ", p99 " + str(round(self.lateness.quantile(0.99) * 1000, 2)) + "ms" +
+                ", max " + str(round(self.lateness.max * 1000, 2)) + "ms")
+
+render_metrics = LoopMetrics("render")
+backend_latency = registry.add(Histogram("led_backend_submit_seconds",
+    "Time to hand one frame of channel writes to the output backend", CALL_BUCKETS))
+backend_writes = registry.add(Counter("led_backend_channel_writes_total",
+    "Channel writes sent to the output backend"))
+backend_send_errors = registry.add(Counter("led_backend_send_errors_total",
+    "Packets the network output could not send"))
+alarm_error = registry.add(Histogram("led_alarm_fire_error_seconds",
+    "How long after its scheduled start an alarm began playing", ALARM_BUCKETS))
+stream_clients = registry.add(Gauge("led_stream_clients", "Viewers of the live frame stream"))
+stream_dropped = registry.add(Counter("led_stream_dropped_total",
+    "Frames a stream viewer missed because it fell behind"))
+sync_offset = registry.add(Gauge("led_sync_offset_seconds",
+    "Offset of the shared clock from this node's wall clock"))
+audio_latency = registry.add(Histogram("led_audio_latency_seconds",
+    "Time from reading a block of sound to writing the frame made from it to the lights", FRAME_BUCKETS))
+
+def showCall(histogram):
+    return ("mean " + str(round(histogram.mean() * 1e6, 1)) + "us" +
+            ", p99 " + str(round(histogram.quantile(0.99) * 1e6, 1)) + "us" +
+            ", max " + str(round(histogram.max * 1e6, 1)) + "us")
+
+def overview():
+    #lines printed by the overview command
+    return [
+        "Render Frames: " + render_metrics.summary(),
+        "Backend Submit: " + str(backend_latency.count) + " batches, " +
+            str(backend_writes.value) + " writes, " + str(backend_send_errors.value) + " send errors, " +
+            showCall(backend_latency),
+        "Alarm Fire Error: " + str(alarm_error.count) + " fired, mean " +
+            str(round(alarm_error.mean(), 3)) + "s, max " + str(round(alarm_error.max, 3)) + "s",
+        "Audio Latency: " + str(audio_latency.count) + " frames, mean " +
+            str(round(audio_latency.mean() * 1000, 2)) + "ms, p99 " +
+            str(round(audio_latency.quantile(0.99) * 1000, 2)) + "ms, max " +
+            str(round(audio_latency.max * 1000, 2)) + "ms",
+    ]
+
+async def handleRequest(reader, writer):
+    try:
+        request = await reader.readline()
+        #headers are read and ignored
+        while True:
+            line = await reader.readline()
+            if not line or line in (b"\r\n", b"\n"):
+                break
+        parts = request.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/", "/metrics"):
+            status = "200 OK"
+            body = registry.render().encode()
+        else:
+            status = "404 Not Found"
+            body = b"not found\n"
+        writer.write(("HTTP/1.0 " + status + "\r\n"
+                      "Content-Type: text/plain; version=0.0.4\r\n"
+                      "Content-Length: " + str(len(body)) + "\r\n\r\n").encode() + body)
+        await writer.drain()
+    except (ConnectionError, UnicodeDecodeError):
+        pass
+    finally:
+        writer.close()
+
+async def startServer(listen):
+    #listen is host:port, or a path for a unix socket
+    return await startListener(handleRequest, listen)
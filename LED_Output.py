@@ -0,0 +1,378 @@
+#LED_Output
+#
+#Output backends sit between the light effects and pigpio. A frame is the
+#(pin, duty cycle) pairs of every channel, channels whose duty cycle has not
+#changed since the last frame are skipped and the rest are handed to the
+#backend as one batch.
+#
+#The script backend hands pigpiod whole chunks of frames as stored scripts
+#that it plays on its own clock, so frame timing no longer depends on when
+#Python gets to run. Python only stores the next chunk while one is playing.
+#pigpio's waves are not used as they only switch pins on and off, a duty
+#cycle can only be set by the PWM command.
+#
+#The network backends send the same frames as E1.31 (sACN) or Art-Net over
+#UDP, so one controller can drive many remote nodes. There a pin is a DMX
+#channel counted from 0 across consecutive universes of 512 channels.
+
+import asyncio
+import socket
+import struct
+import time
+import uuid
+
+#pigpio is only needed by PigpioBackend, the fake backend runs without it
+try:
+    import pigpio
+except ImportError:
+    pigpio = None
+
+#pigpiod socket protocol, every command and reply is four unsigned ints
+PWM_COMMAND = getattr(pigpio, "_PI_CMD_PWM", 5)
+COMMAND_LENGTH = 16
+
+#pigpio script states, the daemon's tick wraps after 2**32 microseconds
+SCRIPT_INITING = getattr(pigpio, "PI_SCRIPT_INITING", 0)
+SCRIPT_HALTED = getattr(pigpio, "PI_SCRIPT_HALTED", 1)
+TICK_WRAP = 1 << 32
+
+#longest script stored at once, bytes, well under pigpiod's 64KB command limit
+script_limit = 60000
+
+#subroutine of every playback script, waits until the tick p0 + v0 microseconds,
+#sleeping at most 500ms at a time and exactly for the rest
+PLAYBACK_WAIT = ("tag 0 tick sta v1 lda p0 add v0 sub v1 jm 1 jz 1 "
+                 "sub 500000 jm 2 mils 500 jmp 0 "
+                 "tag 2 add 500000 sta v1 mics v1 "
+                 "tag 1 ret")
+
+#channels in a DMX universe, and the most channels the network backends address
+UNIVERSE_SLOTS = 512
+NETWORK_CHANNEL_LIMIT = UNIVERSE_SLOTS * 128 - 1
+
+#E1.31 data packet, root, framing and DMP layer before the channel values
+E131_PORT = 5568
+E131_IDENTIFIER = b"ASC-E1.17\0\0\0"
+E131_HEADER = struct.Struct("!HH12sHI16sHI64sBHBBHHBBHHHB")
+E131_PRIORITY = 100
+
+#Art-Net ArtDmx packet before the channel values, the universe is little endian
+ARTNET_PORT = 6454
+ARTNET_HEADER = struct.Struct("<8sH2sBBH2s")
+ARTNET_OPCODE_DMX = 0x5000
+
+class OutputBackend:
+    def __init__(self):
+        #duty cycle last written to each pin
+        self.last = {}
+        #optional Histogram and Counter of LED_Metrics for submit time and writes
+        self.latency = None
+        self.writes_counter = None
+        #longest the render loop may go without calling writeFrame, seconds, None for no limit
+        self.max_idle = None
+
+    def writeFrame(self, frame):
+        #frame is a sequence of (pin, duty cycle), returns how many were written
+        changes = [(pin, duty) for pin, duty in frame if self.last.get(pin) != duty]
+        if changes:
+            if self.latency:
+                start = time.perf_counter()
+                self.submit(changes)
+                self.latency.observe(time.perf_counter() - start)
+                self.writes_counter.value += len(changes)
+            else:
+                self.submit(changes)
+            self.last.update(changes)
+        return len(changes)
+
+    def submit(self, changes):
+        raise NotImplementedError
+
+    def reset(self):
+        #forget written values so the next frame is written in full
+        self.last.clear()
+
+    def close(self):
+        pass
+
+class PigpioBackend(OutputBackend):
+    def __init__(self, pi):
+        OutputBackend.__init__(self)
+        self.pi = pi
+        #the socket and lock pigpio.pi sends its commands through, pipelining
+        #falls back to one call per channel if this pigpio does not have them
+        self.socklock = getattr(pi, "sl", None)
+        if not (hasattr(self.socklock, "s") and hasattr(self.socklock, "l")):
+            self.socklock = None
+
+    def submit(self, changes):
+        if self.socklock is None:
+            for pin, duty in changes:
+                self.pi.set_PWM_dutycycle(pin, duty)
+            return
+
+        #every command is sent at once and the replies are read afterwards,
+        #one round trip per frame instead of one per channel
+        request = b"".join(struct.pack("IIII", PWM_COMMAND, pin, duty, 0) for pin, duty in changes)
+        expected = COMMAND_LENGTH * len(changes)
+        with self.socklock.l:
+            self.socklock.s.sendall(request)
+            reply = b""
+            while len(reply) < expected:
+                chunk = self.socklock.s.recv(expected - len(reply))
+                if not chunk:
+                    raise ConnectionError("pigpiod closed the connection")
+                reply += chunk
+
+        for i in range(len(changes)):
+            result = struct.unpack_from("i", reply, i * COMMAND_LENGTH + 12)[0]
+            if result < 0:
+                raise pigpio.error(pigpio.error_text(result))
+
+def playbackScript(pins, frames, delay):
+    #pigpio script text playing frames delay microseconds apart from the tick in
+    #p0, only channels that change are written so repeated frames cost nothing
+    parts = []
+    last = {}
+    for i, values in enumerate(frames):
+        writes = ["pwm " + str(pin) + " " + str(value) for pin, value in zip(pins, values) if last.get(pin) != value]
+        if writes:
+            parts.append("ld v0 " + str(i * delay) + " call 0 " + " ".join(writes))
+            last.update(zip(pins, values))
+    parts.append("halt")
+    parts.append(PLAYBACK_WAIT)
+    return " ".join(parts).encode()
+
+class ScriptBackend(PigpioBackend):
+    #two scripts take turns, one playing its chunk and the next waiting for its first frame
+    def __init__(self, pi, chunk=100):
+        PigpioBackend.__init__(self, pi)
+        #frames handed over at once
+        self.chunk = chunk
+        self.scripts = [None, None]
+        self.turn = 0
+        #(clock time, daemon tick) read together, to turn frame deadlines into ticks
+        self.anchor = None
+        self.chunks = 0
+
+    def tickAt(self, when, now):
+        if self.anchor is None:
+            self.anchor = (now, self.pi.get_current_tick())
+        anchor_time, anchor_tick = self.anchor
+        return (anchor_tick + int(round((when - anchor_time) * 1000000))) % TICK_WRAP
+
+    async def queue(self, pins, frames, start, delay, clock):
+        #frames play delay seconds apart from start, a time on clock, returns how
+        #many of them were taken, fewer when the script got too long
+        delay = int(round(delay * 1000000))
+        count = len(frames)
+        text = playbackScript(pins, frames, delay)
+        while len(text) > script_limit and count > 1:
+            count //= 2
+            text = playbackScript(pins, frames[:count], delay)
+
+        slot = self.turn
+        self.turn = 1 - self.turn
+        self.release(slot)
+        script = self.scripts[slot] = self.pi.store_script(text)
+        #pigpiod readies a new script on its own thread, the event loop runs meanwhile
+        for _ in range(1000):
+            if self.pi.script_status(script)[0] != SCRIPT_INITING:
+                break
+            await asyncio.sleep(0.001)
+        self.pi.run_script(script, [self.tickAt(start, clock())])
+        self.last.update(zip(pins, frames[count - 1]))
+        self.chunks += 1
+        return count
+
+    def release(self, slot):
+        script = self.scripts[slot]
+        if script is not None:
+            self.scripts[slot] = None
+            self.pi.stop_script(script)
+            self.pi.delete_script(script)
+
+    def playing(self):
+        return self.scripts != [None, None]
+
+    def cancel(self):
+        #drops the chunks handed over, the pins keep the frame they were showing
+        for slot in range(len(self.scripts)):
+            self.release(slot)
+        self.anchor = None
+        #which frame was reached is not known, so the next is written in full
+        self.reset()
+
+    def writeFrame(self, frame):
+        if self.playing():
+            self.cancel()
+        return PigpioBackend.writeFrame(self, frame)
+
+    def close(self):
+        if self.playing():
+            self.cancel()
+
+class FakeBackend(OutputBackend):
+    #keeps everything in memory, for tests and benchmarks without a Pi
+    def __init__(self):
+        OutputBackend.__init__(self)
+        self.duty = {}
+        self.submits = 0
+        self.writes = 0
+        self.history = []
+        self.keep_history = True
+
+    def submit(self, changes):
+        self.submits += 1
+        self.writes += len(changes)
+        self.duty.update(changes)
+        if self.keep_history:
+            self.history.append(tuple(changes))
+
+    def reset(self):
+        OutputBackend.reset(self)
+        self.duty.clear()
+        self.history = []
+
+class NetworkBackend(OutputBackend):
+    #UDP port of the protocol, set by each network backend
+    port = 0
+
+    def __init__(self, host="", port=0, first_universe=1, nodes=None, keepalive=1.0):
+        #host and port receive every universe not in nodes, universe -> host,
+        #an empty host is the protocol's default multicast or broadcast address
+        OutputBackend.__init__(self)
+        self.host = host
+        if port:
+            self.port = port
+        self.first_universe = first_universe
+        self.nodes = nodes or {}
+        #seconds after which unchanged universes are sent again, so receivers keep them,
+        #the render loop calls writeFrame at least twice in that time even when idle
+        self.keepalive = keepalive
+        self.max_idle = keepalive / 2
+        #universe -> channel values, how many of them are in use and when it was last sent
+        self.universes = {}
+        self.used = {}
+        self.sequence = {}
+        self.sent = {}
+        #packets the network would not take, and an optional Counter of LED_Metrics for them
+        self.send_errors = 0
+        self.errors_counter = None
+        self.packets = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+
+    def address(self, channel):
+        return self.first_universe + channel // UNIVERSE_SLOTS, channel % UNIVERSE_SLOTS
+
+    def defaultHost(self, universe):
+        raise NotImplementedError
+
+    def destination(self, universe):
+        return (self.nodes.get(universe) or self.host or self.defaultHost(universe), self.port)
+
+    def packet(self, universe, sequence, data):
+        raise NotImplementedError
+
+    def submit(self, changes):
+        #every universe touched by the frame goes out as one packet, back to back
+        touched = set()
+        for channel, value in changes:
+            universe, slot = self.address(channel)
+            data = self.universes.get(universe)
+            if data is None:
+                data = self.universes[universe] = bytearray(UNIVERSE_SLOTS)
+                self.used[universe] = 0
+            data[slot] = value
+            self.used[universe] = max(self.used[universe], slot + 1)
+            touched.add(universe)
+        self.send(sorted(touched))
+
+    def send(self, universes):
+        now = time.monotonic()
+        for universe in universes:
+            sequence = (self.sequence.get(universe, 0) + 1) % 256
+            self.sequence[universe] = sequence
+            data = memoryview(self.universes[universe])[:self.used[universe]]
+            try:
+                self.sock.sendto(self.packet(universe, sequence, data), self.destination(universe))
+                self.packets += 1
+            except OSError:
+                #no route yet or the network dropped, the keepalive sends it again
+                self.send_errors += 1
+                if self.errors_counter:
+                    self.errors_counter.inc()
+            self.sent[universe] = now
+
+    def writeFrame(self, frame):
+        written = OutputBackend.writeFrame(self, frame)
+        #universes the frame did not touch are sent again once they are due
+        now = time.monotonic()
+        stale = [universe for universe in sorted(self.universes) if now - self.sent[universe] >= self.keepalive]
+        if stale:
+            self.send(stale)
+        return written
+
+    def close(self):
+        self.sock.close()
+
+class E131Backend(NetworkBackend):
+    port = E131_PORT
+
+    def __init__(self, host="", port=0, first_universe=1, nodes=None, keepalive=1.0, name="LED_Main"):
+        NetworkBackend.__init__(self, host, port, first_universe, nodes, keepalive)
+        #component identifier, the same for every packet this backend sends
+        self.cid = uuid.uuid4().bytes
+        self.name = name.encode("utf-8")[:63]
+
+    def defaultHost(self, universe):
+        #every universe has its own multicast group
+        return "239.255." + str(universe >> 8 & 0xff) + "." + str(universe & 0xff)
+
+    def packet(self, universe, sequence, data):
+        count = len(data)
+        header = E131_HEADER.pack(
+            0x0010, 0x0000, E131_IDENTIFIER,
+            0x7000 | (110 + count), 0x00000004, self.cid,
+            0x7000 | (88 + count), 0x00000002, self.name, E131_PRIORITY, 0, sequence, 0, universe,
+            0x7000 | (11 + count), 0x02, 0xa1, 0x0000, 0x0001, count + 1, 0x00)
+        return header + data
+
+class ArtNetBackend(NetworkBackend):
+    port = ARTNET_PORT
+
+    def __init__(self, host="", port=0, first_universe=0, nodes=None, keepalive=1.0):
+        NetworkBackend.__init__(self, host, port, first_universe, nodes, keepalive)
+
+    def defaultHost(self, universe):
+        return "255.255.255.255"
+
+    def packet(self, universe, sequence, data):
+        #the channel count must be even, a padding zero is added when it is not
+        count = len(data) + len(data) % 2
+        header = ARTNET_HEADER.pack(b"Art-Net\0", ARTNET_OPCODE_DMX, b"\x00\x0e",
+                                    sequence, 0, universe & 0x7fff, struct.pack("!H", count))
+        return header + data + b"\0" * (count - len(data))
+
+class RecordingBackend(OutputBackend):
+    #notes every batch with the time it was written, for simulations and traces
+    def __init__(self, clock):
+        OutputBackend.__init__(self)
+        self.clock = clock
+        #pins in the order they were first written, and (time, changes) of every batch
+        self.pins = []
+        self.batches = []
+
+    def submit(self, changes):
+        for pin, _ in changes:
+            if pin not in self.last:
+                self.pins.append(pin)
+        self.batches.append((self.clock(), tuple(changes)))
+
+    def trace(self):
+        #(time, duty cycle of every pin in pins order) after each batch
+        duty = dict.fromkeys(self.pins, 0)
+        for when, changes in self.batches:
+            duty.update(changes)
+            yield when, tuple(duty[pin] for pin in self.pins)
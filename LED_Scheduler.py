@@ -0,0 +1,220 @@
+#LED_Scheduler
+#
+#Frame pacing for the light and alarm loops. Frames are tied to absolute
+#deadlines on the monotonic clock instead of sleeping a fixed delay after
+#each write, so time spent writing never adds up into drift. When the loop
+#falls a whole frame or more behind, the missed frames are dropped and
+#playback continues at the frame that is due now.
+#
+#Given an epoch, frames are counted from it on the clock instead of from when
+#the loop began, so loops on different nodes sharing a clock and an epoch
+#hand out the same frame at the same time.
+#
+#A loop that knows its next frames would only repeat the last one can skip
+#to the first that changes and sleep until then. The sleep is cut short when
+#something else changes what is drawn.
+
+import asyncio
+import math
+import time
+
+#clock and sleeps used by schedulers that are not given their own, and the
+#time of day read by the alarms
+default_clock = time.monotonic
+default_async_sleep = asyncio.sleep
+default_wall_clock = time.time
+
+#longest a loop with nothing left to change sleeps before it looks again, seconds
+max_idle = 3600.0
+
+class VirtualClock:
+    #time that only moves when something sleeps, so frames run as fast as they can be made
+    def __init__(self, start=0.0, wall=None):
+        self.now = start
+        #time of day at start, seconds since 1970, the real one by default
+        self.wall = time.time() - start if wall is None else wall - start
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.wall + self.now
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.now += seconds
+
+    async def asyncSleep(self, seconds):
+        self.sleep(seconds)
+        #still give other tasks their turn
+        await asyncio.sleep(0)
+
+def useClock(clock):
+    #makes new schedulers run on clock, None goes back to real time
+    global default_clock
+    global default_async_sleep
+    global default_wall_clock
+
+    if clock is None:
+        default_clock = time.monotonic
+        default_async_sleep = asyncio.sleep
+        default_wall_clock = time.time
+    else:
+        default_clock = clock.monotonic
+        default_async_sleep = clock.asyncSleep
+        default_wall_clock = clock.time
+
+def wallTime():
+    #seconds since 1970 on the clock in use
+    return default_wall_clock()
+
+class FrameScheduler:
+    def __init__(self, delay, clock=None, async_sleep=None, metrics=None, epoch=None, max_idle=None):
+        self.delay = delay
+        self.epoch = epoch
+        #longest a skip may sleep, seconds, for outputs that must be written every so often
+        self.max_idle = max_idle
+        #LoopMetrics of LED_Metrics to report every frame to, if any
+        self.metrics = metrics
+        self.clock = clock or default_clock
+        self.async_sleep = async_sleep or default_async_sleep
+        #frame asked for by skipTo, the event an idle sleep also waits on and whether wakeUp set it
+        self.skip = None
+        self.wake = None
+        self.woken = False
+        #clock time of frame 0, set by begin
+        self.origin = None
+        self.resetStats()
+
+    def resetStats(self):
+        #frames handed out, frames skipped, times the loop fell a frame behind
+        self.frames_shown = 0
+        self.frames_dropped = 0
+        self.frames_idle = 0
+        self.overruns = 0
+        #lateness of each shown frame against its deadline, seconds
+        self.jitter_total = 0.0
+        self.jitter_max = 0.0
+
+    def begin(self):
+        #returns the first frame, the next one due after now when counting from an epoch
+        if self.epoch is None:
+            self.origin = self.clock()
+            return 0
+        self.origin = self.epoch
+        return max(0, int(math.ceil((self.clock() - self.epoch) / self.delay)))
+
+    def current(self):
+        #frame whose deadline passed last, the one showing now, None before begin
+        if self.origin is None:
+            return None
+        return int(math.floor((self.clock() - self.origin) / self.delay))
+
+    def deadline(self, frame):
+        return self.origin + frame * self.delay
+
+    def due(self, frame, length):
+        #called once the deadline of frame has passed, returns the frame to show
+        late = self.clock() - self.deadline(frame)
+        if late >= self.delay:
+            #coalesce every frame that is already past due into this one
+            skipped = int(late / self.delay)
+            if length is not None:
+                skipped = min(skipped, length - frame)
+            self.overruns += 1
+            self.frames_dropped += skipped
+            if self.metrics:
+                self.metrics.dropped.value += skipped
+            frame += skipped
+            if length is not None and frame >= length:
+                return frame
+            late -= skipped * self.delay
+
+        self.frames_shown += 1
+        self.jitter_total += late
+        if late > self.jitter_max:
+            self.jitter_max = late
+        if self.metrics:
+            self.metrics.frame(late, self.delay)
+        return frame
+
+    def skipTo(self, frame):
+        #called between frames, the next frame worth showing, None when nothing will change
+        self.skip = frame if frame is not None else math.inf
+
+    def advance(self, frame):
+        #the frame after the one just shown, or the one skipTo asked for
+        skip = self.skip
+        self.skip = None
+        if skip is None:
+            return frame + 1
+        limit = frame + max(1, int(min(max_idle, self.max_idle or max_idle) / self.delay))
+        return max(frame + 1, min(skip, limit))
+
+    def idle(self, frames):
+        #frames passed over because they would not have changed anything
+        if frames > 0:
+            self.frames_idle += frames
+            if self.metrics:
+                self.metrics.idle.value += frames
+
+    def wakeUp(self):
+        #ends an idle sleep early, the loop goes on at the next frame's deadline,
+        #the sleep itself is never cancelled so cancelling the loop always ends it
+        if self.wake is not None and not self.wake.is_set():
+            self.woken = True
+            self.wake.set()
+
+    async def asyncFrames(self, length):
+        #yields the index of each frame as its deadline arrives, forever when length
+        #is None, waiting on the event loop
+        frame = self.begin()
+        shown = frame - 1
+        while length is None or frame < length:
+            wait = self.deadline(frame) - self.clock()
+            if wait > 0 and frame > shown + 1:
+                #idle until the frame skipTo asked for unless woken first
+                self.woken = False
+                self.wake = asyncio.Event()
+                sleeper = asyncio.ensure_future(self.async_sleep(wait))
+                waker = asyncio.ensure_future(self.wake.wait())
+                try:
+                    await asyncio.wait((sleeper, waker), return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    sleeper.cancel()
+                    waker.cancel()
+                    self.wake = None
+                if self.woken:
+                    frame = max(shown + 1, int(math.ceil((self.clock() - self.origin) / self.delay)))
+                    continue
+            elif wait > 0:
+                await self.async_sleep(wait)
+            self.idle(frame - shown - 1)
+            frame = self.due(frame, length)
+            if length is not None and frame >= length:
+                break
+            yield frame
+            shown = frame
+            frame = self.advance(frame)
+
+    def stats(self):
+        mean = 0.0
+        if self.frames_shown:
+            mean = self.jitter_total / self.frames_shown
+        return {
+            "frames": self.frames_shown,
+            "dropped": self.frames_dropped,
+            "idle": self.frames_idle,
+            "overruns": self.overruns,
+            "jitter_mean": mean,
+            "jitter_max": self.jitter_max,
+        }
+
+    def summary(self):
+        stats = self.stats()
+        return ("frames " + str(stats["frames"]) +
+                ", dropped " + str(stats["dropped"]) +
+                ", idle " + str(stats["idle"]) +
+                ", overruns " + str(stats["overruns"]) +
+                ", jitter mean " + str(round(stats["jitter_mean"] * 1000, 2)) + "ms" +
+                ", jitter max " + str(round(stats["jitter_max"] * 1000, 2)) + "ms")
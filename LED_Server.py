@@ -0,0 +1,108 @@
+#LED_Server
+#
+#Local control server speaking line-delimited JSON, on a unix socket or a
+#localhost TCP port. Each request is one JSON object on its own line,
+#
+#   {"id": 1, "command": "change", "option": "brightness", "values": ["20"]}
+#
+#and gets one JSON line back,
+#
+#   {"id": 1, "ok": true, "message": "..."}
+#
+#Clients are served by the same event loop as the render task. Commands only
+#flip state and return, so they never hold up a frame.
+
+import asyncio
+import inspect
+import json
+
+#longest request line accepted, bytes
+max_request = 64 * 1024
+
+async def startListener(handler, listen, **options):
+    #listen is host:port, or a path for a unix socket
+    if "/" in listen:
+        return await asyncio.start_unix_server(handler, path=listen, **options)
+    host, _, port = listen.rpartition(":")
+    return await asyncio.start_server(handler, host or "127.0.0.1", int(port), **options)
+
+class ControlServer:
+    def __init__(self, commands):
+        #(command, option) -> function taking the values, returning (ok, message)
+        #or (ok, message, data)
+        self.commands = commands
+        self.clients = 0
+        self.server = None
+
+    def handle(self, request):
+        response = {}
+        if not isinstance(request, dict):
+            response["ok"] = False
+            response["message"] = "Invalid request, expected a JSON object"
+            return response
+        if "id" in request:
+            response["id"] = request["id"]
+
+        command = str(request.get("command", ""))
+        option = str(request.get("option", ""))
+        values = request.get("values", [])
+        if not isinstance(values, list):
+            values = [values]
+        values = [str(value) for value in values]
+
+        function = self.commands.get((command, option))
+        if function is None:
+            response["ok"] = False
+            response["message"] = "Invalid command, valid commands are " + ", ".join(
+                (command + " " + option).strip() for command, option in sorted(self.commands))
+            return response
+
+        try:
+            inspect.signature(function).bind(*values)
+        except TypeError:
+            response["ok"] = False
+            response["message"] = "Invalid number of values for " + (command + " " + option).strip()
+            return response
+        result = function(*values)
+        response["ok"] = result[0]
+        response["message"] = result[1]
+        if len(result) > 2:
+            response["data"] = result[2]
+        return response
+
+    async def serveClient(self, reader, writer):
+        self.clients += 1
+        try:
+            while True:
+                try:
+                    line = await reader.readuntil(b"\n")
+                except asyncio.IncompleteReadError as error:
+                    line = error.partial
+                except asyncio.LimitOverrunError:
+                    writer.write(b'{"ok": false, "message": "Request too long"}\n')
+                    break
+                if not line.strip():
+                    if not line:
+                        break
+                    continue
+
+                try:
+                    response = self.handle(json.loads(line.decode("utf-8")))
+                except (ValueError, UnicodeDecodeError):
+                    response = {"ok": False, "message": "Invalid request, expected a JSON object"}
+                writer.write(json.dumps(response).encode("utf-8") + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.clients -= 1
+            writer.close()
+
+    async def start(self, listen):
+        self.server = await startListener(self.serveClient, listen, limit=max_request)
+        return self.server
+
+    def close(self):
+        if self.server:
+            self.server.close()
+            self.server = None
@@ -0,0 +1,79 @@
+#LED_Settings
+#
+#The light and alarm settings as one read only snapshot. A change makes a
+#new snapshot that is checked as a whole and then swapped in with a single
+#assignment, so a frame never mixes an old brightness with a new flux and the
+#flux is always checked against the brightness it will be drawn with.
+
+from LED_Alarms import parseTime
+
+#longest light, seconds, its whole rainbow is built as one table
+MAX_DURATION = 24 * 60 * 60
+
+class Settings:
+    __slots__ = ("duration", "cycles", "brightness", "flux", "alarm_start", "alarm_end")
+
+    def __init__(self, duration=600, cycles=1, brightness=5, flux=10, alarm_start="", alarm_end=""):
+        #raises ValueError naming the first setting that is not valid
+        for name, value in zip(self.__slots__, (duration, cycles, brightness, flux, alarm_start, alarm_end)):
+            object.__setattr__(self, name, value)
+        problem = self.problem()
+        if problem:
+            raise ValueError(problem)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("settings are read only, use replace")
+
+    def __delattr__(self, name):
+        raise AttributeError("settings are read only, use replace")
+
+    def problem(self):
+        #what is wrong with these settings, empty when nothing is
+        for name in ("duration", "cycles", "brightness", "flux"):
+            if type(getattr(self, name)) is not int:
+                return "light " + name + " must be a whole number"
+        if self.duration <= 0 or self.duration > MAX_DURATION:
+            return "light duration must be greater than zero and at most " + str(MAX_DURATION) + " seconds"
+        if self.cycles <= 0:
+            return "light cycles must be greater than zero"
+        if self.brightness < 0 or self.brightness > 255:
+            return "light brightness must be >= 0 and <= 255"
+        #below zero the rainbow is only clipped to off, as the default brightness 5
+        #and flux 10 are, above 255 there is no duty cycle to draw it with
+        if self.flux < 0 or self.brightness + self.flux > 255:
+            return "light flux must be >= 0 and have brightness + flux <= 255"
+        for name in ("alarm_start", "alarm_end"):
+            value = getattr(self, name)
+            if value and parseTime(value) < 0:
+                return name.replace("_", " ") + " must be hour:minute"
+        #the same start and end is no alarm at all
+        if self.alarm_start and self.alarm_end and parseTime(self.alarm_start) == parseTime(self.alarm_end):
+            return "alarm start and end must differ"
+        return ""
+
+    def replace(self, **changes):
+        #a new snapshot with changes, raises ValueError when it is not valid
+        values = dict((name, getattr(self, name)) for name in self.__slots__)
+        for name in changes:
+            if name not in values:
+                raise TypeError("no setting named " + name)
+        values.update(changes)
+        return Settings(**values)
+
+    def light(self):
+        return (self.duration, self.cycles, self.brightness, self.flux)
+
+    def values(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        return isinstance(other, Settings) and self.values() == other.values()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.values())
+
+    def __repr__(self):
+        return "Settings(" + ", ".join(name + "=" + repr(getattr(self, name)) for name in self.__slots__) + ")"
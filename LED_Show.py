@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+#LED_Show
+#
+#Compiled show files. A show is rendered once, ahead of time, into a binary
+#file holding a small header then one packed uint8 array per channel, red,
+#green, blue of each zone in turn, the same layout as a FrameTable. Playing a
+#show maps the file into memory so frames are read straight from the page
+#cache, there is no math per frame and memory use does not grow with the
+#length of the show.
+#
+#usage: LED_Show.py <output> [--config file] [--effect rainbow|alarm]
+#                   [--duration seconds] [--cycles n] [--brightness n] [--flux n]
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+
+from LED_Effects import Effect
+from LED_Frames import FrameTable
+
+SHOW_MAGIC = b"LEDSHOW\0"
+SHOW_VERSION = 1
+#magic, version, channels, frame delay in microseconds, frames
+SHOW_HEADER = struct.Struct("<8sHHIQ")
+#frames looked through at once for the next change, 5 minutes at 10 frames a second
+show_scan = 3000
+
+def delayMicroseconds(delay):
+    return int(round(delay * 1000000))
+
+def compileShow(path, effect, delay):
+    #renders every frame of effect into path, written beside it and moved into
+    #place so a show being played is never seen half written
+    if effect.length is None:
+        raise ValueError("show needs an effect that ends")
+    length = effect.length
+    channels = len(effect.frame(0))
+    temp_path = path + ".tmp"
+    with open(temp_path, "w+b") as show_file:
+        show_file.write(SHOW_HEADER.pack(SHOW_MAGIC, SHOW_VERSION, channels, delayMicroseconds(delay), length))
+        show_file.truncate(SHOW_HEADER.size + channels * length)
+        data = mmap.mmap(show_file.fileno(), 0)
+        try:
+            #frames are written as they are made, only one is held at a time
+            for i, frame in enumerate(effect.frames()):
+                for channel, value in enumerate(frame):
+                    data[SHOW_HEADER.size + channel * length + i] = value
+            data.flush()
+        finally:
+            data.close()
+    os.replace(temp_path, path)
+    return length
+
+class Show(Effect):
+    #plays a compiled show file, raises OSError or ValueError when it can't be read
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self.file.close()
+            raise ValueError(path + " is not a show file")
+
+        try:
+            magic, version, channels, delay, length = SHOW_HEADER.unpack_from(self.map)
+        except struct.error:
+            magic = None
+        if magic != SHOW_MAGIC or version != SHOW_VERSION or not channels or \
+                len(self.map) < SHOW_HEADER.size + channels * length:
+            self.close()
+            raise ValueError(path + " is not a show file")
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            self.map.madvise(mmap.MADV_SEQUENTIAL)
+
+        #each channel is a view into the mapped file, nothing is copied
+        view = memoryview(self.map)
+        start = SHOW_HEADER.size
+        self.table = FrameTable(*(view[start + channel * length:start + (channel + 1) * length]
+                                  for channel in range(channels)))
+        view.release()
+        self.channel_count = channels
+        self.delay = delay / 1000000
+        self.length = length
+
+    def frame(self, i):
+        return self.table.frame(i)
+
+    def nextChange(self, i):
+        #read from the mapped file a window at a time, memory use stays the same however long the show
+        return self.table.scanChange(i, show_scan)
+
+    def matches(self, channels, delay):
+        #true when the show was compiled for this many channels at this frame rate
+        return self.channel_count == channels and delayMicroseconds(self.delay) == delayMicroseconds(delay)
+
+    def close(self):
+        table = getattr(self, "table", None)
+        if table:
+            for channel in table.channels:
+                channel.release()
+            self.table = None
+        if self.map:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the light or alarm of LED_Main.ini into a show file")
+    parser.add_argument("output")
+    parser.add_argument("--config", help="config file to read, LED_Main's by default")
+    parser.add_argument("--effect", choices=("rainbow", "alarm"), default="rainbow")
+    parser.add_argument("--duration", type=int, help="seconds, overrides the config")
+    parser.add_argument("--cycles", type=int, help="overrides the config")
+    parser.add_argument("--brightness", type=int, help="overrides the config")
+    parser.add_argument("--flux", type=int, help="overrides the config")
+    args = parser.parse_args()
+
+    #compiling needs no Pi, the stand-in is used when pigpio is not installed
+    try:
+        import pigpio
+    except ImportError:
+        import LED_FakePigpio
+        sys.modules["pigpio"] = LED_FakePigpio
+    import LED_Main
+
+    if args.config:
+        LED_Main.config_file_name = args.config
+    LED_Main.loadConfig()
+    overrides = dict((name, getattr(args, name)) for name in ("duration", "cycles", "brightness", "flux")
+                     if getattr(args, name) is not None)
+    try:
+        LED_Main.settings = LED_Main.settings.replace(**overrides)
+    except ValueError as error:
+        parser.error(str(error))
+
+    if args.effect == "alarm":
+        effect = LED_Main.alarmEffect(int(LED_Main.settings.duration / LED_Main.sleep_delay))
+    else:
+        effect = LED_Main.lightEffect()
+    length = compileShow(args.output, effect, LED_Main.sleep_delay)
+    print ("Compiled " + str(length) + " frames of " + str(len(LED_Main.zones)) + " zones to " + args.output)
+
+if __name__ == "__main__":
+    main()
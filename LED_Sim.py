@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+#LED_Sim
+#
+#Runs LED_Main's lights and alarms on virtual time. The event loop never
+#waits, whenever every task is asleep its clock jumps to the next timer, so a
+#600 second light or an alarm hours away plays out in moments. The same run
+#always writes the same frames. An audio file is read one frame of sound per
+#frame, so it stays in step with them. Output goes to a RecordingBackend and
+#can be written out as a trace, CSV or a NumPy .npz file.
+#
+#usage: LED_Sim.py [--config file] [--start "YYYY-MM-DD HH:MM"] [--light]
+#                  [--alarm start end] [--audio file.wav] [--for seconds]
+#                  [--trace file.csv|file.npz]
+
+import argparse
+import asyncio
+import csv
+import selectors
+import sys
+import time
+
+#no Pi is needed, the stand-in is used when pigpio is not installed
+try:
+    import pigpio
+except ImportError:
+    import LED_FakePigpio as pigpio
+    sys.modules["pigpio"] = pigpio
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import LED_Main
+import LED_Metrics
+import LED_Scheduler
+from LED_Output import RecordingBackend
+
+class SimSelector(selectors.DefaultSelector):
+    #waiting takes no time, the loop's clock is moved on by the wait instead
+    def __init__(self, loop):
+        selectors.DefaultSelector.__init__(self)
+        self.loop = loop
+
+    def select(self, timeout=None):
+        if timeout:
+            self.loop.now += timeout
+        return selectors.DefaultSelector.select(self, 0)
+
+class SimLoop(asyncio.SelectorEventLoop):
+    def __init__(self):
+        self.now = 0.0
+        asyncio.SelectorEventLoop.__init__(self, SimSelector(self))
+
+    def time(self):
+        return self.now
+
+class SimClock:
+    #clock for LED_Scheduler.useClock reading the time of a SimLoop
+    def __init__(self, loop, wall):
+        self.loop = loop
+        self.wall = wall
+
+    def monotonic(self):
+        return self.loop.now
+
+    def time(self):
+        return self.wall + self.loop.now
+
+    async def asyncSleep(self, seconds):
+        await asyncio.sleep(seconds)
+
+def writeTrace(path, backend):
+    #one row per written batch, the time in seconds then every pin's duty cycle
+    rows = list(backend.trace())
+    if path.endswith(".npz"):
+        if numpy is None:
+            raise ValueError("writing .npz traces needs numpy")
+        numpy.savez_compressed(path,
+                               time=numpy.array([when for when, _ in rows], dtype=numpy.float64),
+                               pins=numpy.array(backend.pins, dtype=numpy.int32),
+                               duty=numpy.array([duty for _, duty in rows], dtype=numpy.uint8).reshape(len(rows), len(backend.pins)))
+        return len(rows)
+    with open(path, "w", newline="") as trace_file:
+        writer = csv.writer(trace_file)
+        writer.writerow(["time"] + ["pin" + str(pin) for pin in backend.pins])
+        for when, duty in rows:
+            writer.writerow([repr(round(when, 6))] + list(duty))
+    return len(rows)
+
+async def simulate(run_for, light, alarm, audio):
+    LED_Main.alarm_changed = asyncio.Event()
+    LED_Main.alarm_queue.changed = LED_Main.alarm_changed.set
+    if light:
+        LED_Main.startLightTask()
+    if alarm:
+        LED_Main.startAlarmTask()
+    if audio:
+        LED_Main.startAudioTask(audio)
+    await asyncio.sleep(run_for)
+    LED_Main.stopAlarmTask()
+    LED_Main.stopAudioTask()
+    LED_Main.stopLightTask()
+    #let the cancelled tasks finish before the loop is closed
+    others = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    await asyncio.gather(*others, return_exceptions=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Play LED_Main's lights and alarms on virtual time")
+    parser.add_argument("--config", help="config file to load first")
+    parser.add_argument("--start", help="time of day the run starts at, YYYY-MM-DD HH:MM, now by default")
+    parser.add_argument("--light", action="store_true", help="start the light, the default without alarms")
+    parser.add_argument("--alarm", nargs=2, metavar=("START", "END"), help="set the alarm, HH:MM HH:MM")
+    parser.add_argument("--audio", help="WAV file for the lights to follow")
+    parser.add_argument("--for", dest="run_for", type=float,
+                        help="seconds to run, until the light or the next alarm ends by default")
+    parser.add_argument("--trace", help="file to write the frames to, .csv or .npz")
+    args = parser.parse_args()
+
+    wall = time.time()
+    if args.start:
+        try:
+            wall = time.mktime(time.strptime(args.start, "%Y-%m-%d %H:%M"))
+        except ValueError:
+            parser.error("--start must be YYYY-MM-DD HH:MM")
+
+    loop = SimLoop()
+    asyncio.set_event_loop(loop)
+    clock = SimClock(loop, wall)
+    LED_Scheduler.useClock(clock)
+    backend = RecordingBackend(clock.monotonic)
+    LED_Main.backend = backend
+
+    if args.config:
+        LED_Main.config_file_name = args.config
+        if not LED_Main.loadConfig():
+            print ("Config not fully loaded, see above")
+    if args.alarm:
+        if not (LED_Main.checkValidTime(args.alarm[0]) and LED_Main.checkValidTime(args.alarm[1])):
+            parser.error("--alarm needs a start and end time, HH:MM HH:MM")
+        LED_Main.settings = LED_Main.settings.replace(alarm_start=LED_Main.checkValidTime(args.alarm[0]),
+                                                      alarm_end=LED_Main.checkValidTime(args.alarm[1]))
+        LED_Main.setMainAlarm()
+
+    audio = None
+    if args.audio:
+        try:
+            audio = LED_Main.AudioEffect(args.audio, LED_Main.sleep_delay, LED_Main.settings.brightness,
+                                         LED_Main.settings.flux, LED_Main.zoneScales())
+        except (OSError, ValueError) as error:
+            parser.error("--audio " + args.audio + ": " + str(error))
+        if not audio.paced:
+            parser.error("--audio needs a file, a pipe can't be read on virtual time")
+
+    alarm = LED_Main.checkAlarmSet()
+    light = args.light or not (alarm or audio)
+    run_for = args.run_for
+    if run_for is None:
+        run_for = 0
+        if light:
+            run_for = LED_Main.settings.duration
+        if alarm:
+            #the alarm due first is the one ending first, windows never overlap themselves
+            run_for = max(run_for, min(start + next_alarm.length for start, _, next_alarm in LED_Main.alarm_queue.heap) - wall)
+        if audio:
+            run_for = max(run_for, audio.length * LED_Main.sleep_delay)
+        run_for += LED_Main.sleep_delay
+
+    real_start = time.perf_counter()
+    loop.run_until_complete(simulate(run_for, light, alarm, audio))
+    real = time.perf_counter() - real_start
+    loop.close()
+    LED_Scheduler.useClock(None)
+
+    writes = sum(len(changes) for _, changes in backend.batches)
+    print ("Simulated " + str(round(run_for, 1)) + "s from " +
+           time.strftime("%Y-%m-%d %H:%M", time.localtime(wall)) + " in " + str(round(real * 1000, 1)) + "ms")
+    print ("Batches: " + str(len(backend.batches)) + ", channel writes: " + str(writes))
+    if audio:
+        latency = LED_Metrics.audio_latency
+        print ("Audio: " + str(latency.count) + " frames written, " + str(audio.underruns) + " without sound, " +
+               "sound read to frame written mean " + str(round(latency.mean() * 1000, 2)) + "ms, max " +
+               str(round(latency.max * 1000, 2)) + "ms")
+    if args.trace:
+        try:
+            rows = writeTrace(args.trace, backend)
+        except (OSError, ValueError) as error:
+            print ("Could not write the trace: " + str(error))
+            return 1
+        print ("Trace of " + str(rows) + " rows written to " + args.trace)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
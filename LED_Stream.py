@@ -0,0 +1,160 @@
+#LED_Stream
+#
+#Streams the frames written to the LEDs as Server-Sent Events over local
+#HTTP, with a small preview page at / that draws every zone's color. The
+#render loop only turns each frame into one message and appends it to every
+#viewer's buffer, it never waits on a viewer. Each buffer holds a few frames,
+#a viewer that can't keep up loses its oldest ones instead of slowing anyone.
+
+import asyncio
+import collections
+import json
+
+from LED_Server import startListener
+
+#frames kept for each viewer before the oldest are dropped
+client_buffer = 8
+
+PREVIEW_PAGE = b"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>LED Preview</title>
+<style>
+body { background: #111; color: #ccc; font-family: sans-serif; }
+#zones div { display: inline-block; width: 120px; height: 120px; margin: 8px; border-radius: 8px; }
+</style>
+</head>
+<body>
+<div id="zones"></div>
+<p id="status">connecting</p>
+<script>
+var zones = document.getElementById("zones");
+var statusLine = document.getElementById("status");
+var events = new EventSource("/events");
+events.onmessage = function (event) {
+    var frame = JSON.parse(event.data);
+    var count = Math.floor(frame.values.length / 3);
+    while (zones.children.length < count) {
+        zones.appendChild(document.createElement("div"));
+    }
+    while (zones.children.length > count) {
+        zones.removeChild(zones.lastChild);
+    }
+    for (var i = 0; i < count; i++) {
+        var v = frame.values.slice(i * 3, i * 3 + 3);
+        zones.children[i].style.background = "rgb(" + v.join(",") + ")";
+    }
+    statusLine.textContent = "frame " + frame.tick + ", pins " + frame.pins.join(",");
+};
+events.onerror = function () {
+    statusLine.textContent = "disconnected";
+};
+</script>
+</body>
+</html>
+"""
+
+class StreamClient:
+    def __init__(self):
+        self.buffer = collections.deque(maxlen=client_buffer)
+        self.ready = asyncio.Event()
+        self.dropped = 0
+        self.open = True
+
+class FrameStream:
+    def __init__(self):
+        self.clients = set()
+        #last message, sent first to new viewers so they start with the current colors
+        self.last = None
+        self.server = None
+        #optional Gauge and Counter of LED_Metrics for viewers and dropped frames
+        self.clients_gauge = None
+        self.dropped_counter = None
+        #called when a viewer joins, so frames stop being handed out ahead
+        self.changed = None
+
+    def publish(self, tick, pins, frame):
+        #called by the render loop, returns at once however many viewers there are
+        data = json.dumps({"tick": tick, "pins": list(pins), "values": list(frame)}, separators=(",", ":"))
+        self.last = ("data: " + data + "\n\n").encode()
+        for client in self.clients:
+            if len(client.buffer) == client.buffer.maxlen:
+                client.dropped += 1
+                if self.dropped_counter:
+                    self.dropped_counter.inc()
+            client.buffer.append(self.last)
+            client.ready.set()
+
+    def setClients(self):
+        if self.clients_gauge:
+            self.clients_gauge.set(len(self.clients))
+
+    async def serveEvents(self, writer):
+        client = StreamClient()
+        if self.last:
+            client.buffer.append(self.last)
+            client.ready.set()
+        self.clients.add(client)
+        self.setClients()
+        if self.changed:
+            self.changed()
+        try:
+            writer.write(b"HTTP/1.1 200 OK\r\n"
+                         b"Content-Type: text/event-stream\r\n"
+                         b"Cache-Control: no-cache\r\n"
+                         b"Connection: close\r\n\r\n")
+            while client.open:
+                await client.ready.wait()
+                client.ready.clear()
+                while client.buffer:
+                    writer.write(client.buffer.popleft())
+                #only this viewer waits for its socket, frames keep arriving in its buffer
+                await writer.drain()
+        finally:
+            self.clients.discard(client)
+            self.setClients()
+
+    async def handleRequest(self, reader, writer):
+        try:
+            request = await reader.readline()
+            #headers are read and ignored
+            while True:
+                line = await reader.readline()
+                if not line or line in (b"\r\n", b"\n"):
+                    break
+            parts = request.decode("latin-1").split()
+            path = parts[1].split("?")[0] if len(parts) >= 2 and parts[0] == "GET" else ""
+            if path == "/events":
+                await self.serveEvents(writer)
+                return
+            if path == "/":
+                status = "200 OK"
+                content_type = "text/html; charset=utf-8"
+                body = PREVIEW_PAGE
+            else:
+                status = "404 Not Found"
+                content_type = "text/plain"
+                body = b"not found\n"
+            writer.write(("HTTP/1.0 " + status + "\r\n"
+                          "Content-Type: " + content_type + "\r\n"
+                          "Content-Length: " + str(len(body)) + "\r\n\r\n").encode() + body)
+            await writer.drain()
+        except (ConnectionError, UnicodeDecodeError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, listen):
+        #listen is host:port, or a path for a unix socket
+        self.server = await startListener(self.handleRequest, listen)
+        return self.server
+
+    def close(self):
+        #viewers still connected are let go once their buffer is sent
+        for client in self.clients:
+            client.open = False
+            client.ready.set()
+        if self.server:
+            self.server.close()
+            self.server = None
@@ -0,0 +1,110 @@
+#LED_Sync
+#
+#Keeps the lights of several Pis in step. Every node counts frames from the
+#same epoch on a shared clock instead of from when it was started, so nodes
+#started at different times still show the same frame. The shared clock is
+#the leader's wall clock: the leader broadcasts its time over UDP once a
+#second and followers keep the offset between it and their own clock. The
+#delay of a packet only makes the leader look earlier, so the largest of the
+#recent samples is the best estimate.
+
+import asyncio
+import collections
+import socket
+import struct
+import time
+
+SYNC_PORT = 5570
+SYNC_MAGIC = b"LEDS"
+SYNC_VERSION = 1
+#magic, version, sequence, leader time
+SYNC_PACKET = struct.Struct("!4sBxHd")
+
+#seconds between leader broadcasts, and how many samples a follower keeps
+sync_interval = 1.0
+sync_samples = 8
+
+class SyncClock:
+    def __init__(self, role="follower", host="", port=SYNC_PORT, epoch=0.0):
+        #role is leader or follower, host is where the leader sends, broadcast when empty
+        if role not in ("leader", "follower"):
+            raise ValueError("sync role must be leader or follower")
+        self.role = role
+        self.host = host or "255.255.255.255"
+        self.port = port
+        #shared clock time frame 0 was due at, the same on every node
+        self.epoch = epoch
+        self.offset = 0.0
+        self.samples = collections.deque(maxlen=sync_samples)
+        self.sequence = 0
+        self.leader = None
+        self.received = 0
+        #optional Gauge of LED_Metrics for the offset
+        self.offset_gauge = None
+        self.sock = None
+
+    def now(self):
+        #the shared clock, this node's wall clock moved onto the leader's
+        return time.time() + self.offset
+
+    def packet(self):
+        self.sequence = (self.sequence + 1) % 65536
+        return SYNC_PACKET.pack(SYNC_MAGIC, SYNC_VERSION, self.sequence, time.time())
+
+    def receive(self, data, address):
+        #takes one leader packet, returns False when it is not one
+        received = time.time()
+        if len(data) != SYNC_PACKET.size:
+            return False
+        magic, version, _, leader_time = SYNC_PACKET.unpack(data)
+        if magic != SYNC_MAGIC or version != SYNC_VERSION:
+            return False
+        self.samples.append(leader_time - received)
+        self.offset = max(self.samples)
+        self.leader = address[0]
+        self.received += 1
+        if self.offset_gauge:
+            self.offset_gauge.set(self.offset)
+        return True
+
+    def describe(self):
+        if self.role == "leader":
+            return "leader, sending to " + self.host + ":" + str(self.port)
+        if self.leader is None:
+            return "follower, no leader heard yet"
+        return ("follower of " + self.leader + ", offset " + str(round(self.offset * 1000, 2)) + "ms")
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.setblocking(False)
+        try:
+            if self.role == "leader":
+                self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+                while True:
+                    try:
+                        self.sock.sendto(self.packet(), (self.host, self.port))
+                    except OSError:
+                        #no route yet, the next broadcast tries again
+                        pass
+                    await asyncio.sleep(sync_interval)
+
+            self.sock.bind(("", self.port))
+            ready = asyncio.Event()
+            loop.add_reader(self.sock.fileno(), ready.set)
+            try:
+                while True:
+                    await ready.wait()
+                    ready.clear()
+                    try:
+                        while True:
+                            data, address = self.sock.recvfrom(64)
+                            self.receive(data, address)
+                    except BlockingIOError:
+                        pass
+            finally:
+                loop.remove_reader(self.sock.fileno())
+        finally:
+            self.sock.close()
+            self.sock = None
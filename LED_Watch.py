@@ -0,0 +1,109 @@
+#LED_Watch
+#
+#Watches the config file for edits. On Linux the directory is watched with
+#inotify so a change is seen as soon as the file is written, elsewhere the
+#file is checked with os.stat on a short period. Either way the callback only
+#runs when the file's size, modification time or inode has changed, so it is
+#only parsed after a real edit.
+
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import struct
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+#wd, mask, cookie, name length, then the name
+EVENT_HEADER = struct.Struct("iIII")
+
+#seconds between stat checks when inotify is not available
+poll_delay = 1.0
+#seconds to let an editor finish writing before the file is looked at
+settle_delay = 0.05
+
+def openInotify(directory):
+    #inotify file descriptor watching directory, None when it can't be had
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_MODIFY
+    if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+class ConfigWatcher:
+    def __init__(self, path, changed):
+        self.path = path
+        self.changed = changed
+        self.last = self.signature()
+        self.fd = None
+
+    def signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def check(self):
+        signature = self.signature()
+        if signature != self.last:
+            self.last = signature
+            if signature is not None:
+                self.changed()
+
+    def readEvents(self):
+        #true when one of the events is about the watched file
+        name = os.fsencode(os.path.basename(self.path))
+        found = False
+        try:
+            while True:
+                data = os.read(self.fd, 4096)
+                offset = 0
+                while offset + EVENT_HEADER.size <= len(data):
+                    _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+                    offset += EVENT_HEADER.size
+                    if data[offset:offset + length].rstrip(b"\0") == name:
+                        found = True
+                    offset += length
+        except BlockingIOError:
+            pass
+        return found
+
+    async def run(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        self.fd = openInotify(directory)
+        if self.fd is None:
+            while True:
+                await asyncio.sleep(poll_delay)
+                self.check()
+
+        loop = asyncio.get_event_loop()
+        ready = asyncio.Event()
+        loop.add_reader(self.fd, ready.set)
+        try:
+            while True:
+                await ready.wait()
+                ready.clear()
+                if self.readEvents():
+                    await asyncio.sleep(settle_delay)
+                    #events that came in while settling are about the same edit
+                    self.readEvents()
+                    ready.clear()
+                    self.check()
+        finally:
+            loop.remove_reader(self.fd)
+            os.close(self.fd)
+            self.fd = None
@@ -0,0 +1,68 @@
+#LED_Zones
+#
+#A zone is one RGB strip on its own three gpio pins. Every zone has an
+#effect, a phase offset into the rainbow and a brightness percent, and all
+#zones are rendered together by the one light loop.
+
+from LED_Frames import ZONE_EFFECTS
+
+#config section prefix and keys of a zone
+config_zone_prefix = "zone:"
+config_zone_red = "red"
+config_zone_green = "green"
+config_zone_blue = "blue"
+config_zone_effect = "effect"
+config_zone_phase = "phase"
+config_zone_brightness = "brightness"
+
+#highest pin, broadcom numbering of the user gpios, network outputs use DMX channels instead
+GPIO_LIMIT = 31
+
+def checkPin(pin, limit=GPIO_LIMIT):
+    try:
+        new_pin = int(pin)
+    except:
+        return False
+    return new_pin >= 0 and new_pin <= limit
+
+class Zone:
+    def __init__(self, name, pins, effect="rainbow", phase=0, brightness=100, limit=GPIO_LIMIT):
+        if len(pins) != 3 or not all(checkPin(pin, limit) for pin in pins):
+            raise ValueError("zone needs a red, green and blue gpio pin")
+        if effect not in ZONE_EFFECTS:
+            raise ValueError("zone effect must be one of " + ", ".join(ZONE_EFFECTS))
+        if brightness < 0 or brightness > 100:
+            raise ValueError("zone brightness is a percent from 0 to 100")
+        self.name = name
+        self.pins = tuple(int(pin) for pin in pins)
+        self.effect = effect
+        self.phase = phase % 360
+        self.brightness = brightness
+
+    def spec(self):
+        #what the frame table needs to draw this zone
+        return (self.effect, self.phase, self.brightness)
+
+    def describe(self):
+        return (self.name + ": pins " + ",".join(str(pin) for pin in self.pins) +
+                " " + self.effect + " phase " + str(self.phase) +
+                " brightness " + str(self.brightness) + "%")
+
+def loadZone(name, section, limit=GPIO_LIMIT):
+    #builds a zone from its config section, raises KeyError or ValueError
+    return Zone(name,
+                (section[config_zone_red], section[config_zone_green], section[config_zone_blue]),
+                section.get(config_zone_effect, "rainbow"),
+                float(section.get(config_zone_phase, "0")),
+                float(section.get(config_zone_brightness, "100")),
+                limit)
+
+def saveZone(zone):
+    return {
+        config_zone_red: str(zone.pins[0]),
+        config_zone_green: str(zone.pins[1]),
+        config_zone_blue: str(zone.pins[2]),
+        config_zone_effect: zone.effect,
+        config_zone_phase: str(zone.phase),
+        config_zone_brightness: str(zone.brightness),
+    }
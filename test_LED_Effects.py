@@ -0,0 +1,108 @@
+#test_LED_Effects
+#
+#Frames and next changes of the effects and stages, and the layers composing
+#them, checked frame by frame against what a renderer would draw.
+#
+#usage: python3 -m pytest test_LED_Effects.py, or python3 test_LED_Effects.py
+
+import unittest
+
+from LED_Effects import Static, Fade, Chase, Blend, Scale, Pulse, Layers
+
+def firstChange(effect, i, end):
+    #the next change found the slow way, frame by frame
+    values = effect.frame(i)
+    for j in range(i + 1, end):
+        if effect.frame(j) != values:
+            return j
+    return None
+
+class TestEffects(unittest.TestCase):
+    def testStatic(self):
+        effect = Static((300, 20, -5))
+        self.assertEqual(effect.frame(0), (255, 20, 0))
+        self.assertEqual(effect.frame(1000), (255, 20, 0))
+        self.assertIsNone(effect.nextChange(0))
+        self.assertIsNone(effect.length)
+
+    def testFade(self):
+        effect = Fade((0, 100, 10), (30, 100, 0), 31)
+        self.assertEqual(effect.frame(0), (0, 100, 10))
+        self.assertEqual(effect.frame(15), (15, 100, 5))
+        self.assertEqual(effect.frame(30), (30, 100, 0))
+        self.assertEqual(effect.length, 31)
+
+    def testFadeNextChange(self):
+        #a slow fade only changes every few frames, each change is found exactly
+        effect = Fade((0, 0, 0), (5, 3, 0), 100)
+        for i in range(effect.length):
+            expected = firstChange(effect, i, effect.length)
+            self.assertEqual(effect.nextChange(i), effect.length if expected is None else expected)
+
+    def testChase(self):
+        effect = Chase((10, 20, 30), 3, 2)
+        self.assertEqual(effect.frame(0), (10, 20, 30, 0, 0, 0, 0, 0, 0))
+        self.assertEqual(effect.frame(1), (10, 20, 30, 0, 0, 0, 0, 0, 0))
+        self.assertEqual(effect.frame(2), (0, 0, 0, 10, 20, 30, 0, 0, 0))
+        self.assertEqual(effect.frame(5), (0, 0, 0, 0, 0, 0, 10, 20, 30))
+        self.assertEqual(effect.frame(6), effect.frame(0))
+        for i in range(12):
+            self.assertEqual(effect.nextChange(i), firstChange(effect, i, 20))
+
+    def testChaseSingleZone(self):
+        effect = Chase((10, 20, 30), 1, 5)
+        self.assertEqual(effect.frame(7), (10, 20, 30))
+        self.assertIsNone(effect.nextChange(0))
+
+    def testBlend(self):
+        effect = Blend(Static((0, 100, 200)), Chase((100, 100, 100), 1, 1), 0.5)
+        self.assertEqual(effect.frame(0), (50, 100, 150))
+        self.assertIsNone(effect.nextChange(0))
+        self.assertIsNone(effect.length)
+
+    def testBlendLengthAndChanges(self):
+        #the shorter effect ends the blend, the sooner change of the two is next
+        effect = Blend(Fade((0,) * 6, (100,) * 6, 11), Chase((50, 50, 50), 2, 4), 0.5)
+        self.assertEqual(effect.length, 11)
+        self.assertEqual(effect.frame(0), (25, 25, 25, 0, 0, 0))
+        self.assertEqual(effect.frame(10), (75, 75, 75, 50, 50, 50))
+        for i in range(10):
+            self.assertEqual(effect.nextChange(i), min(i + 1, (i // 4 + 1) * 4))
+
+    def testScale(self):
+        effect = Scale(Chase((100, 100, 100), 2, 3), [1.0, 0.5, 0.0, 0.5, 0.5, 0.5])
+        self.assertEqual(effect.frame(0), (100, 50, 0, 0, 0, 0))
+        self.assertEqual(effect.frame(3), (0, 0, 0, 50, 50, 50))
+        self.assertEqual(effect.nextChange(0), 3)
+
+    def testPulse(self):
+        effect = Pulse((1, 0, 0), 100, 4, 1)
+        self.assertEqual(effect.frame(0), (0, 0, 0))
+        self.assertEqual(effect.frame(1), (100, 0, 0))
+        self.assertEqual(effect.frame(2), (0, 0, 0))
+
+class TestLayers(unittest.TestCase):
+    def testHigherLayerCovers(self):
+        layers = Layers()
+        layers.add("light", Static((10, 10, 10)), 0)
+        layers.add("effect", Chase((90, 90, 90), 1, 1), 2)
+        self.assertEqual(layers.frame(0), (90, 90, 90))
+        layers.remove("effect")
+        self.assertEqual(layers.frame(1), (10, 10, 10))
+
+    def testEndingLayer(self):
+        #a fade ends, calls ended and uncovers the layer below
+        ended = []
+        layers = Layers()
+        layers.add("light", Static((10, 10, 10)), 0)
+        layers.add("effect", Fade((0, 0, 0), (40, 40, 40), 5), 2, ended=lambda: ended.append(True))
+        self.assertEqual(layers.frame(0), (0, 0, 0))
+        self.assertEqual(layers.nextChange(0), 1)
+        self.assertEqual(layers.frame(4), (40, 40, 40))
+        self.assertEqual(layers.nextChange(4), 5)
+        self.assertEqual(layers.frame(5), (10, 10, 10))
+        self.assertEqual(ended, [True])
+        self.assertIsNone(layers.nextChange(5))
+
+if __name__ == "__main__":
+    unittest.main()
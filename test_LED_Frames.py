@@ -0,0 +1,52 @@
+#test_LED_Frames
+#
+#Rainbow tables built in chunks and a segment at a time, checked against the
+#same table built whole in one pass.
+#
+#usage: python3 -m pytest test_LED_Frames.py, or python3 test_LED_Frames.py
+
+import unittest
+
+import LED_Frames
+from LED_Frames import SegmentTable, buildRainbowTable, getRainbowTable, clearTableCache
+
+ZONES = (("rainbow", 0, 100), ("rainbow", 90, 50), ("static", 0, 100))
+
+class TestRainbowTables(unittest.TestCase):
+    def setUp(self):
+        self.saved = (LED_Frames.build_chunk, LED_Frames.table_frame_limit, LED_Frames.segment_frames)
+        clearTableCache()
+
+    def tearDown(self):
+        LED_Frames.build_chunk, LED_Frames.table_frame_limit, LED_Frames.segment_frames = self.saved
+        clearTableCache()
+
+    def testChunkedBuild(self):
+        whole = buildRainbowTable(60, 2, 40, 30, 0.1, ZONES, 0.5)
+        LED_Frames.build_chunk = 7
+        chunked = buildRainbowTable(60, 2, 40, 30, 0.1, ZONES, 0.5)
+        self.assertEqual(chunked.length, whole.length)
+        self.assertEqual([bytes(channel) for channel in chunked.channels], [bytes(channel) for channel in whole.channels])
+
+    def testSegments(self):
+        #a dim rainbow changes every few frames, often across a segment's end
+        whole = buildRainbowTable(100, 1, 5, 10, 0.1, ZONES)
+        LED_Frames.table_frame_limit = 100
+        LED_Frames.segment_frames = 40
+        table = getRainbowTable(100, 1, 5, 10, 0.1, ZONES)
+        self.assertIsInstance(table, SegmentTable)
+        self.assertEqual(table.length, whole.length)
+        for i in range(whole.length):
+            self.assertEqual(table.frame(i), whole.frame(i))
+            change = table.nextChange(i)
+            expected = whole.nextChange(i)
+            #a change is found within two segments, past them the end of the second is returned
+            if expected <= (i // 40 + 2) * 40:
+                self.assertEqual(change, expected)
+            else:
+                self.assertEqual(change, (i // 40 + 2) * 40)
+        self.assertLessEqual(len(table.segments), LED_Frames.segment_cache)
+        self.assertRaises(IndexError, table.frame, whole.length)
+
+if __name__ == "__main__":
+    unittest.main()
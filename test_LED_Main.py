@@ -0,0 +1,324 @@
+#test_LED_Main
+#
+#LED_Main's commands and render task on virtual time, with the stand-in for
+#pigpio and a FakeBackend in place of the pins.
+#
+#usage: python3 -m pytest test_LED_Main.py, or python3 test_LED_Main.py
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import unittest
+import wave
+
+#no Pi is needed, the stand-in is used when pigpio is not installed
+try:
+    import pigpio
+except ImportError:
+    import LED_FakePigpio
+    sys.modules["pigpio"] = LED_FakePigpio
+
+import LED_Audio
+import LED_Main
+import LED_Metrics
+import LED_Scheduler
+from LED_Checkpoint import CheckpointFile, PlaybackState, readCheckpoint
+from LED_Output import FakeBackend
+from LED_Settings import Settings
+from LED_Sim import SimLoop, SimClock
+
+class SlowBackend(FakeBackend):
+    #a FakeBackend whose writes take a few milliseconds of real time, like a slow output
+    def writeFrame(self, frame):
+        time.sleep(0.003)
+        return FakeBackend.writeFrame(self, frame)
+
+class FailingBackend(FakeBackend):
+    #a FakeBackend whose output goes away once fail is set
+    def __init__(self):
+        FakeBackend.__init__(self)
+        self.fail = False
+
+    def writeFrame(self, frame):
+        if self.fail:
+            raise OSError(5, "Input/output error")
+        return FakeBackend.writeFrame(self, frame)
+
+def renderTasks():
+    return [task for task in asyncio.all_tasks() if not task.done() and task.get_coro().__name__ == "runRender"]
+
+class MainTest(unittest.TestCase):
+    #every test starts on a fresh loop on virtual time with the defaults and nothing playing
+    def setUp(self):
+        self.loop = SimLoop()
+        asyncio.set_event_loop(self.loop)
+        self.clock = SimClock(self.loop, 1700000000.0)
+        LED_Scheduler.useClock(self.clock)
+        self.backend = LED_Main.backend = FakeBackend()
+        LED_Main.settings = Settings()
+        LED_Main.zones = LED_Main.default_zones
+        LED_Main.playback_changed = None
+
+    def tearDown(self):
+        self.runLoop(self.stopAll())
+        self.loop.close()
+        LED_Scheduler.useClock(None)
+        asyncio.set_event_loop(None)
+
+    async def stopAll(self):
+        LED_Main.stopAlarmTask()
+        LED_Main.stopShowTask()
+        LED_Main.stopEffectTask()
+        LED_Main.stopAudioTask()
+        LED_Main.stopLightTask()
+        others = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in others:
+            task.cancel()
+        await asyncio.gather(*others, return_exceptions=True)
+
+    def runLoop(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+class TestRenderTask(MainTest):
+    def testStopStartLeavesOneRenderTask(self):
+        #stopping wakes the idle render task as it is cancelled, the cancel must still end it
+        async def scenario():
+            self.assertTrue(LED_Main.commandStartLight()[0])
+            await asyncio.sleep(1.3)
+            self.assertTrue(LED_Main.commandStopLight()[0])
+            self.assertTrue(LED_Main.commandStartLight()[0])
+            await asyncio.sleep(5)
+            return renderTasks()
+
+        tasks = self.runLoop(scenario())
+        self.assertEqual(len(tasks), 1)
+        self.assertIs(tasks[0], LED_Main.render_task)
+
+    def testChangeWakesIdleRender(self):
+        #the default rainbow idles for seconds between changes, a new brightness is drawn on the next frame
+        async def scenario():
+            LED_Main.commandStartLight()
+            await asyncio.sleep(1.3)
+            submits = self.backend.submits
+            self.assertTrue(LED_Main.commandChangeBrightness("50")[0])
+            await asyncio.sleep(0.25)
+            return self.backend.submits - submits
+
+        self.assertGreater(self.runLoop(scenario()), 0)
+
+    def testBackendErrorStopsEverything(self):
+        #an output that fails ends the render task and nothing is left playing
+        self.backend = LED_Main.backend = FailingBackend()
+
+        async def scenario():
+            LED_Main.commandStartLight()
+            LED_Main.commandStartEffect("chase")
+            await asyncio.sleep(1.3)
+            self.backend.fail = True
+            LED_Main.commandChangeBrightness("50")
+            await asyncio.sleep(0.5)
+            stopped = (LED_Main.light_state, LED_Main.effect_name, LED_Main.layers.active(), renderTasks())
+            #a start once the output is back draws again
+            self.backend.fail = False
+            self.assertTrue(LED_Main.commandStartLight()[0])
+            await asyncio.sleep(0.5)
+            return stopped, len(renderTasks())
+
+        self.assertEqual(self.runLoop(scenario()), ((False, None, False, []), 1))
+        self.assertTrue(LED_Main.light_state)
+
+    @unittest.skipIf(LED_Audio.numpy is None, "audio needs numpy")
+    def testAudioLatencyUntilWritten(self):
+        #every frame made from new sound is measured once it is written, not when analyzed,
+        #so the time the output takes is counted too
+        self.backend = LED_Main.backend = SlowBackend()
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "silence.wav")
+            sound = wave.open(path, "wb")
+            sound.setnchannels(1)
+            sound.setsampwidth(2)
+            sound.setframerate(44100)
+            sound.writeframes(b"\0\0" * 44100)
+            sound.close()
+            counted = LED_Metrics.audio_latency.count
+            total = LED_Metrics.audio_latency.total
+
+            async def scenario():
+                self.assertTrue(LED_Main.commandStartAudio(path)[0])
+                await asyncio.sleep(2)
+            self.runLoop(scenario())
+
+        self.assertIsNone(LED_Main.audio)
+        self.assertEqual(LED_Metrics.audio_latency.count - counted, 10)
+        self.assertGreaterEqual(LED_Metrics.audio_latency.total - total, 10 * 0.003)
+
+class TestEffectCommands(MainTest):
+    def testChaseDrawsOverTheLight(self):
+        #two zones, the chase steps once a second from one to the other
+        LED_Main.zones = [LED_Main.Zone("a", (1, 2, 3)), LED_Main.Zone("b", (4, 5, 6))]
+
+        async def scenario():
+            LED_Main.commandStartLight()
+            self.assertTrue(LED_Main.commandStartEffect("chase")[0])
+            self.assertFalse(LED_Main.commandStartEffect("chase")[0])
+            await asyncio.sleep(0.05)
+            first = dict(self.backend.duty)
+            await asyncio.sleep(1.0)
+            second = dict(self.backend.duty)
+            self.assertTrue(LED_Main.commandStopEffect()[0])
+            return first, second
+
+        first, second = self.runLoop(scenario())
+        self.assertEqual([first[pin] for pin in (1, 2, 3, 4, 5, 6)], [15, 15, 15, 0, 0, 0])
+        self.assertEqual([second[pin] for pin in (1, 2, 3, 4, 5, 6)], [0, 0, 0, 15, 15, 15])
+        self.assertIsNone(LED_Main.effect_name)
+        self.assertEqual(sorted(LED_Main.layers.layers), ["light"])
+
+    def testFadeEnds(self):
+        #fades up over the light duration, then ends and uncovers the rainbow
+        LED_Main.settings = Settings(duration=2)
+
+        async def scenario():
+            LED_Main.commandStartLight()
+            LED_Main.commandStartEffect("fade")
+            await asyncio.sleep(1.0)
+            middle = LED_Main.effect_name
+            await asyncio.sleep(1.5)
+            return middle
+
+        self.assertEqual(self.runLoop(scenario()), "fade")
+        self.assertIsNone(LED_Main.effect_name)
+        self.assertFalse(LED_Main.commandStopEffect()[0])
+
+    def testUnknownEffect(self):
+        ok, message = LED_Main.commandStartEffect("sparkle")
+        self.assertFalse(ok)
+        self.assertIn("static, fade, chase, blend", message)
+
+class TestChangeCommands(MainTest):
+    #the console, the server and the config all take a value only when Settings does
+    def testFluxAboveBrightness(self):
+        self.assertTrue(LED_Main.commandChangeFlux("10")[0])
+        self.assertTrue(LED_Main.commandChangeFlux("20")[0])
+        self.assertTrue(LED_Main.commandChangeBrightness("3")[0])
+        self.assertEqual((LED_Main.settings.brightness, LED_Main.settings.flux), (3, 20))
+
+    def testRefusedByName(self):
+        ok, message = LED_Main.commandChangeBrightness("250")
+        self.assertFalse(ok)
+        self.assertIn("brightness + flux <= 255", message)
+        ok, message = LED_Main.commandChangeFlux("some")
+        self.assertFalse(ok)
+        self.assertIn("light flux must be a whole number", message)
+        ok, message = LED_Main.commandChangeLight("0")
+        self.assertFalse(ok)
+        self.assertIn("light duration must be greater than zero", message)
+        self.assertEqual(LED_Main.settings, Settings())
+
+    def testAlarm(self):
+        self.assertTrue(LED_Main.commandChangeAlarm("6:30", "7:00")[0])
+        self.assertEqual((LED_Main.settings.alarm_start, LED_Main.settings.alarm_end), ("06:30", "07:00"))
+        self.assertFalse(LED_Main.commandChangeAlarm("7:00", "07:00")[0])
+        self.assertFalse(LED_Main.commandChangeAlarm("25:00", "07:00")[0])
+        self.assertFalse(LED_Main.commandChangeAlarm("", "07:00")[0])
+        self.assertEqual((LED_Main.settings.alarm_start, LED_Main.settings.alarm_end), ("06:30", "07:00"))
+
+class TestConfig(MainTest):
+    def setUp(self):
+        super().setUp()
+        self.folder = tempfile.TemporaryDirectory()
+        self.saved_name = LED_Main.config_file_name
+        LED_Main.config_file_name = os.path.join(self.folder.name, "LED_Main.ini")
+
+    def tearDown(self):
+        LED_Main.config_file_name = self.saved_name
+        self.folder.cleanup()
+        super().tearDown()
+
+    def rewrite(self, old, new):
+        with open(LED_Main.config_file_name) as config_file:
+            text = config_file.read()
+        self.assertIn(old, text)
+        with open(LED_Main.config_file_name, "w") as config_file:
+            config_file.write(text.replace(old, new))
+
+    def testDefaultsRoundTrip(self):
+        #the defaults have flux above brightness and no alarm, they load back as saved
+        self.assertTrue(LED_Main.saveConfig())
+        LED_Main.settings = Settings(duration=30)
+        self.assertTrue(LED_Main.loadConfig())
+        self.assertEqual(LED_Main.settings, Settings())
+
+        #a hot reload of the file as saved changes nothing
+        LED_Main.reloadConfig()
+        self.assertEqual(LED_Main.settings, Settings())
+
+    def testReloadSkipsOnlyTheBadKey(self):
+        self.assertTrue(LED_Main.saveConfig())
+        self.rewrite("brightness = 5", "brightness = 40")
+        self.rewrite("flux = 10", "flux = lots")
+        LED_Main.reloadConfig()
+        self.assertEqual((LED_Main.settings.brightness, LED_Main.settings.flux), (40, 10))
+
+        #a brightness that only fits with the flux after it is still taken
+        self.rewrite("brightness = 40", "brightness = 250")
+        self.rewrite("flux = lots", "flux = 0")
+        self.assertTrue(LED_Main.loadConfig())
+        self.assertEqual((LED_Main.settings.brightness, LED_Main.settings.flux), (250, 0))
+
+    def testAlarmTimes(self):
+        LED_Main.settings = Settings(alarm_start="06:30", alarm_end="07:00")
+        self.assertTrue(LED_Main.saveConfig())
+        LED_Main.settings = Settings()
+        self.assertTrue(LED_Main.loadConfig())
+        self.assertEqual((LED_Main.settings.alarm_start, LED_Main.settings.alarm_end), ("06:30", "07:00"))
+
+        #a time that is not one is skipped, the end is still emptied
+        self.rewrite("alarm_time = 06:30", "alarm_time = 25:00")
+        self.rewrite("alarm_time = 07:00", "alarm_time =")
+        ok, message = LED_Main.commandLoad()
+        self.assertFalse(ok)
+        self.assertIn("skipped", message)
+        self.assertEqual((LED_Main.settings.alarm_start, LED_Main.settings.alarm_end), ("06:30", ""))
+
+class TestCheckpoint(MainTest):
+    def testResumeWithChangedLight(self):
+        #killed 10 seconds into a light changed to 30 seconds, restarted 2 seconds later
+        #with the config's 600, the run carries on with the 18 seconds it had left
+        with tempfile.TemporaryDirectory() as folder:
+            checkpoint = CheckpointFile(os.path.join(folder, "LED_Main.state"))
+
+            async def played():
+                LED_Main.commandStartLight()
+                self.assertTrue(LED_Main.commandChangeLight("30")[0])
+                await asyncio.sleep(10)
+                checkpoint.write(LED_Main.playbackState())
+            self.runLoop(played())
+            checkpoint.close()
+            self.runLoop(self.stopAll())
+            LED_Main.settings = Settings()
+            state = readCheckpoint(checkpoint.path)
+
+        async def resumed():
+            await asyncio.sleep(2)
+            LED_Main.resumePlayback(state)
+            rainbow = LED_Main.layers.get("light")
+            self.assertEqual(LED_Main.settings.duration, 30)
+            self.assertEqual(rainbow.offset + rainbow.length, LED_Main.frameCount(30, LED_Main.sleep_delay))
+            await asyncio.sleep(17.5)
+            playing = LED_Main.light_state
+            await asyncio.sleep(1)
+            return playing
+        self.assertTrue(self.runLoop(resumed()))
+        self.assertFalse(LED_Main.light_state)
+
+    def testInvalidSettingsNotResumed(self):
+        LED_Main.resumePlayback(PlaybackState(LED_Main.wallTime(), (10, 0.0, 0, 1, 5, 10)))
+        self.assertFalse(LED_Main.light_state)
+        self.assertIsNone(LED_Main.layers.get("light"))
+        self.assertEqual(LED_Main.settings, Settings())
+
+if __name__ == "__main__":
+    unittest.main()
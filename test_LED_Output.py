@@ -0,0 +1,197 @@
+#test_LED_Output
+#
+#The E1.31 and Art-Net backends sending frames to a UDP listener on
+#localhost, checking the packets byte for byte against the wire formats, and
+#the script backend storing and starting its scripts in the fake pigpiod of
+#LED_FakePigpio on the daemon's clock.
+#
+#usage: python3 -m pytest test_LED_Output.py, or python3 test_LED_Output.py
+
+import asyncio
+import socket
+import struct
+import unittest
+
+import LED_FakePigpio
+from LED_Output import E131Backend, ArtNetBackend, ScriptBackend, E131_IDENTIFIER, UNIVERSE_SLOTS
+
+class FailingSocket:
+    #stands in for a socket while the network is down
+    def sendto(self, data, address):
+        raise OSError(101, "Network is unreachable")
+
+    def close(self):
+        pass
+
+class TestNetworkOutput(unittest.TestCase):
+    def setUp(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.settimeout(2.0)
+        self.port = self.listener.getsockname()[1]
+
+    def tearDown(self):
+        self.listener.close()
+
+    def receive(self):
+        return self.listener.recvfrom(1024)[0]
+
+    def checkE131(self, packet, backend, universe, sequence, values):
+        count = len(values)
+        self.assertEqual(len(packet), 126 + count)
+        #root layer, from its flags and length on
+        preamble, postamble, identifier = struct.unpack_from("!HH12s", packet, 0)
+        self.assertEqual((preamble, postamble, identifier), (0x0010, 0x0000, E131_IDENTIFIER))
+        root_length, root_vector, cid = struct.unpack_from("!HI16s", packet, 16)
+        self.assertEqual(root_length, 0x7000 | (len(packet) - 16))
+        self.assertEqual(root_vector, 0x00000004)
+        self.assertEqual(cid, backend.cid)
+        #framing layer
+        framing_length, framing_vector, name, priority, sync, seq, options, packet_universe = \
+            struct.unpack_from("!HI64sBHBBH", packet, 38)
+        self.assertEqual(framing_length, 0x7000 | (len(packet) - 38))
+        self.assertEqual(framing_vector, 0x00000002)
+        self.assertEqual(name.rstrip(b"\0"), b"LED_Main")
+        self.assertEqual((priority, sync, seq, options), (100, 0, sequence, 0))
+        self.assertEqual(packet_universe, universe)
+        #DMP layer, the property values are the start code then the channels
+        dmp_length, dmp_vector, address_type, first, increment, property_count, start_code = \
+            struct.unpack_from("!HBBHHHB", packet, 115)
+        self.assertEqual(dmp_length, 0x7000 | (len(packet) - 115))
+        self.assertEqual((dmp_vector, address_type, first, increment), (0x02, 0xa1, 0x0000, 0x0001))
+        self.assertEqual(property_count, count + 1)
+        self.assertEqual(start_code, 0)
+        self.assertEqual(packet[126:], bytes(values))
+
+    def testE131Packet(self):
+        backend = E131Backend("127.0.0.1", self.port)
+        try:
+            self.assertEqual(backend.writeFrame([(0, 10), (1, 20), (2, 30)]), 3)
+            self.checkE131(self.receive(), backend, 1, 1, [10, 20, 30])
+            #only the changed channel is new, the universe goes out whole with the next sequence
+            backend.writeFrame([(0, 10), (1, 20), (2, 40)])
+            self.checkE131(self.receive(), backend, 1, 2, [10, 20, 40])
+        finally:
+            backend.close()
+
+    def testE131Universes(self):
+        #channels past the first 512 are in the next universe, each with its own sequence
+        backend = E131Backend("127.0.0.1", self.port)
+        try:
+            backend.writeFrame([(5, 1), (UNIVERSE_SLOTS + 1, 2)])
+            first = self.receive()
+            second = self.receive()
+            self.checkE131(first, backend, 1, 1, [0, 0, 0, 0, 0, 1])
+            self.checkE131(second, backend, 2, 1, [0, 2])
+        finally:
+            backend.close()
+
+    def testArtNetPacket(self):
+        backend = ArtNetBackend("127.0.0.1", self.port, first_universe=3)
+        try:
+            backend.writeFrame([(0, 10), (1, 20), (2, 30)])
+            packet = self.receive()
+            identifier, opcode, version, sequence, physical, universe, length = \
+                struct.unpack_from("<8sH2sBBH2s", packet, 0)
+            self.assertEqual(identifier, b"Art-Net\0")
+            self.assertEqual(opcode, 0x5000)
+            self.assertEqual(version, b"\x00\x0e")
+            self.assertEqual((sequence, physical, universe), (1, 0, 3))
+            #an odd channel count is padded to an even one, the length is big endian
+            self.assertEqual(struct.unpack("!H", length)[0], 4)
+            self.assertEqual(packet[18:], bytes([10, 20, 30, 0]))
+
+            backend.writeFrame([(0, 10), (1, 20), (2, 30), (3, 40)])
+            packet = self.receive()
+            self.assertEqual(packet[12], 2)
+            self.assertEqual(struct.unpack_from("!H", packet, 16)[0], 4)
+            self.assertEqual(packet[18:], bytes([10, 20, 30, 40]))
+        finally:
+            backend.close()
+
+    def testSendErrorsCounted(self):
+        #a network that is down is counted, not raised into the render loop
+        backend = E131Backend("127.0.0.1", self.port)
+        backend.sock.close()
+        backend.sock = FailingSocket()
+        self.assertEqual(backend.writeFrame([(0, 10), (UNIVERSE_SLOTS, 20)]), 2)
+        self.assertEqual(backend.send_errors, 2)
+        self.assertEqual(backend.packets, 0)
+
+class TestScriptBackend(unittest.TestCase):
+    def setUp(self):
+        #the daemon's clock only moves when the test moves it
+        self.now = 100.0
+        self.fake = LED_FakePigpio.pi()
+        self.fake.daemon.clock = self.clock
+        self.fake.daemon.log = []
+        self.backend = ScriptBackend(self.fake)
+
+    def clock(self):
+        return self.now
+
+    def queue(self, frames, start):
+        return self.backend.queue((4, 5, 6), frames, start, 0.1, self.clock)
+
+    def testUpload(self):
+        count = asyncio.run(self.queue([(10, 0, 0), (10, 20, 0), (10, 20, 30)], 100.5))
+        self.assertEqual(count, 3)
+        self.assertTrue(self.backend.playing())
+        self.assertEqual(len(self.fake.daemon.scripts), 1)
+        self.assertEqual(self.backend.last, {4: 10, 5: 20, 6: 30})
+
+        #nothing is written before the start, then only the channels that change, 100ms apart
+        self.fake.get_current_tick()
+        self.assertEqual(self.fake.daemon.log, [])
+        self.now = 101.0
+        self.fake.get_current_tick()
+        start = 100500000
+        self.assertEqual(self.fake.daemon.log, [(start, 4, 10), (start, 5, 0), (start, 6, 0),
+                                                (start + 100000, 5, 20), (start + 200000, 6, 30)])
+
+        self.backend.cancel()
+        self.assertFalse(self.backend.playing())
+        self.assertEqual(self.fake.daemon.scripts, {})
+
+    def testWaitDoesNotBlock(self):
+        #pigpiod readies the script for a while, other tasks run until it is ready
+        store = self.fake.daemon.storeScript
+
+        def storeIniting(text):
+            script_id = store(text)
+            self.fake.daemon.scripts[script_id].status = LED_FakePigpio.PI_SCRIPT_INITING
+            return script_id
+        self.fake.daemon.storeScript = storeIniting
+
+        async def scenario():
+            ticks = []
+
+            async def ticker():
+                while True:
+                    ticks.append(len(ticks))
+                    if len(ticks) == 5:
+                        for script in self.fake.daemon.scripts.values():
+                            script.status = LED_FakePigpio.PI_SCRIPT_HALTED
+                    await asyncio.sleep(0.001)
+
+            task = asyncio.ensure_future(ticker())
+            count = await self.queue([(1, 2, 3)], 100.5)
+            task.cancel()
+            return count, len(ticks)
+
+        count, ticks = asyncio.run(scenario())
+        self.assertEqual(count, 1)
+        self.assertGreaterEqual(ticks, 5)
+        script = list(self.fake.daemon.scripts.values())[0]
+        self.assertEqual(script.status, LED_FakePigpio.PI_SCRIPT_RUNNING)
+
+    def testStoreError(self):
+        #a script pigpiod will not take is raised, nothing is counted as written
+        self.fake.daemon.storeScript = lambda text: LED_FakePigpio.PI_BAD_SCRIPT
+        with self.assertRaises(LED_FakePigpio.error):
+            asyncio.run(self.queue([(1, 2, 3)], 100.5))
+        self.assertFalse(self.backend.playing())
+        self.assertEqual(self.backend.last, {})
+
+if __name__ == "__main__":
+    unittest.main()
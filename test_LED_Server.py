@@ -0,0 +1,98 @@
+#test_LED_Server
+#
+#The control server started on a localhost port or a unix socket, with
+#clients sending JSON lines over a real connection and reading the replies.
+#
+#usage: python3 -m pytest test_LED_Server.py, or python3 test_LED_Server.py
+
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+
+import LED_Server
+from LED_Server import ControlServer
+
+class TestControlServer(unittest.TestCase):
+    def setUp(self):
+        self.brightness = 5
+        self.server = ControlServer({
+            ("change", "brightness"): self.changeBrightness,
+            ("overview", ""): self.overview,
+        })
+
+    def changeBrightness(self, value):
+        if not value.isdigit():
+            return False, "Invalid brightness"
+        self.brightness = int(value)
+        return True, "Light's brightness changed to: " + value
+
+    def overview(self):
+        return True, "Brightness: " + str(self.brightness), {"brightness": self.brightness}
+
+    async def talk(self, lines, listen="127.0.0.1:0"):
+        #sends lines on one connection and reads a reply line for each of them
+        server = await self.server.start(listen)
+        try:
+            if listen.endswith(":0"):
+                reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+            else:
+                reader, writer = await asyncio.open_unix_connection(listen)
+            replies = []
+            for line in lines:
+                writer.write(line)
+                await writer.drain()
+                reply = await reader.readline()
+                if not reply:
+                    break
+                replies.append(json.loads(reply.decode("utf-8")))
+            clients = self.server.clients
+            writer.close()
+            return replies, clients
+        finally:
+            self.server.close()
+
+    def request(self, **request):
+        return json.dumps(request).encode("utf-8") + b"\n"
+
+    def testCommands(self):
+        replies, clients = asyncio.run(self.talk([
+            self.request(id=1, command="change", option="brightness", values=["20"]),
+            self.request(id="two", command="overview"),
+        ]))
+        self.assertEqual(clients, 1)
+        self.assertEqual(replies[0], {"id": 1, "ok": True, "message": "Light's brightness changed to: 20"})
+        self.assertEqual(replies[1], {"id": "two", "ok": True, "message": "Brightness: 20", "data": {"brightness": 20}})
+
+    def testInvalidRequests(self):
+        #every bad request is answered and the connection stays open for the next one
+        replies, _ = asyncio.run(self.talk([
+            b"not json\n",
+            b"[1, 2]\n",
+            self.request(id=3, command="start", option="light"),
+            self.request(id=4, command="change", option="brightness", values=["1", "2"]),
+            self.request(id=5, command="change", option="brightness", values="dim"),
+            b"\n" + self.request(id=6, command="overview"),
+        ]))
+        self.assertEqual([reply["ok"] for reply in replies], [False, False, False, False, False, True])
+        self.assertEqual(replies[0]["message"], "Invalid request, expected a JSON object")
+        self.assertEqual(replies[1]["message"], "Invalid request, expected a JSON object")
+        self.assertEqual(replies[2]["id"], 3)
+        self.assertEqual(replies[2]["message"], "Invalid command, valid commands are change brightness, overview")
+        self.assertEqual(replies[3]["message"], "Invalid number of values for change brightness")
+        self.assertEqual(replies[4]["message"], "Invalid brightness")
+        self.assertEqual(self.brightness, 5)
+
+    def testRequestTooLong(self):
+        replies, _ = asyncio.run(self.talk([b"{" + b" " * (LED_Server.max_request + 1) + b"}\n"]))
+        self.assertEqual(replies, [{"ok": False, "message": "Request too long"}])
+
+    def testUnixSocket(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "LED_Main.sock")
+            replies, _ = asyncio.run(self.talk([self.request(command="overview")], path))
+        self.assertEqual(replies, [{"ok": True, "message": "Brightness: 5", "data": {"brightness": 5}}])
+
+if __name__ == "__main__":
+    unittest.main()
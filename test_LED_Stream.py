@@ -0,0 +1,135 @@
+#test_LED_Stream
+#
+#The frame stream started on a localhost port with asyncio clients: the
+#preview page, the events of each frame published, and a viewer that stops
+#reading losing its oldest frames while publish carries on.
+#
+#usage: python3 -m pytest test_LED_Stream.py, or python3 test_LED_Stream.py
+
+import asyncio
+import json
+import unittest
+
+import LED_Stream
+from LED_Metrics import Counter, Gauge
+from LED_Stream import FrameStream
+
+class TestFrameStream(unittest.TestCase):
+    def setUp(self):
+        self.stream = FrameStream()
+        self.stream.clients_gauge = Gauge("test_stream_clients", "viewers")
+        self.stream.dropped_counter = Counter("test_stream_dropped", "dropped")
+        self.joined = 0
+        self.stream.changed = self.join
+
+    def join(self):
+        self.joined += 1
+
+    async def connect(self, path):
+        server = await self.stream.start("127.0.0.1:0")
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+        writer.write(b"GET " + path + b" HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        await writer.drain()
+        return reader, writer
+
+    async def readHeaders(self, reader):
+        status = await reader.readline()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b""):
+                return status, headers
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+    async def readEvent(self, reader):
+        line = await reader.readline()
+        self.assertTrue(line.startswith(b"data: "))
+        self.assertEqual(await reader.readline(), b"\n")
+        return json.loads(line[len(b"data: "):].decode("utf-8"))
+
+    async def waitFor(self, condition):
+        for _ in range(1000):
+            if condition():
+                return
+            await asyncio.sleep(0.001)
+        self.fail("timed out")
+
+    def testPreviewPage(self):
+        async def scenario():
+            reader, writer = await self.connect(b"/")
+            status, headers = await self.readHeaders(reader)
+            body = await reader.read()
+            writer.close()
+            reader, writer = await self.connect(b"/other")
+            missing = await reader.readline()
+            writer.close()
+            self.stream.close()
+            return status, headers, body, missing
+
+        status, headers, body, missing = asyncio.run(scenario())
+        self.assertEqual(status, b"HTTP/1.0 200 OK\r\n")
+        self.assertEqual(headers["content-type"], "text/html; charset=utf-8")
+        self.assertEqual(int(headers["content-length"]), len(LED_Stream.PREVIEW_PAGE))
+        self.assertEqual(body, LED_Stream.PREVIEW_PAGE)
+        self.assertEqual(missing, b"HTTP/1.0 404 Not Found\r\n")
+
+    def testEvents(self):
+        async def scenario():
+            #a new viewer is sent the last frame first
+            self.stream.publish(1, (20, 21, 16), (1, 2, 3))
+            reader, writer = await self.connect(b"/events?from=preview")
+            status, headers = await self.readHeaders(reader)
+            events = [await self.readEvent(reader)]
+            self.stream.publish(2, (20, 21, 16), (4, 5, 6))
+            events.append(await self.readEvent(reader))
+            clients = self.stream.clients_gauge.value
+            self.stream.close()
+            ended = await reader.read()
+            writer.close()
+            return status, headers, events, clients, ended
+
+        status, headers, events, clients, ended = asyncio.run(scenario())
+        self.assertEqual(status, b"HTTP/1.1 200 OK\r\n")
+        self.assertEqual(headers["content-type"], "text/event-stream")
+        self.assertEqual(events, [{"tick": 1, "pins": [20, 21, 16], "values": [1, 2, 3]},
+                                  {"tick": 2, "pins": [20, 21, 16], "values": [4, 5, 6]}])
+        self.assertEqual(clients, 1)
+        self.assertEqual(self.joined, 1)
+        self.assertEqual(ended, b"")
+
+    def testSlowViewerDropsOldest(self):
+        #a viewer that stops reading fills its socket, publish still returns at once and
+        #only the newest frames wait in its buffer
+        pins = tuple(range(1536))
+        published = 2000
+
+        async def scenario():
+            reader, writer = await self.connect(b"/events")
+            await self.readHeaders(reader)
+            await self.waitFor(lambda: self.stream.clients)
+            client = next(iter(self.stream.clients))
+            for tick in range(published):
+                self.stream.publish(tick, pins, (tick % 256,) * len(pins))
+                self.assertLessEqual(len(client.buffer), LED_Stream.client_buffer)
+                #the viewer's task gets to write between frames, as it would between renders
+                await asyncio.sleep(0)
+            dropped = client.dropped
+
+            #reading again, the frames come in order and end with the newest
+            ticks = []
+            while not ticks or ticks[-1] != published - 1:
+                ticks.append((await self.readEvent(reader))["tick"])
+            self.stream.close()
+            writer.close()
+            return dropped, ticks
+
+        dropped, ticks = asyncio.run(scenario())
+        self.assertGreater(dropped, 0)
+        self.assertEqual(self.stream.dropped_counter.value, dropped)
+        self.assertEqual(ticks, sorted(ticks))
+        #every frame was either read or dropped
+        self.assertEqual(len(ticks) + dropped, published)
+
+if __name__ == "__main__":
+    unittest.main()